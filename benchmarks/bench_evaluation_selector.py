@@ -0,0 +1,221 @@
+# benchmarks/bench_evaluation_selector.py
+"""Compare the evaluation pair selectors at different corpus sizes.
+
+Variants:
+    pandas  - the former DataFrame merge from evaluations.evaluate()
+    sql     - memeqa.selector.available_pairs (single NOT EXISTS anti-join)
+    queue   - memeqa.evaluation_queue.pick_pair (the first call builds the queue)
+
+Every (variant, size) pair runs in a fresh interpreter so that import time
+and peak RSS are those a new gunicorn worker would see. pandas is only
+needed to run the pandas variant.
+
+Usage:
+    python benchmarks/bench_evaluation_selector.py [--sizes 1000 10000 100000] [--repeat 5]
+
+Output of `--sizes 1000 10000 100000 --repeat 5` (one run, pasted as printed):
+
+    # Linux-6.18.44-fc-v130-x86_64-with-glibc2.36, x86_64, 1 CPU(s), Python 3.11.7, SQLite 3.40.1, pandas 2.3.3, --repeat 5
+       memes  variant  import ms   first ms  median ms   RSS MB    pairs
+        1000   pandas      495.0      17.54      16.55    112.0     1735
+        1000      sql      160.0      12.92       4.89     35.0     1735
+        1000    queue      153.9      11.59       0.62     35.0        -
+       10000   pandas      502.9     203.87     200.83    129.5    19661
+       10000      sql      197.4     108.43      82.26     47.0    19661
+       10000    queue      175.3     112.40       0.77     39.8        -
+      100000   pandas      394.3    1775.81    1815.14    275.2   199344
+      100000      sql      146.4     886.69     994.94    140.6   199344
+      100000    queue      133.7    1826.75       0.45     74.8        -
+
+The queue's first pick builds the actor's queue, once per user or session;
+later picks are an index seek plus the commit of the actor's position.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAX_DESCRIPTIONS = 4
+USER_ID = 1
+
+
+def build_database(path, n_memes, seed=42):
+    """Create a synthetic database with n_memes memes, descriptions and evaluations"""
+    from memeqa.migrations import migrate
+
+    rnd = random.Random(seed)
+    n_users = max(10, n_memes // 100)
+    db = sqlite3.connect(path)
+    migrate(db)
+
+    db.executemany(
+        'INSERT INTO users (id, name, email, country, languages, birth_year) VALUES (?, ?, ?, ?, ?, ?)',
+        [(u, f'user{u}', f'user{u}@example.org', 'Germany', 'English', 1990) for u in range(1, n_users + 1)]
+    )
+    db.executemany('''
+        INSERT INTO memes (id, filename, original_filename, contributor_country, platform_found,
+                           session_id, user_id, languages, humor_type, emotions_conveyed, context_level)
+        VALUES (?, ?, ?, 'Germany', 'Reddit', ?, ?, '[]', '[]', '[]', 'None')
+    ''', [(m, f'{m}.jpg', f'{m}.jpg', f'session{u}', u)
+          for m, u in ((m, rnd.randint(1, n_users)) for m in range(1, n_memes + 1))])
+
+    descriptions = []
+    for meme_id in range(1, n_memes + 1):
+        for _ in range(rnd.randint(0, MAX_DESCRIPTIONS)):
+            u = rnd.randint(1, n_users)
+            descriptions.append((meme_id, 'description', u, f'session{u}'))
+    db.executemany(
+        'INSERT INTO meme_descriptions (meme_id, description, user_id, session_id) VALUES (?, ?, ?, ?)',
+        descriptions
+    )
+
+    # The benchmarked user has evaluated roughly a tenth of the corpus
+    evaluated = rnd.sample(range(1, n_memes + 1), n_memes // 10)
+    db.executemany('''
+        INSERT OR IGNORE INTO evaluations (session_id, user_id, meme_id, evaluated_context_level)
+        VALUES (?, ?, ?, 'None')
+    ''', [(f'session{USER_ID}', USER_ID, m) for m in evaluated])
+    db.execute('''
+        INSERT OR IGNORE INTO description_evaluations (description_id, meme_id, user_id, session_id, vote)
+        SELECT md.id, md.meme_id, e.user_id, e.session_id, 1
+        FROM evaluations e
+        JOIN meme_descriptions md ON md.meme_id = e.meme_id
+        WHERE e.user_id = ?
+    ''', (USER_ID,))
+    db.commit()
+    db.close()
+
+
+def legacy_pandas_pairs(db, user_id):
+    """The DataFrame merge evaluate() used before the selector existed"""
+    import pandas as pd
+
+    memes_desc_table = db.execute("""
+        SELECT
+            m.id AS meme_id,
+            COALESCE(md_other.id, -1) AS description_id,
+            (SELECT COUNT(*) FROM meme_descriptions md_all WHERE md_all.meme_id = m.id) AS total_descriptions,
+            CASE WHEN EXISTS (
+                SELECT 1 FROM meme_descriptions md_user
+                WHERE md_user.meme_id = m.id AND md_user.user_id = ?
+            ) THEN 1 ELSE 0 END AS has_user_description
+        FROM memes m
+        LEFT JOIN meme_descriptions md_other
+            ON m.id = md_other.meme_id AND md_other.user_id != ?
+        WHERE m.user_id != ?
+    """, (user_id, user_id, user_id)).fetchall()
+    evaluated_rows = db.execute("""
+        SELECT e.meme_id, COALESCE(de.description_id, -1) AS evaluated_description_id
+        FROM evaluations e
+        LEFT JOIN description_evaluations de
+            ON e.meme_id = de.meme_id AND de.user_id = e.user_id
+        WHERE e.user_id = ?
+    """, (user_id,)).fetchall()
+
+    memes_df = pd.DataFrame([dict(row) for row in memes_desc_table])
+    if evaluated_rows:
+        evaluated_df = pd.DataFrame([dict(row) for row in evaluated_rows])
+    else:
+        evaluated_df = pd.DataFrame(columns=['meme_id', 'evaluated_description_id'])
+
+    merged_df = memes_df.merge(
+        evaluated_df,
+        left_on=['meme_id', 'description_id'],
+        right_on=['meme_id', 'evaluated_description_id'],
+        how='left',
+        suffixes=('_possible', '_evaluated')
+    )
+    available_df = merged_df[
+        (merged_df['evaluated_description_id'].isna()) |
+        ((merged_df['description_id'] == -1) & (merged_df['has_user_description'] == 0)
+         & (merged_df['total_descriptions'] < MAX_DESCRIPTIONS))
+    ]
+    return set(zip(available_df['meme_id'], available_df['description_id']))
+
+
+def run_variant(variant, db_path, repeat):
+    """Time one variant in this interpreter and print a JSON result line"""
+    started = time.perf_counter()
+    if variant == 'pandas':
+        import pandas  # noqa: F401
+        select = lambda db: legacy_pandas_pairs(db, USER_ID)
+    elif variant == 'sql':
+        from memeqa.selector import available_pairs
+        select = lambda db: available_pairs(db, USER_ID, None, MAX_DESCRIPTIONS)
+    else:
+        from flask import Flask
+        from memeqa import evaluation_queue
+        app = Flask(__name__)
+        app.config['MAX_DESCRIPTIONS_PER_MEME'] = MAX_DESCRIPTIONS
+        app.app_context().push()
+        select = lambda db: evaluation_queue.pick_pair(db, USER_ID, None)
+    import_ms = (time.perf_counter() - started) * 1000
+
+    db = sqlite3.connect(db_path)
+    db.row_factory = sqlite3.Row
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = select(db)
+        timings.append((time.perf_counter() - started) * 1000)
+    db.rollback()
+
+    print(json.dumps({
+        'import_ms': import_ms,
+        'first_ms': timings[0],
+        'median_ms': statistics.median(timings),
+        'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'pairs': len(result) if isinstance(result, set) else None,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--variants', nargs='+', default=['pandas', 'sql', 'queue'])
+    parser.add_argument('--run', nargs=2, metavar=('VARIANT', 'DB'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_variant(args.run[0], args.run[1], args.repeat)
+        return
+
+    try:
+        from importlib.metadata import version
+        pandas_version = version('pandas')
+    except ImportError:
+        pandas_version = 'not installed'
+    print(f'# {platform.platform()}, {platform.processor() or platform.machine()}, {os.cpu_count()} CPU(s), '
+          f'Python {platform.python_version()}, SQLite {sqlite3.sqlite_version}, pandas {pandas_version}, '
+          f'--repeat {args.repeat}')
+    print(f"{'memes':>8} {'variant':>8} {'import ms':>10} {'first ms':>10} {'median ms':>10} {'RSS MB':>8} {'pairs':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            db_path = os.path.join(tmp, f'bench_{size}.db')
+            build_database(db_path, size)
+            for variant in args.variants:
+                output = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), '--repeat', str(args.repeat),
+                     '--run', variant, db_path],
+                    cwd=ROOT, capture_output=True, text=True, check=True
+                ).stdout
+                r = json.loads(output.strip().splitlines()[-1])
+                pairs = r['pairs'] if r['pairs'] is not None else '-'
+                print(f"{size:>8} {variant:>8} {r['import_ms']:>10.1f} {r['first_ms']:>10.2f} "
+                      f"{r['median_ms']:>10.2f} {r['rss_mb']:>8.1f} {pairs:>8}")
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, ROOT)
+    main()
@@ -6,11 +6,84 @@ load_dotenv()
 class Config:
     """Configuration settings"""
     SECRET_KEY = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
+    # Previous keys, comma separated: still accepted for sessions and login links after a rotation
+    SECRET_KEY_FALLBACKS = [key for key in os.environ.get('SECRET_KEY_FALLBACKS', '').split(',') if key]
+    LOGIN_TOKEN_MAX_AGE = 24 * 60 * 60  # seconds a login link stays valid
+    LOGIN_TOKEN_REPLAY_CACHE_SIZE = 100000  # used login links remembered per worker (memeqa/login_tokens.py)
     GMAIL_USER = os.environ.get('GMAIL_USER')
     GMAIL_APP_PASSWORD = os.environ.get('GMAIL_APP_PASSWORD')
+    # Email is queued in email_outbox and sent by a background job (memeqa/mailer.py)
+    MAIL_SMTP_HOST = os.environ.get('MAIL_SMTP_HOST', 'smtp.gmail.com')
+    MAIL_SMTP_PORT = int(os.environ.get('MAIL_SMTP_PORT', '587'))
+    MAIL_SMTP_STARTTLS = os.environ.get('MAIL_SMTP_STARTTLS', '1') == '1'
+    MAIL_SMTP_TIMEOUT = 10  # seconds
+    MAIL_SMTP_IDLE_SECONDS = 60  # an SMTP session idle for longer is reopened
+    MAIL_USERNAME = os.environ.get('MAIL_USERNAME', GMAIL_USER)
+    MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD', GMAIL_APP_PASSWORD)
+    MAIL_SENDER = os.environ.get('MAIL_SENDER')  # defaults to MAIL_USERNAME
+    MAIL_BATCH_SIZE = 50  # messages sent per claimed batch
+    MAIL_MAX_ATTEMPTS = 6
+    MAIL_RETRY_BASE_SECONDS = 60  # doubled after every failed attempt
+    MAIL_RETRY_MAX_SECONDS = 3600
     UPLOAD_FOLDER = 'uploads'
+    # New uploads go to ab/cd/<name> below UPLOAD_FOLDER, one level per two hex
+    # digits of the content hash; 0 keeps them flat. `flask shard-uploads` moves old ones.
+    UPLOAD_SHARD_LEVELS = 2
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
+    # Uploaded images are served as immutable (memeqa.utils.send_upload)
+    UPLOAD_CACHE_MAX_AGE = 365 * 24 * 3600
+    # Let the front-end server send the bytes: '' (Flask sends them), 'x-sendfile' or 'x-accel-redirect'
+    UPLOAD_OFFLOAD = os.environ.get('UPLOAD_OFFLOAD', '')
+    # nginx internal location aliased to UPLOAD_FOLDER, used with 'x-accel-redirect'
+    UPLOAD_ACCEL_PREFIX = os.environ.get('UPLOAD_ACCEL_PREFIX', '/protected-uploads/')
+    # Where uploads are kept (memeqa/storage.py): 'filesystem' (UPLOAD_FOLDER) or 's3',
+    # in which case UPLOAD_FOLDER is a local read-through cache of the bucket
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'filesystem')
+    S3_BUCKET = os.environ.get('S3_BUCKET')
+    S3_PREFIX = os.environ.get('S3_PREFIX', '')
+    # e.g. http://localhost:9000 for MinIO; unset for AWS
+    S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')
+    S3_REGION = os.environ.get('S3_REGION')
+    S3_ACCESS_KEY_ID = os.environ.get('S3_ACCESS_KEY_ID')
+    S3_SECRET_ACCESS_KEY = os.environ.get('S3_SECRET_ACCESS_KEY')
+    # Lifetime of the presigned URLs images are redirected to; 0 serves them through Flask
+    S3_PRESIGN_EXPIRES = int(os.environ.get('S3_PRESIGN_EXPIRES', 3600))
+    S3_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+    S3_MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+    S3_MAX_CONCURRENCY = 4
+    # Resized copies written next to each upload (memeqa/images.py); widths in px
+    IMAGE_DERIVATIVE_SIZES = (256, 512, 1024)
+    # Tried in this order when serving; 'avif' needs a Pillow build with AVIF support
+    IMAGE_DERIVATIVE_FORMATS = ('webp',)
+    IMAGE_DERIVATIVE_QUALITY = 80
+    # Uploads whose dHash differs from an existing meme's in at most this many
+    # of 64 bits are flagged as near duplicates (memeqa/fingerprints.py)
+    NEAR_DUPLICATE_DISTANCE = 6
+
+    # Background jobs (memeqa/jobs.py). Worker threads per app process; set
+    # JOB_WORKERS=0 and run `flask run-jobs` to process them elsewhere
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+    JOB_POLL_INTERVAL = 5  # seconds an idle worker waits before looking again
+    JOB_LEASE_SECONDS = 600  # a job running longer is assumed lost and requeued
+    JOB_MAX_ATTEMPTS = 5
+    JOB_RETRY_BASE_SECONDS = 30  # doubled after every failed attempt
+    JOB_RETRY_MAX_SECONDS = 3600
+    JOB_RETENTION_SECONDS = 7 * 24 * 60 * 60  # done and failed jobs are deleted after this long
+    # meme_analytics is updated by a job folding logged evaluation changes
+    # (memeqa/meme_stats.py); waiting a little lets one run fold a burst
+    MEME_STATS_FOLD_DELAY = 10
+    MEME_STATS_BATCH_SIZE = 500
+    # An evaluation is correct when it shares a humor type with the uploader and
+    # its emotions overlap the uploader's by at least this Jaccard index (memeqa/scoring.py)
+    SCORING_EMOTION_THRESHOLD = 0.5
+    # A meme's agreement is refreshed by one queued job per meme, this many
+    # seconds after the evaluation that queued it
+    SCORING_AGREEMENT_DELAY = 10
+    # Rows read per keyset page by /export_data and `flask export-data`
+    EXPORT_PAGE_SIZE = 1000
+    # Images per tar shard of a `flask build-release` bundle (memeqa/release.py)
+    RELEASE_IMAGES_PER_SHARD = 1000
     # Generate file extension accept string
     ACCEPT_FILE_TYPES = '.' + ',.'.join(ALLOWED_EXTENSIONS)
 
@@ -25,6 +98,7 @@ class Config:
     PROMPT_EVAL_EVERY = 10  # should_prompt_upload
     PROMPT_UPLOAD_EVERY = 5  # should_prompt_evaluate
     MAX_DESCRIPTIONS_PER_MEME = 4
+    GALLERY_TOTAL_TTL = 60  # seconds a gallery total is reused between page views
     
     # Environment detection - make sure these are uppercase
     ENV = os.environ.get('ENV', 'production')
@@ -33,6 +107,17 @@ class Config:
 
     # Database configuration
     DATABASE_PATH = 'memes.db'
+    # Apply pending migrations when the app starts; disable to run `flask migrate-db` ahead of deploys
+    AUTO_MIGRATE = os.environ.get('AUTO_MIGRATE', '1') == '1'
+    # Applied once to every pooled connection (see memeqa/database.py)
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -32000,  # negative = KiB, ~32MB page cache
+        'mmap_size': 268435456,  # 256MB
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,  # ms to wait on a locked database
+    }
 
     EMOTIONS_TYPES = [
     {
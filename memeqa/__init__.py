@@ -1,5 +1,5 @@
 # memeqa/__init__.py
-from flask import Flask,render_template
+from flask import Flask,render_template,g
 import os
 from datetime import datetime
 from config import Config  # Your existing config.py
@@ -10,13 +10,44 @@ def create_app():
     app = Flask(__name__)
     
     app.config.from_object(Config)
+
+    # Stream uploads straight into the upload folder
+    from memeqa.ingest import IngestRequest, cleanup_partial_uploads
+    app.request_class = IngestRequest
+    app.teardown_request(cleanup_partial_uploads)
     
     # Initialize database
     from memeqa.database import init_db, close_db
+    from memeqa.migrations import migrate_db_command
+    from memeqa.query_audit import audit_queries_command
+    from memeqa.images import build_derivatives_command, meme_srcset
+    from memeqa.jobs import run_jobs_command, start_workers
+    from memeqa.fingerprints import backfill_fingerprints_command
+    from memeqa.upload_layout import shard_uploads_command
+    from memeqa.aggregates import rebuild_aggregates_command
+    from memeqa.meme_stats import rebuild_meme_stats_command
+    from memeqa.labels import score_evaluations_command
+    from memeqa.export import export_data_command
+    from memeqa.release import build_release_command
+    from memeqa.mailer import mail_stats_command
     app.teardown_appcontext(close_db)
+    app.cli.add_command(migrate_db_command)
+    app.cli.add_command(audit_queries_command)
+    app.cli.add_command(build_derivatives_command)
+    app.cli.add_command(run_jobs_command)
+    app.cli.add_command(backfill_fingerprints_command)
+    app.cli.add_command(shard_uploads_command)
+    app.cli.add_command(rebuild_aggregates_command)
+    app.cli.add_command(rebuild_meme_stats_command)
+    app.cli.add_command(score_evaluations_command)
+    app.cli.add_command(export_data_command)
+    app.cli.add_command(build_release_command)
+    app.cli.add_command(mail_stats_command)
+    app.add_template_global(meme_srcset)
     
-    with app.app_context():
-        init_db()
+    if app.config['AUTO_MIGRATE']:
+        with app.app_context():
+            init_db()
     
     # Create upload folder
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -28,6 +59,18 @@ def create_app():
     app.register_blueprint(memes.bp, url_prefix='/memes')
     app.register_blueprint(evaluations.bp, url_prefix='/evaluate')
 
+    @app.before_request
+    def ensure_job_workers():
+        """Start background job threads in whichever process serves requests"""
+        start_workers(app)
+
+    if app.config.get('DEBUG'):
+        @app.after_request
+        def add_query_count(response):
+            """Expose the number of SQL statements the request ran"""
+            response.headers['X-Query-Count'] = str(g.get('query_count', 0))
+            return response
+
     # Register error handlers
     @app.errorhandler(404)
     def not_found(error):
@@ -51,11 +94,9 @@ def create_app():
 
     @app.context_processor
     def inject_session_data():
-        from memeqa.utils import AppSession
-        from memeqa.utils import get_current_user
-        from memeqa.database import get_db
+        from memeqa.utils import get_app_session
 
-        app_session = AppSession(get_current_user(get_db()))
+        app_session = get_app_session()
         return {
             'app_session': app_session
         }
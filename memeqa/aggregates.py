@@ -0,0 +1,111 @@
+# memeqa/aggregates.py
+"""Materialised aggregates for the /analytics dashboard.
+
+Counters (memes, evaluations, accuracy, distinct evaluators, active users)
+and per-value meme counts live in summary tables that triggers on memes,
+evaluations and users keep current in the same transaction as the write
+(migrations/0006_analytics_aggregates.sql). The dashboard then reads a
+handful of rows by primary key instead of aggregating the raw tables.
+`flask rebuild-aggregates` recomputes everything from scratch.
+"""
+import click
+from flask.cli import with_appcontext
+
+COUNTERS = ('memes', 'evaluations', 'judged_evaluations', 'correct_evaluations', 'evaluators', 'active_users')
+DIMENSIONS = ('country', 'platform', 'humor_type', 'context_level')
+
+REBUILD_STATEMENTS = (
+    'DELETE FROM analytics_counters',
+    'DELETE FROM analytics_breakdowns',
+    'DELETE FROM analytics_evaluator_sessions',
+    '''
+    INSERT INTO analytics_counters (name, value)
+    SELECT 'memes', COUNT(*) FROM memes
+    UNION ALL SELECT 'evaluations', COUNT(*) FROM evaluations
+    UNION ALL SELECT 'judged_evaluations', COUNT(was_correct) FROM evaluations
+    UNION ALL SELECT 'correct_evaluations', COUNT(CASE WHEN was_correct THEN 1 END) FROM evaluations
+    UNION ALL SELECT 'evaluators', COUNT(DISTINCT session_id) FROM evaluations
+    UNION ALL SELECT 'active_users', COUNT(*) FROM users WHERE is_active = 1
+    ''',
+    '''
+    INSERT INTO analytics_breakdowns (dimension, value, count)
+    SELECT 'country', contributor_country, COUNT(*) FROM memes WHERE contributor_country != '' GROUP BY contributor_country
+    UNION ALL SELECT 'platform', platform_found, COUNT(*) FROM memes WHERE platform_found != '' GROUP BY platform_found
+    UNION ALL SELECT 'humor_type', humor_type, COUNT(*) FROM memes WHERE humor_type != '' GROUP BY humor_type
+    UNION ALL SELECT 'context_level', context_level, COUNT(*) FROM memes WHERE context_level != '' GROUP BY context_level
+    ''',
+    '''
+    INSERT INTO analytics_evaluator_sessions (session_id, evaluations)
+    SELECT session_id, COUNT(*) FROM evaluations WHERE session_id IS NOT NULL GROUP BY session_id
+    ''',
+)
+
+COUNTERS_QUERY = f'''
+    SELECT name, value FROM analytics_counters
+    WHERE name IN ({', '.join(f"'{name}'" for name in COUNTERS)})
+'''
+
+BREAKDOWNS_QUERY = f'''
+    SELECT dimension, value, count FROM analytics_breakdowns
+    WHERE dimension IN ({', '.join(f"'{dimension}'" for dimension in DIMENSIONS)}) AND count > 0
+    ORDER BY dimension, count DESC, value
+'''
+
+# Memes with at least 5 scored evaluations, hardest or easiest first (idx_meme_analytics_accuracy)
+RANKING_QUERY = '''
+    SELECT m.id, m.original_filename,
+           COALESCE((
+               SELECT d.description FROM meme_descriptions AS d
+               WHERE d.meme_id = m.id
+               ORDER BY d.is_original DESC, d.id
+               LIMIT 1
+           ), 'No description') AS meme_content,
+           a.accuracy_rate, a.total_evaluations
+    FROM meme_analytics AS a
+    JOIN memes AS m ON m.id = a.meme_id
+    WHERE a.judged_evaluations >= 5
+    ORDER BY a.accuracy_rate {order}
+    LIMIT :limit
+'''
+
+
+def rebuild(db):
+    """Recompute every summary table from the raw tables; the caller commits"""
+    for statement in REBUILD_STATEMENTS:
+        db.execute(statement)
+
+
+def counters(db):
+    """Return {counter name: value}, 0 for counters not stored yet"""
+    values = dict.fromkeys(COUNTERS, 0)
+    values.update((row['name'], row['value']) for row in db.execute(COUNTERS_QUERY))
+    return values
+
+
+def breakdowns(db):
+    """Return {dimension: [(value, count)] largest first}"""
+    result = {dimension: [] for dimension in DIMENSIONS}
+    for row in db.execute(BREAKDOWNS_QUERY):
+        result[row['dimension']].append((row['value'], row['count']))
+    return result
+
+
+def accuracy_ranking(db, hardest=True, limit=10):
+    """Return the memes with the lowest (or highest) accuracy among well-evaluated ones"""
+    return db.execute(RANKING_QUERY.format(order='ASC' if hardest else 'DESC'), {'limit': limit}).fetchall()
+
+
+@click.command('rebuild-aggregates')
+@with_appcontext
+def rebuild_aggregates_command():
+    """Recompute the analytics summary tables from the raw data."""
+    from memeqa.database import get_db
+
+    db = get_db()
+    before = counters(db)
+    rebuild(db)
+    db.commit()
+    after = counters(db)
+    for name in COUNTERS:
+        drift = f' (was {before[name]})' if before[name] != after[name] else ''
+        click.echo(f'{name}: {after[name]}{drift}')
@@ -1,22 +1,133 @@
 # memeqa/database.py
+import os
 import sqlite3
-from flask import g, current_app
+import threading
+from flask import g, current_app, has_app_context
+
+
+class ConnectionPool:
+    """Keeps one SQLite connection per worker thread and reuses it across requests.
+
+    PRAGMAs are applied once, when a connection is opened. Connections are
+    keyed by process and thread so a forked gunicorn worker never inherits
+    its parent's handles.
+    """
+
+    def __init__(self, path, pragmas=None):
+        self.path = path
+        self.pragmas = dict(pragmas or {})
+        self._lock = threading.Lock()
+        self._connections = {}  # (pid, thread ident) -> connection
+        self._busy = set()
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False  # only ever used by its owning thread, see acquire()
+        )
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def acquire(self):
+        """Return this thread's connection, opening it on first use"""
+        key = (os.getpid(), threading.get_ident())
+        with self._lock:
+            conn = self._connections.get(key)
+            if conn is None:
+                self._prune()
+                conn = self._connections[key] = self._connect()
+                self.created += 1
+            else:
+                self.reused += 1
+            self._busy.add(key)
+        return conn
+
+    def release(self, conn):
+        """Hand the connection back, dropping any transaction left open"""
+        key = (os.getpid(), threading.get_ident())
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            with self._lock:
+                self._connections.pop(key, None)
+                self.discarded += 1
+            conn.close()
+        with self._lock:
+            self._busy.discard(key)
+
+    def _prune(self):
+        """Close connections owned by threads or processes that are gone"""
+        pid = os.getpid()
+        alive = {t.ident for t in threading.enumerate()}
+        for key in list(self._connections):
+            owner_pid, ident = key
+            if owner_pid != pid or ident not in alive:
+                conn = self._connections.pop(key)
+                self._busy.discard(key)
+                self.discarded += 1
+                if owner_pid == pid:
+                    conn.close()
+
+    def close_all(self):
+        with self._lock:
+            for conn in self._connections.values():
+                conn.close()
+            self._connections.clear()
+            self._busy.clear()
+
+    def stats(self):
+        with self._lock:
+            self._prune()
+            return {
+                'path': self.path,
+                'open': len(self._connections),
+                'in_use': len(self._busy),
+                'created': self.created,
+                'reused': self.reused,
+                'discarded': self.discarded,
+                'pragmas': self.pragmas,
+            }
+
+
+_pool_lock = threading.Lock()
+
+
+def get_pool(app=None):
+    """Return the connection pool for the app's database, creating it on first use"""
+    app = app or current_app
+    pools = app.extensions.setdefault('memeqa_db_pools', {})
+    path = app.config['DATABASE_PATH']
+    if path not in pools:
+        with _pool_lock:
+            if path not in pools:
+                pools[path] = ConnectionPool(path, app.config.get('SQLITE_PRAGMAS'))
+    return pools[path]
+
+def _count_query(statement):
+    if has_app_context():
+        g.query_count = g.get('query_count', 0) + 1
 
 def get_db():
     if 'db' not in g:
-        g.db = sqlite3.connect(
-            current_app.config['DATABASE_PATH'],
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        g.db = get_pool().acquire()
+        if current_app.config.get('DEBUG'):
+            g.db.set_trace_callback(_count_query)
     return g.db
 
 def close_db(e=None):
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        if current_app.config.get('DEBUG'):
+            db.set_trace_callback(None)
+        get_pool().release(db)
 
 def init_db():
-    db = get_db()
-    with current_app.open_resource('../schema.sql') as f:
-        db.executescript(f.read().decode('utf8'))
\ No newline at end of file
+    from memeqa.migrations import migrate
+    migrate(get_db())
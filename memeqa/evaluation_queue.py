@@ -0,0 +1,144 @@
+# memeqa/evaluation_queue.py
+"""Per-actor queue of (meme, description) pairs still open for evaluation.
+
+An actor is either a registered user or an anonymous session. Its queue is
+materialised into the evaluation_queue table the first time it asks for a
+meme and is then kept current by refresh_meme() whenever an upload, an
+evaluation or a new description touches a meme, so picking the next pair is
+a single index seek instead of a scan over the whole corpus.
+"""
+import random
+
+from flask import current_app
+
+from memeqa.selector import pairs_query
+
+_SORT_KEY_MIN = -2 ** 63
+_SORT_KEY_MAX = 2 ** 63 - 1
+
+
+def actor_key(user_id, session_id):
+    """Return the queue key for a registered user or an anonymous session"""
+    if user_id:
+        return f'user:{user_id}'
+    return f'session:{session_id}'
+
+
+def _actor_params(user_id, session_id):
+    column = 'user_id' if user_id else 'session_id'
+    return column, {
+        'actor': actor_key(user_id, session_id),
+        'actor_value': user_id if user_id else session_id,
+        'max_descriptions': current_app.config['MAX_DESCRIPTIONS_PER_MEME'],
+    }
+
+
+def ensure_queue(db, user_id, session_id):
+    """Materialise the actor's queue if it has not been built yet"""
+    column, params = _actor_params(user_id, session_id)
+    # A plain read when the queue exists: an INSERT OR IGNORE would open a
+    # write transaction and hold the database's write lock for the request
+    if db.execute('SELECT 1 FROM evaluation_queue_actors WHERE actor = ?', (params['actor'],)).fetchone():
+        return params['actor']
+
+    try:
+        cursor = db.execute('''
+            INSERT OR IGNORE INTO evaluation_queue_actors (actor, user_id, session_id)
+            VALUES (:actor, :user_id, :session_id)
+        ''', dict(params, user_id=user_id or None, session_id=None if user_id else session_id))
+        if cursor.rowcount:
+            db.execute(
+                'INSERT OR IGNORE INTO evaluation_queue (actor, meme_id, description_id, sort_key) '
+                + pairs_query(column, ':actor_value', ':actor'),
+                params
+            )
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    return params['actor']
+
+
+def pick_pair(db, user_id, session_id):
+    """Return a random open (meme_id, description_id) pair, or None.
+
+    Sort keys are random, so the queue in key order is a random permutation
+    of the open pairs. Each pick takes the pair after the last one shown
+    (starting at a random point and wrapping around), so an actor goes
+    through every open pair once before any comes up again.
+    """
+    actor = ensure_queue(db, user_id, session_id)
+    last_key = db.execute('SELECT last_sort_key FROM evaluation_queue_actors WHERE actor = ?',
+                          (actor,)).fetchone()['last_sort_key']
+    if last_key is None:
+        last_key = random.randint(_SORT_KEY_MIN, _SORT_KEY_MAX)
+
+    row = db.execute('''
+        SELECT meme_id, description_id, sort_key FROM evaluation_queue
+        WHERE actor = ? AND sort_key > ?
+        ORDER BY sort_key LIMIT 1
+    ''', (actor, last_key)).fetchone()
+    if row is None:
+        # Past the last key, wrap around
+        row = db.execute('''
+            SELECT meme_id, description_id, sort_key FROM evaluation_queue
+            WHERE actor = ?
+            ORDER BY sort_key LIMIT 1
+        ''', (actor,)).fetchone()
+    if row is None:
+        return None
+
+    try:
+        db.execute('UPDATE evaluation_queue_actors SET last_sort_key = ? WHERE actor = ?',
+                   (row['sort_key'], actor))
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    return row['meme_id'], row['description_id']
+
+
+def refresh_meme(db, meme_id, user_id=None, session_id=None):
+    """Recompute the open pairs of one meme.
+
+    With an actor given only that actor's queue is touched (e.g. after it
+    evaluated the meme); otherwise every materialised queue is updated (new
+    meme or new description). The caller commits.
+    """
+    max_descriptions = current_app.config['MAX_DESCRIPTIONS_PER_MEME']
+
+    if user_id or session_id:
+        column, params = _actor_params(user_id, session_id)
+        db.execute('DELETE FROM evaluation_queue WHERE actor = ? AND meme_id = ?',
+                   (params['actor'], meme_id))
+        db.execute(
+            'INSERT OR IGNORE INTO evaluation_queue (actor, meme_id, description_id, sort_key) '
+            + pairs_query(column, ':actor_value', ':actor', meme_filter='AND m.id = :meme_id'),
+            dict(params, meme_id=meme_id)
+        )
+        return
+
+    db.execute('DELETE FROM evaluation_queue WHERE meme_id = ?', (meme_id,))
+    for column in ('user_id', 'session_id'):
+        db.execute(
+            'INSERT OR IGNORE INTO evaluation_queue (actor, meme_id, description_id, sort_key) '
+            + pairs_query(column, f'a.{column}', 'a.actor',
+                          actors_from='evaluation_queue_actors a JOIN',
+                          meme_filter='AND m.id = :meme_id'),
+            {'meme_id': meme_id, 'max_descriptions': max_descriptions}
+        )
+
+
+def drop_queue(db, user_id=None, session_id=None):
+    """Forget an actor's queue so it is rebuilt on its next visit. The caller commits."""
+    actor = actor_key(user_id, session_id)
+    db.execute('DELETE FROM evaluation_queue WHERE actor = ?', (actor,))
+    db.execute('DELETE FROM evaluation_queue_actors WHERE actor = ?', (actor,))
+
+
+def has_candidates(db, user_id, session_id):
+    """Check whether any meme from someone else exists at all"""
+    column = 'user_id' if user_id else 'session_id'
+    row = db.execute(f'SELECT 1 FROM memes WHERE {column} != ? LIMIT 1',
+                     (user_id if user_id else session_id,)).fetchone()
+    return row is not None
@@ -0,0 +1,420 @@
+# memeqa/export.py
+"""Streaming research export.
+
+Each exported table is read in keyset pages (`WHERE id > ? ORDER BY id
+LIMIT EXPORT_PAGE_SIZE`), so memory stays bounded by one page however
+large the dataset is, no read transaction is held between pages, and an
+interrupted dump resumes with `after=<last id received>`.
+
+Delta exports read change_log instead (migrations/0009_change_log.sql):
+triggers give every inserted, updated or deleted row a new, increasing
+seq, so `since=<watermark>` returns each row changed after that point
+once, in its current state, or as a tombstone when it is gone. Every
+export reports the watermark it was taken at, to be passed as `since`
+next time.
+
+/export_data streams NDJSON or CSV; `flask export-data` writes the same
+rows to files, including Parquet and Arrow IPC when pyarrow is installed.
+
+Exports carry no contributor names, and session ids go out as
+pseudonym(session_id), an HMAC-SHA256 registered on the connection by
+register_pseudonym(). Live exports key it from SECRET_KEY, so a session
+keeps its pseudonym from one delta to the next (until the key rotates);
+releases use a key of their own (memeqa/release.py).
+"""
+import csv
+import hashlib
+import hmac
+import io
+import json
+import os
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from memeqa import aggregates
+
+DATASET_INFO = {
+    'name': 'MemeQA',
+    'version': '2.0',
+    'description': 'Comprehensive meme understanding dataset with cultural and humor classifications',
+    'institutions': ['THWS', 'CAIRO'],
+    'license': 'Research Use Only'
+}
+
+# (select expression, column name, type); 'json' columns hold JSON arrays
+# and are decoded in NDJSON, every other format keeps the stored text
+TABLES = {
+    'memes': {
+        'columns': (
+            ('m.id', 'id', 'int'),
+            ('m.filename', 'filename', 'text'),
+            ('m.original_filename', 'original_filename', 'text'),
+            ('m.contributor_country', 'contributor_country', 'text'),
+            ('m.platform_found', 'platform_found', 'text'),
+            ('m.user_id', 'user_id', 'int'),
+            ('m.languages', 'languages', 'json'),
+            ('m.humor_type', 'humor_type', 'json'),
+            ('m.emotions_conveyed', 'emotions_conveyed', 'json'),
+            ('m.context_level', 'context_level', 'text'),
+            ('m.likes', 'likes', 'int'),
+            ('m.upload_date', 'upload_date', 'timestamp'),
+            ('a.total_evaluations', 'analytics_evaluations', 'int'),
+            ('a.accuracy_rate', 'accuracy_rate', 'float'),
+            ('a.difficulty_score', 'difficulty_score', 'float'),
+            ('a.avg_evaluation_time', 'avg_evaluation_time', 'float'),
+            ('ag.humor_jaccard', 'humor_jaccard', 'float'),
+            ('ag.emotion_jaccard', 'emotion_jaccard', 'float'),
+            ('ag.humor_alpha', 'humor_alpha', 'float'),
+            ('ag.emotion_alpha', 'emotion_alpha', 'float'),
+            ('ag.context_agreement', 'context_agreement', 'float'),
+        ),
+        'from': '''memes AS m
+            LEFT JOIN meme_analytics AS a ON a.meme_id = m.id
+            LEFT JOIN meme_agreement AS ag ON ag.meme_id = m.id''',
+        'key': 'm.id',
+        'source': 'memes',
+    },
+    'evaluations': {
+        'columns': (
+            ('e.id', 'id', 'int'),
+            ('pseudonym(e.session_id)', 'session_id', 'text'),
+            ('e.user_id', 'user_id', 'int'),
+            ('e.meme_id', 'meme_id', 'int'),
+            ('e.evaluation_date', 'evaluation_date', 'timestamp'),
+            ('e.evaluation_time_seconds', 'evaluation_time_seconds', 'int'),
+            ('e.evaluated_humor_type', 'evaluated_humor_type', 'json'),
+            ('e.evaluated_emotions', 'evaluated_emotions', 'json'),
+            ('e.evaluated_context_level', 'evaluated_context_level', 'text'),
+            ('e.matches_humor_type', 'matches_humor_type', 'bool'),
+            ('e.emotion_overlap_score', 'emotion_overlap_score', 'float'),
+            ('e.was_correct', 'was_correct', 'bool'),
+            ('m.humor_type', 'humor_type', 'json'),
+            ('m.emotions_conveyed', 'emotions_conveyed', 'json'),
+            ('m.context_level', 'context_level', 'text'),
+        ),
+        'from': 'evaluations AS e JOIN memes AS m ON m.id = e.meme_id',
+        'key': 'e.id',
+        'source': 'evaluations',
+    },
+    # Anonymized: no names, emails or birth years
+    'contributors': {
+        'columns': (
+            ('u.id', 'id', 'int'),
+            ('u.country', 'country', 'text'),
+            ('u.research_interest', 'research_interest', 'text'),
+            ('u.total_submissions', 'total_submissions', 'int'),
+            ('u.total_evaluations', 'total_evaluations', 'int'),
+            ('u.evaluation_accuracy', 'evaluation_accuracy', 'float'),
+            ('u.registration_date', 'registration_date', 'timestamp'),
+        ),
+        'from': 'users AS u',
+        'where': 'u.is_active = 1',
+        'key': 'u.id',
+        'source': 'users',
+    },
+}
+
+FORMATS = ('ndjson', 'csv', 'parquet', 'arrow')
+
+
+def pseudonym_key(config):
+    """Key of the live exports' pseudonyms"""
+    return hmac.new(config['SECRET_KEY'].encode('utf-8'), b'memeqa-export-pseudonym', hashlib.sha256).digest()
+
+
+def register_pseudonym(db, key):
+    """Define the SQL function pseudonym(value) the export queries select session ids through"""
+    def pseudonym(value):
+        if value is None:
+            return None
+        return hmac.new(key, str(value).encode('utf-8'), hashlib.sha256).hexdigest()[:32]
+
+    db.create_function('pseudonym', 1, pseudonym, deterministic=True)
+
+
+def page_query(table):
+    """Keyset page of one table: :after is the last id already exported"""
+    spec = TABLES[table]
+    conditions = [f"{spec['key']} > :after"]
+    if spec.get('where'):
+        conditions.append(spec['where'])
+    return f'''
+        SELECT {', '.join(f'{expression} AS {name}' for expression, name, _ in spec['columns'])}
+        FROM {spec['from']}
+        WHERE {' AND '.join(conditions)}
+        ORDER BY {spec['key']}
+        LIMIT :limit
+    '''
+
+
+def rows_query(table, count):
+    """The exported rows of a table among `count` ids"""
+    spec = TABLES[table]
+    conditions = [f"{spec['key']} IN ({', '.join('?' * count)})"]
+    if spec.get('where'):
+        conditions.append(spec['where'])
+    return f'''
+        SELECT {', '.join(f'{expression} AS {name}' for expression, name, _ in spec['columns'])}
+        FROM {spec['from']}
+        WHERE {' AND '.join(conditions)}
+    '''
+
+
+# Rows of one source table changed in (since, until], oldest change first
+CHANGES_QUERY = '''
+    SELECT seq, row_id, changed_at FROM change_log
+    WHERE table_name = :source AND seq > :since AND seq <= :until
+    ORDER BY seq
+    LIMIT :limit
+'''
+
+
+def column_names(table):
+    return [name for _, name, _ in TABLES[table]['columns']]
+
+
+def pages(db, table, after=0, page_size=1000):
+    """Yield lists of rows of a table in id order, starting after the given id"""
+    query = page_query(table)
+    while True:
+        rows = db.execute(query, {'after': after, 'limit': page_size}).fetchall()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < page_size:
+            return
+        after = rows[-1]['id']
+
+
+def watermark(db):
+    """The latest change seq; everything up to it is reflected in an export started now"""
+    return db.execute('SELECT COALESCE(MAX(seq), 0) AS seq FROM change_log').fetchone()['seq']
+
+
+def change_pages(db, table, since, until, page_size=1000):
+    """Yield lists of (change, row) for rows changed in (since, until]; row is
+    None when the row is gone from the export (deleted, or filtered out)"""
+    params = {'source': TABLES[table]['source'], 'since': since, 'until': until, 'limit': page_size}
+    while True:
+        changes = db.execute(CHANGES_QUERY, params).fetchall()
+        if not changes:
+            return
+        ids = [change['row_id'] for change in changes]
+        rows = {row['id']: row for row in db.execute(rows_query(table, len(ids)), ids)}
+        yield [(change, rows.get(change['row_id'])) for change in changes]
+        if len(changes) < page_size:
+            return
+        params['since'] = changes[-1]['seq']
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def _decode(value):
+    if not isinstance(value, str):
+        return value
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def _record(table, row):
+    record = dict(row)
+    for _, name, kind in TABLES[table]['columns']:
+        if kind == 'json':
+            record[name] = _decode(record[name])
+    return record
+
+
+def ndjson_chunk(table, rows, tagged=False):
+    """One page as NDJSON, JSON array columns decoded; tagged lines name their table"""
+    lines = []
+    for row in rows:
+        record = _record(table, row)
+        if tagged:
+            record = {'table': table, 'row': record}
+        lines.append(json.dumps(record, default=_json_default) + '\n')
+    return ''.join(lines)
+
+
+def changes_chunk(table, page):
+    """One page of changes as NDJSON: upserts carry the row, deletes only its id"""
+    lines = []
+    for change, row in page:
+        record = {'table': table, 'seq': change['seq'], 'changed_at': change['changed_at']}
+        if row is None:
+            record.update(op='delete', id=change['row_id'])
+        else:
+            record.update(op='upsert', row=_record(table, row))
+        lines.append(json.dumps(record, default=_json_default) + '\n')
+    return ''.join(lines)
+
+
+def csv_chunk(rows, header=None):
+    """One page as CSV, preceded by the header row when given"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(header)
+    writer.writerows(
+        [value.isoformat() if isinstance(value, datetime) else value for value in row]
+        for row in rows
+    )
+    return buffer.getvalue()
+
+
+def header_record(db, until):
+    """First NDJSON line of a full export"""
+    counts = aggregates.counters(db)
+    return {
+        'export_timestamp': datetime.now().isoformat(),
+        'watermark': until,
+        'dataset_info': DATASET_INFO,
+        'statistics': {
+            'total_memes': counts['memes'],
+            'total_evaluations': counts['evaluations'],
+            'total_contributors': counts['active_users'],
+        },
+    }
+
+
+def stream_ndjson(db, tables, after=0, page_size=1000, until=0):
+    """NDJSON chunks, one per page. Several tables get a header line first
+    (reporting `until` as the watermark), every row names its table and
+    `after` applies to the first table."""
+    tagged = len(tables) > 1
+    if tagged:
+        yield json.dumps(header_record(db, until), default=_json_default) + '\n'
+    for position, table in enumerate(tables):
+        for rows in pages(db, table, after if position == 0 else 0, page_size):
+            yield ndjson_chunk(table, rows, tagged)
+
+
+def stream_changes(db, tables, since, until, page_size=1000):
+    """NDJSON chunks of the rows changed in (since, until], after a header line"""
+    header = {'export_timestamp': datetime.now().isoformat(), 'since': since, 'watermark': until}
+    yield json.dumps(header) + '\n'
+    for table in tables:
+        for page in change_pages(db, table, since, until, page_size):
+            yield changes_chunk(table, page)
+
+
+def stream_csv(db, table, after=0, page_size=1000):
+    """CSV chunks of one table, the header first"""
+    yield csv_chunk([], column_names(table))
+    for rows in pages(db, table, after, page_size):
+        yield csv_chunk(rows)
+
+
+def _arrow_schema(pa, table):
+    types = {
+        'int': pa.int64(), 'float': pa.float64(), 'bool': pa.bool_(),
+        'text': pa.string(), 'json': pa.string(), 'timestamp': pa.timestamp('us'),
+    }
+    return pa.schema([(name, types[kind]) for _, name, kind in TABLES[table]['columns']])
+
+
+def _arrow_value(kind, value):
+    # Columns filled from form fields may hold '' or text where a number belongs
+    if value is None:
+        return None
+    if kind == 'int':
+        return value if isinstance(value, int) else None
+    if kind == 'float':
+        return float(value) if isinstance(value, (int, float)) else None
+    if kind == 'bool':
+        return bool(value) if isinstance(value, (int, float)) else None
+    if kind == 'timestamp':
+        return value if isinstance(value, datetime) else None
+    return value if isinstance(value, str) else str(value)
+
+
+def write_arrow(db, table, path, fmt='parquet', after=0, page_size=1000):
+    """Write a table to a Parquet or Arrow IPC file one record batch per page; return the rows written"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError('pyarrow is required for Parquet/Arrow export') from None
+
+    schema = _arrow_schema(pa, table)
+    columns = TABLES[table]['columns']
+    if fmt == 'parquet':
+        writer = pq.ParquetWriter(path, schema)
+    else:
+        writer = pa.ipc.new_file(path, schema)
+    written = 0
+    try:
+        for rows in pages(db, table, after, page_size):
+            arrays = [
+                pa.array([_arrow_value(kind, row[i]) for row in rows], type=schema.field(i).type)
+                for i, (_, _, kind) in enumerate(columns)
+            ]
+            writer.write_batch(pa.record_batch(arrays, schema=schema))
+            written += len(rows)
+    finally:
+        writer.close()
+    return written
+
+
+def write_text(db, table, path, fmt='ndjson', after=0, page_size=1000):
+    """Write a table to an NDJSON or CSV file; return the rows written"""
+    written = 0
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            f.write(csv_chunk([], column_names(table)))
+        for rows in pages(db, table, after, page_size):
+            f.write(csv_chunk(rows) if fmt == 'csv' else ndjson_chunk(table, rows))
+            written += len(rows)
+    return written
+
+
+@click.command('export-data')
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default='ndjson', show_default=True)
+@click.option('--table', type=click.Choice(['all', *TABLES]), default='all', show_default=True)
+@click.option('--out', 'out_dir', type=click.Path(file_okay=False), default='export', show_default=True,
+              help='Directory receiving one file per table.')
+@click.option('--after', type=int, default=0, help='Resume a single table after this id.')
+@click.option('--since', type=int, default=None,
+              help='Only rows changed after this watermark, as changes.ndjson with tombstones.')
+@with_appcontext
+def export_data_command(fmt, table, out_dir, after, since):
+    """Export the research dataset to files, one page of rows in memory at a time."""
+    from memeqa.database import get_db
+
+    if after and table == 'all':
+        raise click.UsageError('--after needs --table')
+    if since is not None and fmt != 'ndjson':
+        raise click.UsageError('--since writes NDJSON only')
+    db = get_db()
+    register_pseudonym(db, pseudonym_key(current_app.config))
+    page_size = current_app.config['EXPORT_PAGE_SIZE']
+    until = watermark(db)
+    os.makedirs(out_dir, exist_ok=True)
+    if since is not None:
+        path = os.path.join(out_dir, 'changes.ndjson')
+        with open(path, 'w', encoding='utf-8') as f:
+            for chunk in stream_changes(db, list(TABLES) if table == 'all' else [table], since, until, page_size):
+                f.write(chunk)
+        click.echo(f'changes {since}..{until} -> {path}')
+        return
+    for name in (TABLES if table == 'all' else [table]):
+        path = os.path.join(out_dir, f'{name}.{fmt}')
+        if fmt in ('parquet', 'arrow'):
+            try:
+                written = write_arrow(db, name, path, fmt, after, page_size)
+            except RuntimeError as e:
+                raise click.ClickException(str(e))
+        else:
+            written = write_text(db, name, path, fmt, after, page_size)
+        click.echo(f'{name}: {written} rows -> {path}')
+    click.echo(f'watermark: {until} (pass --since {until} next time)')
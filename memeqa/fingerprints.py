@@ -0,0 +1,160 @@
+# memeqa/fingerprints.py
+"""Exact and near-duplicate detection for uploaded memes.
+
+Exact duplicates share the SHA-256 of their bytes (memes.content_hash,
+which also names the stored file, unique among memes). Near duplicates -- re-encodes, resizes,
+light crops -- are found by a 64-bit difference hash (dHash) compared by
+Hamming distance.
+
+dHashes are indexed with multi-index hashing: each one is split into four
+16-bit bands stored in meme_dhash_bands. Two hashes within distance r
+agree within r // 4 bits on at least one band (pigeonhole), so probing
+every band value within that many bit flips finds all candidates with a
+handful of primary-key lookups; the exact distance is then checked here.
+"""
+import hashlib
+from itertools import combinations
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from PIL import Image
+
+BANDS = 4
+BAND_BITS = 16
+_BAND_MASK = (1 << BAND_BITS) - 1
+_HASH_CHUNK = 1024 * 1024
+
+
+def file_sha256(path):
+    """Return the SHA-256 hex digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def upload_sha256(file):
+    """Return the SHA-256 of an uploaded FileStorage, using the ingest stream's when it has one"""
+    stream = file.stream
+    if hasattr(stream, 'sha256'):
+        return stream.sha256
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(_HASH_CHUNK), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def dhash(path):
+    """Return the 64-bit difference hash of an image as an unsigned int"""
+    with Image.open(path) as image:
+        image.draft('L', (64, 64))  # JPEGs decode at reduced scale
+        pixels = list(image.convert('L').resize((9, 8), Image.Resampling.LANCZOS).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def to_signed(value):
+    """Fit an unsigned 64-bit hash into SQLite's signed INTEGER"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def bands(value):
+    """Split an unsigned 64-bit hash into [(band, 16-bit value)]"""
+    return [(band, (value >> (band * BAND_BITS)) & _BAND_MASK) for band in range(BANDS)]
+
+
+def _flips(value, radius):
+    """Yield every 16-bit value within `radius` bit flips of value"""
+    yield value
+    for distance in range(1, radius + 1):
+        for bits in combinations(range(BAND_BITS), distance):
+            flipped = value
+            for bit in bits:
+                flipped ^= 1 << bit
+            yield flipped
+
+
+def find_duplicate(db, content_hash):
+    """Return the id of a meme with exactly these bytes, or None"""
+    row = db.execute('SELECT id FROM memes WHERE content_hash = ? LIMIT 1', (content_hash,)).fetchone()
+    return row['id'] if row else None
+
+
+def find_similar(db, value, max_distance):
+    """Return [(meme_id, distance)] of memes whose dHash is within max_distance, closest first"""
+    radius = max_distance // BANDS
+    probes = [(band, probe) for band, band_value in bands(value) for probe in _flips(band_value, radius)]
+    placeholders = ', '.join('(?, ?)' for _ in probes)
+    rows = db.execute(f'''
+        WITH probes (band, value) AS (VALUES {placeholders})
+        SELECT DISTINCT m.id, m.dhash
+        FROM probes AS p
+        JOIN meme_dhash_bands AS b ON b.band = p.band AND b.value = p.value
+        JOIN memes AS m ON m.id = b.meme_id
+    ''', [n for probe in probes for n in probe]).fetchall()
+
+    matches = []
+    for row in rows:
+        distance = bin(value ^ to_unsigned(row['dhash'])).count('1')
+        if distance <= max_distance:
+            matches.append((row['id'], distance))
+    matches.sort(key=lambda match: (match[1], match[0]))
+    return matches
+
+
+def index_meme(db, meme_id, content_hash, value):
+    """Store a meme's fingerprints; value may be None for undecodable images. The caller commits."""
+    db.execute('UPDATE memes SET content_hash = ?, dhash = ? WHERE id = ?',
+               (content_hash, to_signed(value) if value is not None else None, meme_id))
+    db.execute('DELETE FROM meme_dhash_bands WHERE meme_id = ?', (meme_id,))
+    if value is not None:
+        db.executemany('INSERT INTO meme_dhash_bands (band, value, meme_id) VALUES (?, ?, ?)',
+                       [(band, band_value, meme_id) for band, band_value in bands(value)])
+
+
+@click.command('backfill-fingerprints')
+@with_appcontext
+def backfill_fingerprints_command():
+    """Compute content hashes and dHashes for memes uploaded before fingerprinting."""
+    from memeqa.database import get_db
+    from memeqa.storage import get_storage
+
+    db = get_db()
+    storage = get_storage()
+    rows = db.execute('SELECT id, filename FROM memes WHERE content_hash IS NULL ORDER BY id').fetchall()
+    done = failed = copies = 0
+    for row in rows:
+        try:
+            path = storage.local_path(row['filename'])
+            content_hash = file_sha256(path)
+        except OSError as e:
+            click.echo(f"{row['filename']}: {e}", err=True)
+            failed += 1
+            continue
+        try:
+            value = dhash(path)
+        except (OSError, ValueError) as e:
+            click.echo(f"{row['filename']}: no dHash ({e})", err=True)
+            value = None
+        # content_hash is unique: an exact copy of an earlier meme keeps only its dHash
+        original = find_duplicate(db, content_hash)
+        if original is not None and original != row['id']:
+            click.echo(f"{row['filename']}: exact copy of meme {original}", err=True)
+            content_hash = None
+            copies += 1
+        index_meme(db, row['id'], content_hash, value)
+        done += 1
+        if done % 500 == 0:
+            db.commit()
+    db.commit()
+    click.echo(f'{done} memes fingerprinted, {failed} failed, {copies} exact copies of earlier memes')
@@ -0,0 +1,201 @@
+# memeqa/gallery.py
+"""Gallery listing: filter predicates, keyset cursors and cached totals.
+
+Gallery pages are ordered newest first by (upload_date, id). Moving to the
+next or previous page seeks from the last or first key of the current page
+through idx_memes_upload instead of skipping rows with OFFSET, so deep pages
+cost the same as the first one. Keys travel between requests as opaque
+cursors.
+"""
+import base64
+import json
+import threading
+
+from cachetools import TTLCache
+from flask import current_app
+
+# WHERE clause per gallery filter; all of them take :user_id
+FILTERS = {
+    'all': '''m.id IN (
+        SELECT id FROM memes WHERE user_id = :user_id
+        UNION
+        SELECT meme_id FROM evaluations WHERE user_id = :user_id
+    )''',
+    'evaluated': 'm.id IN (SELECT meme_id FROM evaluations WHERE user_id = :user_id)',
+    'own': 'm.user_id = :user_id',
+    'liked': 'm.id IN (SELECT meme_id FROM meme_likes WHERE user_id = :user_id)',
+}
+
+_totals = None
+_totals_lock = threading.Lock()
+
+
+def encode_cursor(upload_date, meme_id):
+    """Pack a (upload_date, id) key into an opaque URL-safe token"""
+    raw = json.dumps([upload_date, meme_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Unpack a cursor token, returning None if it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        upload_date, meme_id = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(upload_date, str) or not isinstance(meme_id, int):
+        return None
+    return upload_date, meme_id
+
+
+def _totals_cache():
+    global _totals
+    if _totals is None:
+        _totals = TTLCache(maxsize=4096, ttl=current_app.config['GALLERY_TOTAL_TTL'])
+    return _totals
+
+
+def _cached_total(key):
+    with _totals_lock:
+        return _totals_cache().get(key)
+
+
+def _remember_total(key, total):
+    with _totals_lock:
+        _totals_cache()[key] = total
+
+
+def count_memes(db, filter_type, user_id, version=None):
+    """Return the number of memes in a gallery filter, cached for GALLERY_TOTAL_TTL.
+
+    version is folded into the cache key so callers can pass counters that
+    change with the result (e.g. the user's upload and evaluation totals).
+    """
+    key = (filter_type, user_id, version)
+    total = _cached_total(key)
+    if total is None:
+        total = db.execute(
+            f'SELECT COUNT(*) AS count FROM memes AS m WHERE {FILTERS[filter_type]}',
+            {'user_id': user_id}
+        ).fetchone()['count']
+        _remember_total(key, total)
+    return total
+
+
+def forget_totals(user_id):
+    """Drop the cached totals of a user, e.g. after a like"""
+    with _totals_lock:
+        cache = _totals_cache()
+        for key in [key for key in cache if key[1] == user_id]:
+            cache.pop(key, None)
+
+
+def page_query(filter_type, seek=None, with_total=False):
+    """Return the SQL for one gallery page.
+
+    seek is None (OFFSET), 'after' or 'before'. Rows carry the meme columns,
+    sort_date (upload_date as stored, for cursors) and liked_by_user. With
+    with_total the filtered set is counted by a window in the same statement
+    and every row also carries total_count.
+    """
+    where = FILTERS[filter_type]
+    source, alias = 'memes', 'm'
+    if with_total:
+        # Counted rows are a derived table; alias it apart from memes so a real scan stays visible
+        source = f'(SELECT m.*, COUNT(*) OVER () AS total_count FROM memes AS m WHERE {where})'
+        alias, where = 'f', '1'
+
+    order = 'DESC'
+    limit = 'LIMIT :limit OFFSET :offset'
+    if seek == 'after':
+        where += f' AND ({alias}.upload_date, {alias}.id) < (:key_date, :key_id)'
+        limit = 'LIMIT :limit'
+    elif seek == 'before':
+        where += f' AND ({alias}.upload_date, {alias}.id) > (:key_date, :key_id)'
+        order = 'ASC'
+        limit = 'LIMIT :limit'
+
+    return f'''
+        SELECT {alias}.*,
+            CAST({alias}.upload_date AS TEXT) AS sort_date,
+            EXISTS (
+                SELECT 1 FROM meme_likes AS ml WHERE ml.meme_id = {alias}.id AND ml.user_id = :user_id
+            ) AS liked_by_user
+        FROM {source} AS {alias}
+        WHERE {where}
+        ORDER BY {alias}.upload_date {order}, {alias}.id {order}
+        {limit}
+    '''
+
+
+def fetch_page(db, filter_type, user_id, per_page, page=1, after=None, before=None, version=None):
+    """Return (rows newest first, more, total) for one gallery page in a single statement.
+
+    after / before are (upload_date, id) keys: the page starts right below
+    `after` or ends right above `before`. Without either the page is taken
+    by OFFSET from `page`, which is only used for direct page-number jumps.
+    more tells whether rows remain past the page in the direction of travel.
+    total comes from the count_memes() cache when it is warm and is
+    otherwise counted alongside the page (see count_memes for version).
+    """
+    total_key = (filter_type, user_id, version)
+    total = _cached_total(total_key)
+
+    params = {'user_id': user_id, 'limit': per_page + 1}
+    key = after or before
+    if key:
+        params.update(key_date=key[0], key_id=key[1])
+    else:
+        params['offset'] = (page - 1) * per_page
+
+    seek = 'after' if after else 'before' if before else None
+    rows = db.execute(page_query(filter_type, seek, with_total=total is None), params).fetchall()
+
+    if total is None:
+        # An empty page says nothing about the rest of the filter
+        total = rows[0]['total_count'] if rows else count_memes(db, filter_type, user_id, version)
+        _remember_total(total_key, total)
+
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if before:
+        rows.reverse()
+    return rows, more, total
+
+
+def neighbours_query(filter_type):
+    """Return the SQL behind neighbours(); takes :meme_id and :user_id"""
+    where = FILTERS[filter_type]
+    return f'''
+        SELECT
+            EXISTS (SELECT 1 FROM memes AS m WHERE m.id = c.id AND {where}) AS listed,
+            (SELECT m.id FROM memes AS m
+             WHERE {where} AND (m.upload_date, m.id) > (c.upload_date, c.id)
+             ORDER BY m.upload_date ASC, m.id ASC LIMIT 1) AS newer_id,
+            (SELECT m.id FROM memes AS m
+             WHERE {where} AND (m.upload_date, m.id) < (c.upload_date, c.id)
+             ORDER BY m.upload_date DESC, m.id DESC LIMIT 1) AS older_id,
+            (SELECT COUNT(*) FROM memes AS m
+             WHERE {where} AND (m.upload_date, m.id) > (c.upload_date, c.id)) AS position
+        FROM memes AS c
+        WHERE c.id = :meme_id
+    '''
+
+
+def neighbours(db, filter_type, user_id, meme_id, per_page):
+    """Locate a meme within a gallery filter without listing the filter.
+
+    Returns a dict with newer_id / older_id (the memes shown before and
+    after it, or None), position (0-based, newest first) and page, the
+    gallery page it sits on. A meme outside the filter has no neighbours
+    and is placed on page 1.
+    """
+    row = db.execute(neighbours_query(filter_type), {'meme_id': meme_id, 'user_id': user_id}).fetchone()
+    if row is None or not row['listed']:
+        return {'newer_id': None, 'older_id': None, 'position': None, 'page': 1}
+    return {
+        'newer_id': row['newer_id'],
+        'older_id': row['older_id'],
+        'position': row['position'],
+        'page': row['position'] // per_page + 1,
+    }
@@ -0,0 +1,157 @@
+# memeqa/images.py
+"""Resized copies of uploaded memes.
+
+Every upload gets one derivative per configured width and format, stored
+under derivatives/ in the upload storage by a background job (see memeqa/jobs.py). Pages ask for a width through
+memes.uploaded_file?size=N (or a srcset built by meme_srcset()) and get the
+smallest derivative at least that wide, falling back to the original while
+derivatives are missing.
+"""
+import os
+
+import click
+from flask import current_app, url_for
+from flask.cli import with_appcontext
+from PIL import Image, ImageOps, features
+
+from memeqa import jobs
+
+DERIVATIVES_DIR = 'derivatives'
+
+# Pillow save() arguments per output format
+_SAVE_OPTIONS = {
+    'webp': {'format': 'WEBP', 'method': 4},
+    'avif': {'format': 'AVIF', 'speed': 8},
+}
+
+MIME_TYPES = {'webp': 'image/webp', 'avif': 'image/avif'}
+
+
+def derivatives_folder(upload_folder):
+    return os.path.join(upload_folder, DERIVATIVES_DIR)
+
+
+def derivative_name(filename, size, fmt):
+    """Return the file name of one derivative of an upload, in the upload's subfolder"""
+    stem = filename.rsplit('.', 1)[0]
+    return f'{stem}_{size}.{fmt}'
+
+
+def derivative_key(filename, size, fmt):
+    """Return the storage key of one derivative of an upload"""
+    return f'{DERIVATIVES_DIR}/{derivative_name(filename, size, fmt)}'
+
+
+def supported_formats(formats):
+    """Drop formats this Pillow build cannot encode"""
+    return [fmt for fmt in formats if fmt in _SAVE_OPTIONS and features.check(fmt)]
+
+
+def generate_derivatives(storage, filename, sizes, formats, quality=80, overwrite=False):
+    """Write the resized copies of one upload and return the keys written.
+
+    Images are scaled to each width keeping their aspect ratio and are never
+    enlarged, so a small upload gets copies at its own size. EXIF rotation is
+    applied first because the derivatives carry no metadata.
+    """
+    formats = supported_formats(formats)
+
+    written = []
+    with Image.open(storage.local_path(filename)) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info or 'A' in image.getbands() else 'RGB')
+
+        for size in sorted(sizes, reverse=True):
+            if image.width > size:
+                image = image.resize((size, max(1, round(image.height * size / image.width))),
+                                     Image.Resampling.LANCZOS)
+            for fmt in formats:
+                key = derivative_key(filename, size, fmt)
+                if not overwrite and storage.exists(key):
+                    continue
+                path = storage.cache_path(key)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = path + '.tmp'
+                image.save(tmp_path, quality=quality, **_SAVE_OPTIONS[fmt])
+                storage.put_file(key, tmp_path)
+                written.append(key)
+    return written
+
+
+@jobs.handler('image.derivatives')
+def derivatives_job(payload):
+    """Background job queued by the upload route; raising lets the queue retry it"""
+    from memeqa.database import get_db
+    from memeqa.storage import get_storage
+
+    config = current_app.config
+    # The file may have moved since the job was queued (flask shard-uploads)
+    row = get_db().execute('SELECT filename FROM memes WHERE id = ?', (payload.get('meme_id'),)).fetchone()
+    generate_derivatives(
+        get_storage(), row['filename'] if row else payload['filename'],
+        config['IMAGE_DERIVATIVE_SIZES'], config['IMAGE_DERIVATIVE_FORMATS'],
+        quality=config['IMAGE_DERIVATIVE_QUALITY'],
+    )
+
+
+def _accepts(accept_mimetypes, fmt):
+    # No Accept header: anything goes. AVIF must be named explicitly, since
+    # browsers without AVIF support still send image/* and */*.
+    if not accept_mimetypes:
+        return True
+    if fmt == 'avif':
+        return MIME_TYPES[fmt] in accept_mimetypes.values()
+    return MIME_TYPES[fmt] in accept_mimetypes
+
+
+def pick_derivative(storage, filename, size, accept_mimetypes):
+    """Return the storage key of the derivative to serve for a requested width, or None.
+
+    The smallest configured width that covers the request wins; formats are
+    tried in config order, skipping ones the client does not accept.
+    """
+    sizes = sorted(current_app.config['IMAGE_DERIVATIVE_SIZES'])
+    width = next((s for s in sizes if s >= size), sizes[-1])
+    for fmt in current_app.config['IMAGE_DERIVATIVE_FORMATS']:
+        if fmt not in MIME_TYPES or not _accepts(accept_mimetypes, fmt):
+            continue
+        key = derivative_key(filename, width, fmt)
+        if storage.exists(key):
+            return key
+    return None
+
+
+def meme_srcset(filename):
+    """Return a srcset attribute value listing every derivative width of an upload"""
+    return ', '.join(
+        f"{url_for('memes.uploaded_file', filename=filename, size=size)} {size}w"
+        for size in sorted(current_app.config['IMAGE_DERIVATIVE_SIZES'])
+    )
+
+
+@click.command('build-derivatives')
+@click.option('--overwrite', is_flag=True, help='Regenerate derivatives that already exist.')
+@with_appcontext
+def build_derivatives_command(overwrite):
+    """Generate missing resized copies for every uploaded meme."""
+    from memeqa.database import get_db
+    from memeqa.storage import get_storage
+
+    config = current_app.config
+    storage = get_storage()
+    formats = supported_formats(config['IMAGE_DERIVATIVE_FORMATS'])
+    skipped = set(config['IMAGE_DERIVATIVE_FORMATS']) - set(formats)
+    if skipped:
+        click.echo(f"Pillow cannot encode {', '.join(sorted(skipped))}, skipping", err=True)
+
+    done = failed = 0
+    for row in get_db().execute('SELECT filename FROM memes ORDER BY id'):
+        try:
+            generate_derivatives(storage, row['filename'], config['IMAGE_DERIVATIVE_SIZES'], formats,
+                                 quality=config['IMAGE_DERIVATIVE_QUALITY'], overwrite=overwrite)
+            done += 1
+        except (OSError, ValueError) as e:
+            click.echo(f"{row['filename']}: {e}", err=True)
+            failed += 1
+    click.echo(f'{done} memes processed, {failed} failed')
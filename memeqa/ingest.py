@@ -0,0 +1,172 @@
+# memeqa/ingest.py
+"""Streaming ingest of uploaded files.
+
+Werkzeug normally spools each uploaded file into a temporary file (or
+memory) before the view runs, and the view then copies it to the upload
+folder. IngestRequest hands the multipart parser an UploadStream instead,
+which writes every chunk straight into a partial file inside the upload
+folder while it
+
+- sniffs the image type from the first bytes and stops storing anything
+  that is not an allowed image,
+- counts bytes and aborts the request with 413 once a file passes
+  MAX_CONTENT_LENGTH,
+- hashes the content with SHA-256.
+
+Saving an accepted upload is then a rename of the partial file (commit()),
+and partial files a request did not commit are removed at teardown.
+"""
+import hashlib
+import os
+import uuid
+
+from flask import current_app, g
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+# Leading bytes of the formats in ALLOWED_EXTENSIONS
+_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpg'),
+)
+# Extensions in ALLOWED_EXTENSIONS that admit each sniffed type
+_EXTENSIONS = {'png': {'png'}, 'jpg': {'jpg', 'jpeg'}, 'webp': {'webp'}}
+_SNIFF_BYTES = 12
+
+PARTIAL_PREFIX = '.partial-'
+
+
+def sniff_image_type(head):
+    """Return the extension matching an image's leading bytes, or None"""
+    for signature, extension in _SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+class UploadStream:
+    """File-like sink for one uploaded file, see the module docstring"""
+
+    def __init__(self, folder, max_size, allowed_types):
+        self.folder = folder
+        self.max_size = max_size
+        self.allowed_types = allowed_types
+        self.path = os.path.join(folder, f'{PARTIAL_PREFIX}{uuid.uuid4().hex}')
+        self.size = 0
+        self.image_type = None
+        self.rejected = None  # 'type' when the content is not an allowed image
+        self.committed = False
+        self._head = b''
+        self._hash = hashlib.sha256()
+        self._file = open(self.path, 'w+b')
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_size:
+            self.discard()
+            raise RequestEntityTooLarge()
+        if self.rejected:
+            return len(data)
+
+        self._hash.update(data)
+        if self.image_type is None:
+            self._head += data
+            if len(self._head) < _SNIFF_BYTES:
+                return len(data)
+            self._check_type()
+            if self.rejected:
+                return len(data)
+            data, self._head = self._head, b''
+        self._file.write(data)
+        return len(data)
+
+    def _check_type(self):
+        self.image_type = sniff_image_type(self._head)
+        if not _EXTENSIONS.get(self.image_type, set()) & set(self.allowed_types):
+            self.rejected = 'type'
+            self.discard()
+
+    def seek(self, offset, whence=0):
+        # The parser rewinds the container once the part is complete
+        if self.image_type is None and not self.rejected:
+            self._check_type()
+            if not self.rejected:
+                self._file.write(self._head)
+                self._head = b''
+        if self._file.closed:
+            return 0
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return 0 if self._file.closed else self._file.tell()
+
+    def read(self, size=-1):
+        return b'' if self._file.closed else self._file.read(size)
+
+    def readline(self, size=-1):
+        return b'' if self._file.closed else self._file.readline(size)
+
+    def flush(self):
+        if not self._file.closed:
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def commit(self, filename):
+        """Move the received file to its final name in the upload folder (no copy)"""
+        if self.rejected:
+            raise ValueError('Rejected uploads cannot be saved')
+        self.seek(0)
+        self._file.close()
+        final_path = os.path.join(self.folder, filename)
+        os.replace(self.path, final_path)
+        self.committed = True
+        return final_path
+
+    def discard(self):
+        """Drop whatever was received"""
+        self._file.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class IngestRequest(Request):
+    """Request class that streams uploaded files into the upload folder"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        from memeqa.utils import get_upload_folder
+
+        folder = get_upload_folder(current_app)
+        os.makedirs(folder, exist_ok=True)
+        stream = UploadStream(
+            folder,
+            current_app.config['MAX_CONTENT_LENGTH'],
+            current_app.config['ALLOWED_EXTENSIONS'],
+        )
+        g.setdefault('upload_streams', []).append(stream)
+        return stream
+
+
+def cleanup_partial_uploads(exc=None):
+    """Teardown: remove partial files the request received but did not save"""
+    for stream in g.pop('upload_streams', []):
+        if not stream.committed:
+            stream.discard()
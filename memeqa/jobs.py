@@ -0,0 +1,264 @@
+# memeqa/jobs.py
+"""Durable background jobs backed by the jobs table.
+
+Request handlers enqueue() work in their own transaction and return; worker
+threads started in each app process (or a separate `flask run-jobs`
+process) claim due jobs one at a time with a single UPDATE ... RETURNING,
+so a job is never handed to two workers, even across processes. Failed
+jobs are retried with exponential backoff until max_attempts, and jobs
+whose worker died are requeued once their lease expires.
+
+Handlers are registered by kind with @handler('kind') and receive the
+decoded payload; they run inside an app context and raise to fail.
+"""
+import json
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+_HANDLERS = {}
+_workers = {}  # pid -> JobWorker
+_workers_lock = threading.Lock()
+
+
+def handler(kind):
+    """Register the function that runs jobs of this kind"""
+    def register(func):
+        _HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(db, kind, payload=None, max_attempts=None, delay=0, unique=False):
+    """Queue a job and return its id. The caller commits, then may call wake().
+
+    With unique=True nothing is queued (and None is returned) while another
+    job of the same kind and payload is still waiting, so bursts collapse
+    into one run.
+    """
+    if kind not in _HANDLERS:
+        raise ValueError(f'No handler registered for job kind {kind!r}')
+    sql = '''
+        INSERT INTO jobs (kind, payload, max_attempts, run_after)
+        SELECT ?, ?, ?, datetime('now', ?)
+    '''
+    payload = json.dumps(payload or {}, sort_keys=True)
+    params = [
+        kind,
+        payload,
+        max_attempts or current_app.config['JOB_MAX_ATTEMPTS'],
+        f'+{int(delay)} seconds',
+    ]
+    if unique:
+        sql += "WHERE NOT EXISTS (SELECT 1 FROM jobs WHERE status = 'queued' AND kind = ? AND payload = ?)"
+        params.extend((kind, payload))
+    cursor = db.execute(sql, params)
+    return cursor.lastrowid if cursor.rowcount else None
+
+
+def job_status(db, job_id):
+    """Return the job row as a dict, or None"""
+    row = db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def queue_stats(db):
+    """Return {status: count} over the jobs table"""
+    rows = db.execute('SELECT status, COUNT(*) AS count FROM jobs GROUP BY status').fetchall()
+    return {row['status']: row['count'] for row in rows}
+
+
+def claim(db, worker_name):
+    """Atomically mark the next due job as running and return it, or None"""
+    row = db.execute('''
+        UPDATE jobs
+        SET status = 'running', attempts = attempts + 1,
+            locked_by = ?, locked_at = CURRENT_TIMESTAMP
+        WHERE id = (
+            SELECT id FROM jobs
+            WHERE status = 'queued' AND run_after <= CURRENT_TIMESTAMP
+            ORDER BY run_after, id
+            LIMIT 1
+        )
+        RETURNING id, kind, payload, attempts, max_attempts
+    ''', (worker_name,)).fetchone()
+    db.commit()
+    return row
+
+
+def requeue_stale(db, lease_seconds):
+    """Put running jobs whose lease expired back in the queue; return how many"""
+    cursor = db.execute('''
+        UPDATE jobs
+        SET status = 'queued', locked_by = NULL, locked_at = NULL
+        WHERE status = 'running' AND locked_at < datetime('now', ?)
+    ''', (f'-{int(lease_seconds)} seconds',))
+    db.commit()
+    return cursor.rowcount
+
+
+def purge_finished(db, retention_seconds, batch_size=1000):
+    """Delete one batch of done and failed jobs that finished over retention_seconds ago; return how many"""
+    cursor = db.execute('''
+        DELETE FROM jobs WHERE id IN (
+            SELECT id FROM jobs
+            WHERE status IN ('done', 'failed') AND finished_at < datetime('now', ?)
+            LIMIT ?
+        )
+    ''', (f'-{int(retention_seconds)} seconds', batch_size))
+    db.commit()
+    return cursor.rowcount
+
+
+def retry_delay(attempts, config):
+    """Seconds to wait before the next attempt: exponential, capped, with jitter"""
+    delay = min(config['JOB_RETRY_BASE_SECONDS'] * 2 ** (attempts - 1), config['JOB_RETRY_MAX_SECONDS'])
+    return delay * random.uniform(0.5, 1.0)
+
+
+def run_next(db, worker_name):
+    """Claim and run one job. Return its id, or None when nothing was due."""
+    job = claim(db, worker_name)
+    if job is None:
+        return None
+
+    try:
+        func = _HANDLERS.get(job['kind'])
+        if func is None:
+            raise LookupError(f"No handler registered for job kind {job['kind']!r}")
+        func(json.loads(job['payload']))
+    except Exception as e:
+        db.rollback()
+        error = f'{type(e).__name__}: {e}'
+        if job['attempts'] < job['max_attempts']:
+            delay = retry_delay(job['attempts'], current_app.config)
+            db.execute('''
+                UPDATE jobs
+                SET status = 'queued', locked_by = NULL, locked_at = NULL,
+                    last_error = ?, run_after = datetime('now', ?)
+                WHERE id = ?
+            ''', (error, f'+{int(delay)} seconds', job['id']))
+        else:
+            db.execute('''
+                UPDATE jobs
+                SET status = 'failed', locked_by = NULL, last_error = ?, finished_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (error, job['id']))
+        current_app.logger.error(f"Job {job['id']} ({job['kind']}) attempt {job['attempts']} failed: "
+                                 f"{error}\n{traceback.format_exc()}")
+    else:
+        db.execute('''
+            UPDATE jobs
+            SET status = 'done', locked_by = NULL, last_error = NULL, finished_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (job['id'],))
+    db.commit()
+    return job['id']
+
+
+class JobWorker:
+    """A pool of threads draining the jobs table for one app process"""
+
+    def __init__(self, app, threads, poll_interval, lease_seconds, retention_seconds):
+        self.app = app
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.retention_seconds = retention_seconds
+        self.name = f'{socket.gethostname()}:{os.getpid()}'
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.threads):
+            thread = threading.Thread(target=self._run, args=(f'{self.name}:{i}',),
+                                      name=f'memeqa-jobs-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _run(self, worker_name):
+        from memeqa.database import get_db
+
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    db = get_db()
+                    ran = run_next(db, worker_name)
+                    if ran is None:
+                        requeue_stale(db, self.lease_seconds)
+                        purge_finished(db, self.retention_seconds)
+            except Exception as e:
+                # Database trouble; back off instead of spinning
+                self.app.logger.error(f'Job worker {worker_name} error: {e}')
+                ran = None
+            if ran is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+
+def start_workers(app):
+    """Start this process's worker threads once; a no-op when JOB_WORKERS is 0"""
+    pid = os.getpid()
+    if pid in _workers or not app.config['JOB_WORKERS']:
+        return
+    with _workers_lock:
+        if pid not in _workers:
+            worker = JobWorker(app, app.config['JOB_WORKERS'], app.config['JOB_POLL_INTERVAL'],
+                               app.config['JOB_LEASE_SECONDS'], app.config['JOB_RETENTION_SECONDS'])
+            worker.start()
+            _workers[pid] = worker
+
+
+def wake():
+    """Nudge this process's workers after committing new jobs"""
+    worker = _workers.get(os.getpid())
+    if worker is not None:
+        worker.wake()
+
+
+@click.command('run-jobs')
+@click.option('--threads', default=1, show_default=True, help='Worker threads.')
+@click.option('--once', is_flag=True, help='Exit when no job is due instead of polling.')
+@with_appcontext
+def run_jobs_command(threads, once):
+    """Process background jobs in the foreground."""
+    from memeqa.database import get_db
+
+    app = current_app._get_current_object()
+    if once:
+        db = get_db()
+        requeue_stale(db, app.config['JOB_LEASE_SECONDS'])
+        count = 0
+        while run_next(db, f'{socket.gethostname()}:{os.getpid()}:cli') is not None:
+            count += 1
+        while purge_finished(db, app.config['JOB_RETENTION_SECONDS']):
+            pass
+        click.echo(f'{count} jobs run, queue: {queue_stats(db)}')
+        return
+
+    worker = JobWorker(app, threads, app.config['JOB_POLL_INTERVAL'], app.config['JOB_LEASE_SECONDS'],
+                       app.config['JOB_RETENTION_SECONDS'])
+    worker.start()
+    click.echo(f'Processing jobs with {threads} thread(s), Ctrl+C to stop')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        worker.stop()
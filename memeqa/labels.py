@@ -0,0 +1,130 @@
+# memeqa/labels.py
+"""Label bitmasks, and the scoring done while serving requests.
+
+Humor types and emotions are encoded as bitmasks over Config.HUMOR_TYPES
+and Config.EMOTIONS_TYPES (one bit per label, unknown labels dropped).
+score_evaluation() scores the single evaluation evaluate_meme just saved
+with plain int masks; batches and per-meme agreement are NumPy work in
+memeqa/scoring.py, imported only by the job and the command below, so
+serving requests never needs NumPy. A process loads it when it first
+runs a 'scoring.meme' job (JOB_WORKERS=0 plus `flask run-jobs` keeps it
+out of web workers altogether).
+"""
+import json
+import math
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from memeqa import jobs
+from memeqa import meme_stats
+
+
+class LabelSet:
+    """Bit positions of a fixed label vocabulary"""
+
+    def __init__(self, labels):
+        if len(labels) > 64:
+            raise ValueError('At most 64 labels fit in a mask')
+        self.labels = list(labels)
+        self.bits = {label: 1 << i for i, label in enumerate(self.labels)}
+
+    def mask(self, value):
+        """Mask of a JSON array (or single label) of labels; None when nothing was chosen"""
+        if value is None or value == '':
+            return None
+        try:
+            labels = json.loads(value)
+        except (TypeError, ValueError):
+            labels = value
+        if isinstance(labels, str):
+            labels = [labels]
+        if not isinstance(labels, list) or not labels:
+            return None
+        mask = 0
+        for label in labels:
+            mask |= self.bits.get(label, 0)
+        return mask
+
+
+def label_sets(config):
+    humor = LabelSet([humor['type'] for humor in config['HUMOR_TYPES']])
+    emotions = LabelSet([emotion['emotion'] for emotion in config['EMOTIONS_TYPES']])
+    return humor, emotions
+
+
+def score_evaluation(db, evaluation_id):
+    """Score one evaluation against its meme's labels, as scoring.score_evaluations does a batch"""
+    config = current_app.config
+    humor, emotions = label_sets(config)
+    row = db.execute('''
+        SELECT e.evaluated_humor_type, e.evaluated_emotions, m.humor_type, m.emotions_conveyed
+        FROM evaluations AS e
+        JOIN memes AS m ON m.id = e.meme_id
+        WHERE e.id = ?
+    ''', (evaluation_id,)).fetchone()
+    if row is None:
+        return
+
+    eval_humor, meme_humor = humor.mask(row['evaluated_humor_type']), humor.mask(row['humor_type'])
+    eval_emotions, meme_emotions = emotions.mask(row['evaluated_emotions']), emotions.mask(row['emotions_conveyed'])
+    humor_present = eval_humor is not None and meme_humor is not None
+    emotions_present = eval_emotions is not None and meme_emotions is not None
+
+    matches_humor = humor_present and (eval_humor & meme_humor) != 0
+    emotion_jaccard = None
+    if emotions_present and eval_emotions | meme_emotions:
+        emotion_jaccard = (eval_emotions & meme_emotions).bit_count() / (eval_emotions | meme_emotions).bit_count()
+    correct = matches_humor and emotion_jaccard is not None \
+        and emotion_jaccard >= config['SCORING_EMOTION_THRESHOLD']
+
+    db.execute('''
+        UPDATE evaluations
+        SET matches_humor_type = ?, emotion_overlap_score = ?, was_correct = ?
+        WHERE id = ?
+    ''', (
+        matches_humor if humor_present else None,
+        emotion_jaccard,
+        correct if humor_present and emotions_present else None,
+        evaluation_id,
+    ))
+
+
+@jobs.handler('scoring.meme')
+def meme_agreement_job(payload):
+    """Refresh one meme's agreement after an evaluation, queued by evaluate_meme"""
+    from memeqa import scoring
+    from memeqa.database import get_db
+
+    db = get_db()
+    results, _ = scoring.agreement(db, [payload['meme_id']])
+    scoring.store_agreement(db, results)
+    db.commit()
+
+
+@click.command('score-evaluations')
+@click.option('--batch-size', default=5000, show_default=True, help='Evaluations scored per transaction.')
+@with_appcontext
+def score_evaluations_command(batch_size):
+    """Score every evaluation and recompute per-meme agreement in one pass."""
+    from memeqa import scoring
+    from memeqa.database import get_db
+
+    db = get_db()
+    scored, last_id = 0, 0
+    while True:
+        ids = scoring.score_evaluations(db, after_id=last_id, limit=batch_size)
+        db.commit()
+        if not ids:
+            break
+        scored += len(ids)
+        last_id = ids[-1]
+
+    results, dataset = scoring.agreement(db)
+    scoring.store_agreement(db, results)
+    meme_stats.schedule(db)  # was_correct changed under meme_analytics
+    db.commit()
+    click.echo(f'{scored} evaluations scored, agreement stored for {len(results)} memes')
+    for name, value in dataset.items():
+        click.echo(f"{name}: {'n/a' if math.isnan(value) else f'{value:.3f}'}")
@@ -0,0 +1,68 @@
+# memeqa/login_tokens.py
+"""Signed, single-use login links.
+
+A token is an itsdangerous URLSafeTimedSerializer signature (HMAC-SHA1
+over the email, a nonce and the issue time), so verifying one is a
+constant-time signature check and never touches the database. Tokens are
+signed with SECRET_KEY and still accepted under SECRET_KEY_FALLBACKS, so
+the key can be rotated without breaking links already sent.
+
+Each token works once: the nonces of used tokens are remembered in a TTL
+cache until they would have expired anyway. The nonce rather than the
+token string is the key, since several base64 spellings of a token
+decode to the same signature. The cache lives in the worker process,
+so with several workers a link could in theory be replayed once per
+worker within LOGIN_TOKEN_MAX_AGE.
+"""
+import hmac
+import secrets
+import threading
+
+from cachetools import TTLCache
+from flask import current_app
+from itsdangerous import BadData, URLSafeTimedSerializer
+
+SALT = 'memeqa-login'
+
+_used = None
+_used_lock = threading.Lock()
+
+
+def _serializer(config):
+    # itsdangerous signs with the last key and accepts all of them
+    keys = [*config.get('SECRET_KEY_FALLBACKS', []), config['SECRET_KEY']]
+    return URLSafeTimedSerializer(keys, salt=SALT)
+
+
+def _used_tokens():
+    global _used
+    if _used is None:
+        config = current_app.config
+        _used = TTLCache(maxsize=config['LOGIN_TOKEN_REPLAY_CACHE_SIZE'], ttl=config['LOGIN_TOKEN_MAX_AGE'])
+    return _used
+
+
+def generate_login_token(email):
+    """Return a login token for email, valid for LOGIN_TOKEN_MAX_AGE seconds"""
+    return _serializer(current_app.config).dumps({'email': email, 'nonce': secrets.token_urlsafe(8)})
+
+
+def verify_login_token(token, email):
+    """Check a token was issued for email, is unexpired and unused, and mark it used"""
+    config = current_app.config
+    try:
+        payload = _serializer(config).loads(token, max_age=config['LOGIN_TOKEN_MAX_AGE'])
+    except BadData:
+        return False
+    if not isinstance(payload, dict) or not isinstance(payload.get('email'), str) \
+            or not isinstance(payload.get('nonce'), str):
+        return False
+    if not hmac.compare_digest(payload['email'].encode(), email.encode()):
+        return False
+
+    with _used_lock:
+        used = _used_tokens()
+        if payload['nonce'] in used:
+            return False
+        used[payload['nonce']] = True
+    return True
@@ -0,0 +1,267 @@
+# memeqa/mailer.py
+"""Outgoing email through the email_outbox table.
+
+Requests only insert into the outbox (queue_email) and return; the
+'mail.flush' job, queued at most once at a time, claims due messages in
+batches of MAIL_BATCH_SIZE and sends them over one SMTP connection per
+worker thread, kept open between batches until it has been idle for
+MAIL_SMTP_IDLE_SECONDS. A message that fails is retried with exponential
+backoff, or given up on after its max_attempts or a permanent (5xx)
+rejection. In DEVELOPMENT messages are printed instead of sent, as before.
+"""
+import os
+import random
+import smtplib
+import threading
+import time
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from memeqa import jobs
+
+_connections = {}  # (pid, thread ident) -> SMTPConnection
+_connections_lock = threading.Lock()
+
+
+class SMTPConnection:
+    """An SMTP session reused across messages and batches"""
+
+    def __init__(self, host, port, username=None, password=None, starttls=True, timeout=10, idle_seconds=60):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.idle_seconds = idle_seconds
+        self._smtp = None
+        self._last_used = 0.0
+        self.opened = 0
+
+    def _open(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                smtp.starttls()
+            if self.username and self.password:
+                smtp.login(self.username, self.password)
+        except BaseException:
+            smtp.close()
+            raise
+        self.opened += 1
+        return smtp
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except smtplib.SMTPException:
+                self._smtp.close()
+            except OSError:
+                pass
+            self._smtp = None
+
+    def send(self, msg):
+        """Send one message, reconnecting once if the server dropped an idle session"""
+        if self._smtp is not None and time.monotonic() - self._last_used > self.idle_seconds:
+            self.close()  # the server has most likely timed the session out
+        for attempt in (1, 2):
+            if self._smtp is None:
+                self._smtp = self._open()
+            try:
+                self._smtp.send_message(msg)
+                return
+            except smtplib.SMTPServerDisconnected:
+                self._smtp = None
+                if attempt == 2:
+                    raise
+            finally:
+                if self._smtp is not None:
+                    self._last_used = time.monotonic()  # the server answered, even if it refused
+
+
+def get_connection(config):
+    """This thread's SMTP connection for the configured server"""
+    key = (os.getpid(), threading.get_ident())
+    connection = _connections.get(key)
+    if connection is None:
+        with _connections_lock:
+            connection = _connections[key] = SMTPConnection(
+                config['MAIL_SMTP_HOST'], config['MAIL_SMTP_PORT'],
+                config['MAIL_USERNAME'], config['MAIL_PASSWORD'],
+                starttls=config['MAIL_SMTP_STARTTLS'],
+                timeout=config['MAIL_SMTP_TIMEOUT'],
+                idle_seconds=config['MAIL_SMTP_IDLE_SECONDS'],
+            )
+    return connection
+
+
+def build_message(sender, row):
+    msg = MIMEMultipart()
+    msg['From'] = sender
+    msg['To'] = row['to_email']
+    msg['Subject'] = row['subject']
+    msg.attach(MIMEText(row['body'], 'plain'))
+    return msg
+
+
+def queue_email(db, to_email, subject, body):
+    """Put an email in the outbox and make sure it gets sent; the caller commits, then calls jobs.wake()"""
+    cursor = db.execute('''
+        INSERT INTO email_outbox (to_email, subject, body, max_attempts)
+        VALUES (?, ?, ?, ?)
+    ''', (to_email, subject, body, current_app.config['MAIL_MAX_ATTEMPTS']))
+    jobs.enqueue(db, 'mail.flush', unique=True)
+    return cursor.lastrowid
+
+
+def claim_batch(db, batch_size, lease_seconds):
+    """Mark the next due messages as sending and return them"""
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        # Messages of a sender that died mid-batch go back in the queue
+        db.execute('''
+            UPDATE email_outbox SET status = 'queued', locked_at = NULL
+            WHERE status = 'sending' AND locked_at < datetime('now', ?)
+        ''', (f'-{int(lease_seconds)} seconds',))
+        rows = db.execute('''
+            UPDATE email_outbox
+            SET status = 'sending', attempts = attempts + 1, locked_at = CURRENT_TIMESTAMP
+            WHERE id IN (
+                SELECT id FROM email_outbox
+                WHERE status = 'queued' AND run_after <= CURRENT_TIMESTAMP
+                ORDER BY run_after, id
+                LIMIT ?
+            )
+            RETURNING id, to_email, subject, body, attempts, max_attempts
+        ''', (batch_size,)).fetchall()
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    return sorted(rows, key=lambda row: row['id'])
+
+
+def retry_delay(attempts, config):
+    """Seconds before the next attempt: exponential, capped, with jitter"""
+    delay = min(config['MAIL_RETRY_BASE_SECONDS'] * 2 ** (attempts - 1), config['MAIL_RETRY_MAX_SECONDS'])
+    return delay * random.uniform(0.5, 1.0)
+
+
+def _permanent(error):
+    """5xx replies will not change on retry; 4xx and network errors might"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+
+def deliver(rows, config):
+    """Send a batch; return {id: None on success, or the exception}"""
+    results = {}
+    if config.get('DEVELOPMENT'):
+        for row in rows:
+            print("=" * 50)
+            print(f"EMAIL TO: {row['to_email']}")
+            print(f"SUBJECT: {row['subject']}")
+            print(f"BODY:\n{row['body']}")
+            print("=" * 50)
+            results[row['id']] = None
+        return results
+
+    connection = get_connection(config)
+    sender = config['MAIL_SENDER'] or config['MAIL_USERNAME']
+    for row in rows:
+        try:
+            connection.send(build_message(sender, row))
+            results[row['id']] = None
+        except (smtplib.SMTPException, OSError) as e:
+            results[row['id']] = e
+            if not isinstance(e, (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)):
+                # The session itself failed: leave the rest of the batch for the retry
+                connection.close()
+                for rest in rows[len(results):]:
+                    results[rest['id']] = e
+                break
+    return results
+
+
+def flush_outbox(db, config):
+    """Send one batch of due messages; return how many were claimed"""
+    rows = claim_batch(db, config['MAIL_BATCH_SIZE'], config['JOB_LEASE_SECONDS'])
+    if not rows:
+        return 0
+    results = deliver(rows, config)
+
+    sent, retry, failed = [], [], []
+    for row in rows:
+        error = results[row['id']]
+        if error is None:
+            sent.append((row['id'],))
+        elif _permanent(error) or row['attempts'] >= row['max_attempts']:
+            failed.append((f'{type(error).__name__}: {error}', row['id']))
+        else:
+            delay = retry_delay(row['attempts'], config)
+            retry.append((f'{type(error).__name__}: {error}', f'+{int(delay)} seconds', row['id']))
+    db.executemany('''
+        UPDATE email_outbox
+        SET status = 'sent', locked_at = NULL, last_error = NULL, sent_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    ''', sent)
+    db.executemany('''
+        UPDATE email_outbox
+        SET status = 'queued', locked_at = NULL, last_error = ?, run_after = datetime('now', ?)
+        WHERE id = ?
+    ''', retry)
+    db.executemany('''
+        UPDATE email_outbox SET status = 'failed', locked_at = NULL, last_error = ? WHERE id = ?
+    ''', failed)
+    db.commit()
+    if retry or failed:
+        current_app.logger.warning(f'Email batch: {len(sent)} sent, {len(retry)} to retry, {len(failed)} failed')
+    return len(rows)
+
+
+def outbox_stats(db):
+    """Queue depth: {status: count} plus the age in seconds of the oldest queued message"""
+    stats = {
+        row['status']: row['count']
+        for row in db.execute('SELECT status, COUNT(*) AS count FROM email_outbox GROUP BY status')
+    }
+    oldest = db.execute('''
+        SELECT (julianday('now') - julianday(MIN(created_at))) * 86400 AS age
+        FROM email_outbox WHERE status = 'queued'
+    ''').fetchone()['age']
+    stats['oldest_queued_seconds'] = round(oldest) if oldest is not None else None
+    return stats
+
+
+@jobs.handler('mail.flush')
+def flush_job(payload):
+    """Drain the due part of the outbox, then schedule a run for the next retry"""
+    from memeqa.database import get_db
+
+    config = current_app.config
+    db = get_db()
+    while flush_outbox(db, config):
+        pass
+    wait = db.execute('''
+        SELECT (julianday(MIN(run_after)) - julianday('now')) * 86400 AS wait
+        FROM email_outbox WHERE status = 'queued'
+    ''').fetchone()['wait']
+    if wait is not None:
+        jobs.enqueue(db, 'mail.flush', delay=max(0, wait) + 1, unique=True)
+        db.commit()
+
+
+@click.command('mail-stats')
+@with_appcontext
+def mail_stats_command():
+    """Show the email outbox queue depth."""
+    from memeqa.database import get_db
+
+    for name, value in outbox_stats(get_db()).items():
+        click.echo(f'{name}: {value}')
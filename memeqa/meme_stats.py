@@ -0,0 +1,192 @@
+# memeqa/meme_stats.py
+"""Per-meme evaluation statistics in meme_analytics.
+
+Triggers on evaluations log every change as signed rows in
+meme_analytics_pending (migrations/0007_meme_analytics_running_stats.sql),
+so evaluate_meme pays one extra INSERT and never reads the stats it
+affects. The 'meme_stats.fold' job, queued by evaluate_meme at most once
+at a time, folds the log into meme_analytics in batches: one read of the
+affected rows, Welford updates in Python (an edit is a removal plus an
+addition), one UPSERT per meme and a delete of the folded log rows, all
+in one write transaction.
+"""
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from memeqa import jobs
+
+UPSERT_SQL = '''
+    INSERT INTO meme_analytics (
+        meme_id, total_evaluations, judged_evaluations, correct_identifications, accuracy_rate,
+        difficulty_score, timed_evaluations, avg_evaluation_time, evaluation_time_m2, last_updated
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT (meme_id) DO UPDATE SET
+        total_evaluations = excluded.total_evaluations,
+        judged_evaluations = excluded.judged_evaluations,
+        correct_identifications = excluded.correct_identifications,
+        accuracy_rate = excluded.accuracy_rate,
+        difficulty_score = excluded.difficulty_score,
+        timed_evaluations = excluded.timed_evaluations,
+        avg_evaluation_time = excluded.avg_evaluation_time,
+        evaluation_time_m2 = excluded.evaluation_time_m2,
+        last_updated = CURRENT_TIMESTAMP
+'''
+
+# Recomputes meme_analytics from evaluations (also the initial fill in migration 0007)
+REBUILD_SQL = '''
+    INSERT INTO meme_analytics (
+        meme_id, total_evaluations, judged_evaluations, correct_identifications, accuracy_rate,
+        difficulty_score, timed_evaluations, avg_evaluation_time, evaluation_time_m2
+    )
+    SELECT meme_id,
+           COUNT(*),
+           COUNT(was_correct),
+           COUNT(CASE WHEN was_correct THEN 1 END),
+           COALESCE(AVG(CASE WHEN was_correct THEN 1.0 WHEN was_correct IS NOT NULL THEN 0.0 END), 0.0),
+           COALESCE(1.0 - AVG(CASE WHEN was_correct THEN 1.0 WHEN was_correct IS NOT NULL THEN 0.0 END), 0.0),
+           COUNT(t),
+           COALESCE(AVG(t), 0.0),
+           COALESCE(SUM((t - mean_t) * (t - mean_t)), 0.0)
+    FROM (
+        SELECT meme_id, was_correct, t, AVG(t) OVER (PARTITION BY meme_id) AS mean_t
+        FROM (
+            SELECT meme_id, was_correct,
+                   CASE WHEN typeof(evaluation_time_seconds) IN ('integer', 'real')
+                        THEN evaluation_time_seconds END AS t
+            FROM evaluations
+        )
+    )
+    GROUP BY meme_id
+'''
+
+
+def _number(value):
+    # evaluation_time_seconds comes from a form field and may hold '' or text
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+class MemeStats:
+    """Running statistics of one meme's evaluations"""
+
+    def __init__(self, row=None):
+        self.total = row['total_evaluations'] if row else 0
+        self.judged = row['judged_evaluations'] if row else 0
+        self.correct = row['correct_identifications'] if row else 0
+        self.timed = row['timed_evaluations'] if row else 0
+        self.mean_time = row['avg_evaluation_time'] if row else 0.0
+        self.m2_time = row['evaluation_time_m2'] if row else 0.0
+
+    def add(self, was_correct, seconds):
+        self.total += 1
+        if was_correct is not None:
+            self.judged += 1
+            self.correct += bool(was_correct)
+        seconds = _number(seconds)
+        if seconds is not None:
+            # Welford's update
+            self.timed += 1
+            delta = seconds - self.mean_time
+            self.mean_time += delta / self.timed
+            self.m2_time += delta * (seconds - self.mean_time)
+
+    def remove(self, was_correct, seconds):
+        self.total = max(0, self.total - 1)
+        if was_correct is not None and self.judged:
+            self.judged -= 1
+            self.correct = max(0, self.correct - bool(was_correct))
+        seconds = _number(seconds)
+        if seconds is not None and self.timed:
+            # Welford's update run backwards
+            if self.timed == 1:
+                self.timed, self.mean_time, self.m2_time = 0, 0.0, 0.0
+            else:
+                mean_before = (self.timed * self.mean_time - seconds) / (self.timed - 1)
+                self.m2_time = max(0.0, self.m2_time - (seconds - mean_before) * (seconds - self.mean_time))
+                self.mean_time = mean_before
+                self.timed -= 1
+
+    @property
+    def accuracy(self):
+        return self.correct / self.judged if self.judged else 0.0
+
+    @property
+    def time_variance(self):
+        """Sample variance of the evaluation time, None below two timed evaluations"""
+        return self.m2_time / (self.timed - 1) if self.timed > 1 else None
+
+    def row(self, meme_id):
+        accuracy = self.accuracy
+        return (meme_id, self.total, self.judged, self.correct, accuracy,
+                1.0 - accuracy if self.judged else 0.0,
+                self.timed, self.mean_time, self.m2_time)
+
+
+def fold_pending(db, batch_size=500):
+    """Fold one batch of logged evaluation changes into meme_analytics; return how many"""
+    db.execute('BEGIN IMMEDIATE')  # concurrent folds must not read the same log rows
+    try:
+        changes = db.execute('''
+            SELECT id, meme_id, sign, was_correct, evaluation_time
+            FROM meme_analytics_pending ORDER BY id LIMIT ?
+        ''', (batch_size,)).fetchall()
+        if not changes:
+            db.commit()
+            return 0
+
+        meme_ids = sorted({change['meme_id'] for change in changes})
+        placeholders = ', '.join('?' * len(meme_ids))
+        stats = {
+            row['meme_id']: MemeStats(row)
+            for row in db.execute(f'SELECT * FROM meme_analytics WHERE meme_id IN ({placeholders})', meme_ids)
+        }
+        for change in changes:
+            meme_stats = stats.setdefault(change['meme_id'], MemeStats())
+            if change['sign'] > 0:
+                meme_stats.add(change['was_correct'], change['evaluation_time'])
+            else:
+                meme_stats.remove(change['was_correct'], change['evaluation_time'])
+
+        db.executemany(UPSERT_SQL, [meme_stats.row(meme_id) for meme_id, meme_stats in stats.items()])
+        db.execute('DELETE FROM meme_analytics_pending WHERE id <= ?', (changes[-1]['id'],))
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    return len(changes)
+
+
+def schedule(db):
+    """Make sure a fold runs soon; called in the transaction that changed evaluations"""
+    jobs.enqueue(db, 'meme_stats.fold', delay=current_app.config['MEME_STATS_FOLD_DELAY'], unique=True)
+
+
+@jobs.handler('meme_stats.fold')
+def fold_job(payload):
+    """Drain the change log in MEME_STATS_BATCH_SIZE batches"""
+    from memeqa.database import get_db
+
+    db = get_db()
+    while fold_pending(db, current_app.config['MEME_STATS_BATCH_SIZE']):
+        pass
+
+
+def rebuild(db):
+    """Recompute meme_analytics from evaluations; the caller commits"""
+    db.execute('DELETE FROM meme_analytics_pending')
+    db.execute('DELETE FROM meme_analytics')
+    db.execute(REBUILD_SQL)
+
+
+@click.command('rebuild-meme-stats')
+@with_appcontext
+def rebuild_meme_stats_command():
+    """Recompute meme_analytics from the evaluations table."""
+    from memeqa.database import get_db
+
+    db = get_db()
+    db.execute('BEGIN IMMEDIATE')
+    rebuild(db)
+    db.commit()
+    count = db.execute('SELECT COUNT(*) AS count FROM meme_analytics').fetchone()['count']
+    click.echo(f'meme_analytics rebuilt for {count} memes')
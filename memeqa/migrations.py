@@ -0,0 +1,92 @@
+# memeqa/migrations.py
+"""Versioned schema migrations.
+
+Migrations are the numbered SQL files in migrations/ (NNNN_description.sql).
+The number of the last one applied is stored in PRAGMA user_version, so a
+database that is already current costs a single PRAGMA read at startup.
+Pending migrations are applied under an exclusive lock; a worker that had
+to wait for the lock re-reads the version and skips what another worker
+already applied.
+"""
+import os
+import re
+import sqlite3
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+
+_FILENAME = re.compile(r'^(\d+)_(\w+)\.sql$')
+
+
+def load_migrations(directory=MIGRATIONS_DIR):
+    """Return [(version, name, path)] sorted by version"""
+    migrations = []
+    for filename in os.listdir(directory):
+        match = _FILENAME.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(directory, filename)))
+    migrations.sort()
+    return migrations
+
+
+def split_statements(script):
+    """Split a SQL script into complete statements (CREATE TRIGGER bodies stay whole)"""
+    statement = ''
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            if statement.strip():
+                yield statement.strip()
+            statement = ''
+    if statement.strip() and not all(l.strip().startswith('--') for l in statement.splitlines() if l.strip()):
+        raise ValueError(f'Incomplete SQL statement: {statement.strip()[:80]}')
+
+
+def schema_version(db):
+    return db.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(db, directory=MIGRATIONS_DIR):
+    """Apply pending migrations and return the [(version, name)] applied"""
+    migrations = load_migrations(directory)
+    if not migrations or schema_version(db) >= migrations[-1][0]:
+        return []
+
+    applied = []
+    isolation_level = db.isolation_level
+    db.isolation_level = None  # we manage the transaction ourselves
+    try:
+        db.execute('BEGIN EXCLUSIVE')
+        version = schema_version(db)
+        for number, name, path in migrations:
+            if number <= version:
+                continue
+            with open(path, encoding='utf8') as f:
+                for statement in split_statements(f.read()):
+                    db.execute(statement)
+            db.execute(f'PRAGMA user_version = {number}')
+            applied.append((number, name))
+        db.execute('COMMIT')
+    except BaseException:
+        if db.in_transaction:
+            db.execute('ROLLBACK')
+        raise
+    finally:
+        db.isolation_level = isolation_level
+    return applied
+
+
+@click.command('migrate-db')
+@with_appcontext
+def migrate_db_command():
+    """Apply pending schema migrations (run ahead of deploys)."""
+    from memeqa.database import get_db
+
+    db = get_db()
+    applied = migrate(db)
+    for number, name in applied:
+        click.echo(f'Applied {number:04d}_{name}')
+    click.echo(f"Database {current_app.config['DATABASE_PATH']} is at schema version {schema_version(db)}")
@@ -0,0 +1,249 @@
+# memeqa/query_audit.py
+"""EXPLAIN QUERY PLAN audit of the app's hot SQL statements.
+
+HOT_QUERIES lists the statements that run on every page view or form
+submit, with representative parameters. Statements built by helper modules
+are taken from those modules; inline route SQL is mirrored here and has to
+be updated together with the route. `flask audit-queries` fails when any of
+them reads a table without an index (a plain `SCAN <table>` step).
+Intentional scans are listed per query in `allow_scan`.
+"""
+import re
+
+import click
+from flask.cli import with_appcontext
+
+from memeqa import aggregates
+from memeqa import export
+from memeqa import gallery
+from memeqa.selector import pairs_query
+
+_TABLE_SCAN = re.compile(r'^SCAN (\w+)(?: AS \w+)?$')
+
+USER = {'actor': 'user:1', 'actor_value': 1, 'meme_id': 1, 'max_descriptions': 4}
+SESSION = {'actor': 'session:s', 'actor_value': 's', 'meme_id': 1, 'max_descriptions': 4}
+GALLERY = {'user_id': 1, 'limit': 5, 'offset': 0, 'key_date': '2025-01-01 00:00:00', 'key_id': 1}
+
+HOT_QUERIES = {
+    # --- evaluations.evaluate / evaluation_queue ---
+    'queue.pick': (
+        '''SELECT meme_id, description_id, sort_key FROM evaluation_queue
+           WHERE actor = ? AND sort_key > ? ORDER BY sort_key LIMIT 1''',
+        ('user:1', 0),
+    ),
+    'queue.position': ('SELECT last_sort_key FROM evaluation_queue_actors WHERE actor = ?', ('user:1',)),
+    'queue.refresh_user': (pairs_query('user_id', ':actor_value', ':actor', meme_filter='AND m.id = :meme_id'), USER),
+    'queue.refresh_session': (pairs_query('session_id', ':actor_value', ':actor', meme_filter='AND m.id = :meme_id'), SESSION),
+    'queue.refresh_all': (
+        pairs_query('user_id', 'a.user_id', 'a.actor', actors_from='evaluation_queue_actors a JOIN',
+                    meme_filter='AND m.id = :meme_id'),
+        USER,
+        {'a'},  # evaluation_queue_actors: fans out to every materialised queue by design
+    ),
+    'queue.drop': ('DELETE FROM evaluation_queue WHERE actor = ?', ('user:1',)),
+    'evaluate.description_count': ('SELECT COUNT(*) AS count FROM meme_descriptions WHERE meme_id = ?', (1,)),
+    'evaluate.status': ('''
+        SELECT evaluated_humor_type, evaluated_emotions, evaluated_context_level, de.vote
+        FROM evaluations e
+        LEFT JOIN description_evaluations de ON e.meme_id = de.meme_id
+        WHERE e.meme_id = ? AND e.user_id = ?
+        AND (de.description_id = ? OR (? = -1 AND de.description_id IS NULL))
+    ''', (1, 1, 1, 1)),
+
+    # --- evaluations.evaluate_meme ---
+    'evaluate_meme.existing': (
+        'SELECT * FROM evaluations WHERE meme_id = ? AND ((user_id = ?) OR (session_id = ?))', (1, 1, 's'),
+    ),
+    'evaluate_meme.existing_like': ('SELECT id FROM meme_likes WHERE meme_id = ? AND ((user_id = ?))', (1, 1)),
+    'evaluate_meme.existing_vote': (
+        'SELECT id FROM description_evaluations WHERE description_id = ? AND ((user_id = ?) OR (session_id = ?))',
+        (1, 1, 's'),
+    ),
+
+    # --- utils.AppSession ---
+    'session.user_stats': (
+        'SELECT total_submissions, total_evaluations, evaluation_accuracy FROM users WHERE id = ?', (1,),
+    ),
+    'session.anon_uploads': ('SELECT COUNT(*) as count FROM memes WHERE session_id = ? AND user_id IS NULL', ('s',)),
+    'session.anon_evaluations': (
+        'SELECT COUNT(*) as count FROM evaluations WHERE session_id = ? AND user_id IS NULL', ('s',),
+    ),
+    'session.own_memes_user': ('SELECT COUNT(*) as count FROM memes WHERE user_id = ?', (1,)),
+    'session.own_memes_anon': ('SELECT COUNT(*) as count FROM memes WHERE session_id = ? AND user_id IS NULL', ('s',)),
+    'session.total_memes': ('SELECT COUNT(*) as count FROM memes', ()),
+
+    # --- main.index ---
+    'index.evaluation_count': ('SELECT COUNT(*) as count FROM evaluations WHERE session_id = ?', ('s',)),
+    'index.top_uploaders': (
+        'SELECT name, total_submissions FROM users WHERE is_active = 1 ORDER BY total_submissions DESC LIMIT 5', (),
+    ),
+    'index.top_evaluators': (
+        'SELECT name, total_evaluations FROM users WHERE is_active = 1 ORDER BY total_evaluations DESC LIMIT 5', (),
+    ),
+
+    # --- main.analytics / main.stats ---
+    'analytics.counters': (aggregates.COUNTERS_QUERY, ()),
+    'analytics.breakdowns': (aggregates.BREAKDOWNS_QUERY, ()),
+    'analytics.hardest': (aggregates.RANKING_QUERY.format(order='ASC'), {'limit': 10}),
+    'analytics.easiest': (aggregates.RANKING_QUERY.format(order='DESC'), {'limit': 10}),
+
+    # --- main.export_data / flask export-data ---
+    **{
+        f'export.{table}': (export.page_query(table), {'after': 0, 'limit': 1000})
+        for table in export.TABLES
+    },
+    **{
+        f'export.{table}_changed_rows': (export.rows_query(table, 3), (1, 2, 3))
+        for table in export.TABLES
+    },
+    'export.changes': (
+        export.CHANGES_QUERY, {'source': 'memes', 'since': 0, 'until': 100, 'limit': 1000},
+    ),
+    'export.watermark': ('SELECT COALESCE(MAX(seq), 0) AS seq FROM change_log', ()),
+
+    # --- memes.gallery ---
+    **{
+        f'gallery.{filter_type}_{seek or "offset"}{"_total" if with_total else ""}': (
+            gallery.page_query(filter_type, seek, with_total), GALLERY,
+            {'f'} if with_total else set(),  # the counted, already filtered rows
+        )
+        for filter_type in gallery.FILTERS
+        for seek in (None, 'after', 'before')
+        for with_total in (False, True)
+    },
+    **{
+        f'gallery.{filter_type}_count': (
+            f'SELECT COUNT(*) AS count FROM memes AS m WHERE {gallery.FILTERS[filter_type]}', GALLERY,
+        )
+        for filter_type in gallery.FILTERS
+    },
+
+    # --- memes.upload_file fingerprints ---
+    'upload.duplicate': ('SELECT id FROM memes WHERE content_hash = ? LIMIT 1', ('0' * 64,)),
+    'upload.similar': ('''
+        WITH probes (band, value) AS (VALUES (?, ?), (?, ?))
+        SELECT DISTINCT m.id, m.dhash
+        FROM probes AS p
+        JOIN meme_dhash_bands AS b ON b.band = p.band AND b.value = p.value
+        JOIN memes AS m ON m.id = b.meme_id
+    ''', (0, 1, 1, 2), {'p'}),  # p: the probe values themselves
+
+    # --- jobs (enqueue from evaluate_meme, worker loop) ---
+    'jobs.claim': ('''
+        SELECT id FROM jobs
+        WHERE status = 'queued' AND run_after <= CURRENT_TIMESTAMP
+        ORDER BY run_after, id
+        LIMIT 1
+    ''', ()),
+    'mailer.claim': (
+        '''SELECT id FROM email_outbox WHERE status = 'queued' AND run_after <= CURRENT_TIMESTAMP
+           ORDER BY run_after, id LIMIT ?''', (50,),
+    ),
+    'mailer.requeue_stale': (
+        "SELECT id FROM email_outbox WHERE status = 'sending' AND locked_at < datetime('now', ?)", ('-600 seconds',),
+    ),
+    'jobs.enqueue_unique': (
+        "SELECT 1 FROM jobs WHERE status = 'queued' AND kind = ? AND payload = ?", ('scoring.meme', '{"meme_id": 1}'),
+    ),
+    'jobs.requeue_stale': (
+        "SELECT id FROM jobs WHERE status = 'running' AND locked_at < datetime('now', ?)", ('-600 seconds',),
+    ),
+    'jobs.purge_finished': (
+        "SELECT id FROM jobs WHERE status IN ('done', 'failed') AND finished_at < datetime('now', ?) LIMIT ?",
+        ('-604800 seconds', 1000),
+    ),
+
+    # --- memes.meme_detail ---
+    **{
+        f'detail.neighbours_{filter_type}': (gallery.neighbours_query(filter_type), {'user_id': 1, 'meme_id': 1})
+        for filter_type in gallery.FILTERS
+    },
+    'detail.user_eval': ('SELECT * FROM evaluations WHERE meme_id = ? AND user_id = ?', (1, 1)),
+    'detail.evaluations': ('''
+        SELECT evaluated_humor_type, evaluated_emotions, evaluated_context_level
+        FROM evaluations WHERE meme_id = ?
+    ''', (1,)),
+    'detail.likes_count': ('SELECT COUNT(*) AS c FROM meme_likes WHERE meme_id = ?', (1,)),
+    'detail.descriptions': ('''
+        SELECT md.*, CASE WHEN md.user_id = ?2 THEN 'You' ELSE u.name END AS uploader_name,
+               de.vote, m.id AS meme_own
+        FROM meme_descriptions md
+        LEFT JOIN users u ON md.user_id = u.id
+        LEFT JOIN description_evaluations de ON md.id = de.description_id AND de.user_id = ?2
+        LEFT JOIN memes m ON md.meme_id = m.id
+        WHERE md.meme_id = ?1
+        AND (m.user_id = ?2 OR de.vote IS NOT NULL OR md.user_id = ?2)
+        ORDER BY md.created_at DESC
+    ''', (1, 1)),
+
+    # --- auth.profile ---
+    'profile.recent_memes': ('''
+        SELECT m.*, COUNT(e.id) AS num_evaluations
+        FROM memes m
+        LEFT JOIN evaluations e ON m.id = e.meme_id
+        WHERE m.user_id = ?
+        GROUP BY m.id
+        ORDER BY m.upload_date DESC
+        LIMIT ?
+    ''', (1, 5)),
+    'profile.recent_eval_memes': ('''
+        SELECT m.*, COUNT(e.id) AS num_evaluations
+        FROM memes m
+        LEFT JOIN evaluations e ON m.id = e.meme_id
+        WHERE e.user_id = ?
+        GROUP BY m.id
+        ORDER BY m.upload_date DESC
+        LIMIT ?
+    ''', (1, 5)),
+    'profile.evaluation_stats': ('''
+        SELECT COUNT(*) as total_evaluations, AVG(evaluation_time_seconds) as avg_time
+        FROM evaluations WHERE user_id = ?
+    ''', (1,)),
+    'profile.rank': ('SELECT COUNT(*) as rank FROM users WHERE total_submissions > ? AND id != ?', (0, 1)),
+}
+
+
+def table_scans(db, sql, params=()):
+    """Return the tables the statement reads without an index"""
+    plan = db.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+    scans = []
+    for row in plan:
+        match = _TABLE_SCAN.match(row[3])
+        if match:
+            scans.append(match.group(1))
+    return scans
+
+
+def audit(db, queries=None):
+    """Return {name: [scanned tables]} for every query that scans a table it is not allowed to"""
+    failures = {}
+    for name, entry in (queries or HOT_QUERIES).items():
+        sql, params = entry[:2]
+        allowed = entry[2] if len(entry) > 2 else set()
+        scans = [table for table in table_scans(db, sql, params) if table not in allowed]
+        if scans:
+            failures[name] = scans
+    return failures
+
+
+@click.command('audit-queries')
+@click.option('--verbose', is_flag=True, help='Print the plan of every query.')
+@with_appcontext
+def audit_queries_command(verbose):
+    """Fail if a hot query does a full table SCAN."""
+    from memeqa.database import get_db
+
+    db = get_db()
+    export.register_pseudonym(db, b'')  # called by the export queries
+    if verbose:
+        for name, entry in HOT_QUERIES.items():
+            click.echo(name)
+            for row in db.execute('EXPLAIN QUERY PLAN ' + entry[0], entry[1]).fetchall():
+                click.echo(f'    {row[3]}')
+
+    failures = audit(db)
+    for name, tables in failures.items():
+        click.echo(f"SCAN in {name}: {', '.join(tables)}", err=True)
+    if failures:
+        raise SystemExit(1)
+    click.echo(f'{len(HOT_QUERIES)} hot queries checked, no table scans')
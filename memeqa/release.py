@@ -0,0 +1,235 @@
+# memeqa/release.py
+"""Offline dataset releases.
+
+`flask build-release --version X` copies the live database into a
+snapshot with SQLite's online backup API (the database runs in WAL mode,
+so the copy holds a read snapshot and writers carry on), then builds
+the release from the read-only snapshot instead of a serving worker:
+
+    memeqa-<version>/
+        manifest.json                 version, counts, sha256 of every file
+        data/<table>.ndjson.zst       the export tables (memeqa/export.py)
+        data/images.ndjson.zst        meme id -> archive member and its sha256
+        images/part-00000.tar.zst     the images, packed in parallel
+
+Session ids are pseudonymized as in every export, but under a random
+per-release key that is never written out, so they still group an
+evaluator's rows within the release but cannot be matched to the live
+export or across releases. The manifest records this.
+
+zstd needs the optional `zstandard` package; gzip and uncompressed
+releases work without it.
+"""
+import gzip
+import hashlib
+import json
+import os
+import secrets
+import shutil
+import sqlite3
+import tarfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from memeqa import export
+
+SUFFIXES = {'zstd': '.zst', 'gzip': '.gz', 'none': ''}
+
+ANONYMIZATION = {
+    'dropped_columns': {'memes': ['contributor_name']},
+    'pseudonymized_columns': {'evaluations': ['session_id']},
+    'pseudonym': 'HMAC-SHA256 (first 32 hex digits) under a random key that is not published; '
+                 'equal values are equal within this release only',
+}
+
+
+def open_compressed(path, compression, level=None):
+    """Binary file object writing `path` through the chosen compressor"""
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError('zstd releases need the zstandard package (or use --compression gzip)') from None
+        raw = open(path, 'wb')
+        return zstandard.ZstdCompressor(level=level or 10, threads=-1).stream_writer(raw, closefd=True)
+    if compression == 'gzip':
+        return gzip.open(path, 'wb', compresslevel=level or 6)
+    return open(path, 'wb')
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def snapshot(source_path, target_path):
+    """Copy the live database to target_path with the online backup API"""
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target)
+        target.execute('PRAGMA journal_mode = DELETE')  # a self-contained file, opened read-only below
+    finally:
+        target.close()
+        source.close()
+
+
+def open_snapshot(path):
+    db = sqlite3.connect(f'file:{path}?mode=ro', uri=True, detect_types=sqlite3.PARSE_DECLTYPES)
+    db.row_factory = sqlite3.Row
+    return db
+
+
+def _pack_shard(job):
+    """Write one tar shard of images; runs in a worker process.
+
+    Returns (shard path, [(meme id, member, sha256, bytes)]).
+    """
+    path, files, compression, level = job
+    members = []
+    with open_compressed(path, compression, level) as out, tarfile.open(fileobj=out, mode='w|') as tar:
+        for meme_id, member, source in files:
+            digest = hashlib.sha256()
+            with open(source, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+                size = f.tell()
+                f.seek(0)
+                info = tarfile.TarInfo(member)
+                info.size = size
+                info.mtime = 0  # identical input, identical archive
+                tar.addfile(info, f)
+            members.append((meme_id, member, digest.hexdigest(), size))
+    return path, members
+
+
+def write_tables(db, data_dir, compression, level, page_size):
+    """Write every export table as compressed NDJSON; return {table: rows}"""
+    counts = {}
+    for table in export.TABLES:
+        path = os.path.join(data_dir, f'{table}.ndjson{SUFFIXES[compression]}')
+        rows_written = 0
+        with open_compressed(path, compression, level) as out:
+            for rows in export.pages(db, table, page_size=page_size):
+                out.write(export.ndjson_chunk(table, rows).encode('utf-8'))
+                rows_written += len(rows)
+        counts[table] = rows_written
+    return counts
+
+
+def image_jobs(db, storage, images_dir, compression, level, per_shard):
+    """Split the memes' images into shard jobs; return (jobs, missing ids)"""
+    jobs, files, missing = [], [], []
+    for row in db.execute('SELECT id, filename FROM memes ORDER BY id'):
+        try:
+            source = storage.local_path(row['filename'])
+        except (FileNotFoundError, ValueError):
+            missing.append(row['id'])
+            continue
+        files.append((row['id'], f"images/{row['filename']}", source))
+    for start in range(0, len(files), per_shard):
+        path = os.path.join(images_dir, f'part-{start // per_shard:05d}.tar{SUFFIXES[compression]}')
+        jobs.append((path, files[start:start + per_shard], compression, level))
+    return jobs, missing
+
+
+@click.command('build-release')
+@click.option('--version', 'version', required=True, help='Release version, e.g. 2.1.')
+@click.option('--out', 'out_dir', type=click.Path(file_okay=False), default='releases', show_default=True)
+@click.option('--compression', type=click.Choice(list(SUFFIXES)), default='zstd', show_default=True)
+@click.option('--level', type=int, default=None, help='Compression level (zstd 1-22, gzip 1-9).')
+@click.option('--workers', type=int, default=os.cpu_count() or 1, show_default=True,
+              help='Processes packing images.')
+@click.option('--no-images', is_flag=True, help='Metadata only.')
+@with_appcontext
+def build_release_command(version, out_dir, compression, level, workers, no_images):
+    """Build a versioned dataset release from a snapshot of the database."""
+    from memeqa.storage import get_storage
+
+    if compression == 'zstd':
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            raise click.ClickException('zstd releases need the zstandard package (or use --compression gzip)')
+    config = current_app.config
+    name = f'memeqa-{version}'
+    release_dir = os.path.join(out_dir, name)
+    if os.path.exists(release_dir):
+        raise click.ClickException(f'{release_dir} already exists')
+    building = release_dir + '.partial'
+    shutil.rmtree(building, ignore_errors=True)
+    data_dir = os.path.join(building, 'data')
+    images_dir = os.path.join(building, 'images')
+    os.makedirs(data_dir)
+    os.makedirs(images_dir)
+
+    snapshot_path = os.path.join(out_dir, f'.{name}.snapshot.db')
+    click.echo(f'Snapshotting {config["DATABASE_PATH"]}')
+    snapshot(config['DATABASE_PATH'], snapshot_path)
+    db = open_snapshot(snapshot_path)
+    export.register_pseudonym(db, secrets.token_bytes(32))
+    try:
+        created_at = datetime.now(timezone.utc).isoformat()
+        counts = write_tables(db, data_dir, compression, level, config['EXPORT_PAGE_SIZE'])
+        click.echo(', '.join(f'{table}: {count} rows' for table, count in counts.items()))
+
+        missing = []
+        if not no_images:
+            jobs, missing = image_jobs(db, get_storage(), images_dir, compression, level,
+                                       config['RELEASE_IMAGES_PER_SHARD'])
+            index_path = os.path.join(data_dir, f'images.ndjson{SUFFIXES[compression]}')
+            packed = 0
+            with open_compressed(index_path, compression, level) as index, \
+                    ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+                for path, members in pool.map(_pack_shard, jobs):
+                    shard = os.path.relpath(path, building)
+                    for meme_id, member, digest, size in members:
+                        line = {'meme_id': meme_id, 'shard': shard, 'member': member, 'sha256': digest, 'bytes': size}
+                        index.write((json.dumps(line) + '\n').encode('utf-8'))
+                    packed += len(members)
+            counts['images'] = packed
+            click.echo(f'images: {packed} packed in {len(jobs)} shards, {len(missing)} missing')
+
+        watermark = db.execute('SELECT COALESCE(MAX(seq), 0) AS seq FROM change_log').fetchone()['seq']
+        schema_version = db.execute('PRAGMA user_version').fetchone()[0]
+    finally:
+        db.close()
+        os.remove(snapshot_path)
+
+    files = []
+    for root, _, names in os.walk(building):
+        for file_name in sorted(names):
+            path = os.path.join(root, file_name)
+            files.append({
+                'path': os.path.relpath(path, building),
+                'sha256': sha256_file(path),
+                'bytes': os.path.getsize(path),
+            })
+    files.sort(key=lambda f: f['path'])
+    manifest = {
+        **export.DATASET_INFO,
+        'version': version,
+        'created_at': created_at,
+        'schema_version': schema_version,
+        'watermark': watermark,  # pass as ?since= to /export_data for changes after this release
+        'compression': compression,
+        'anonymization': ANONYMIZATION,
+        'counts': counts,
+        'missing_images': missing,
+        # sha256 over the file list, identifying the release's content
+        'content_hash': hashlib.sha256(
+            ''.join(f"{f['path']}\0{f['sha256']}\n" for f in files).encode('utf-8')
+        ).hexdigest(),
+        'files': files,
+    }
+    with open(os.path.join(building, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.rename(building, release_dir)
+    click.echo(f"{release_dir}: {len(files)} files, content hash {manifest['content_hash']}")
@@ -1,7 +1,8 @@
 # memeqa/routes/auth.py
 from flask import Blueprint, render_template, request, flash, redirect, url_for, session, current_app
 from memeqa.database import get_db
-from memeqa.utils import get_current_user, generate_login_token, verify_login_token, send_email,parse_json_columns
+from memeqa.utils import get_current_user, send_email,parse_json_columns
+from memeqa.login_tokens import generate_login_token, verify_login_token
 from datetime import datetime
 
 bp = Blueprint('auth', __name__)
@@ -126,7 +127,7 @@ def login_with_token(token):
     """Login using email token"""
     email = request.args.get('email', '').lower()
     
-    if not email or not verify_login_token(token, email, current_app.config['SECRET_KEY']):
+    if not email or not verify_login_token(token, email):
         flash('Invalid or expired login link. Please request a new one.')
         return redirect(url_for('auth.register'))
     
@@ -339,7 +340,7 @@ def profile():
 # Helper functions
 def send_login_link(email):
     """Send a login link to the user's email"""
-    token = generate_login_token(email, current_app.config['SECRET_KEY'])
+    token = generate_login_token(email)
     login_url = url_for('auth.login_with_token', token=token, email=email, _external=True)
     
     subject = "🎭 MemeQA Login Link"
@@ -359,11 +360,11 @@ The MemeQA Research Team
 THWS & CAIRO
     """.strip()
     
-    send_email(email, subject, body, current_app.config)
+    send_email(email, subject, body)
 
 def send_confirmation_email(name, email):
     """Send registration confirmation email"""
-    token = generate_login_token(email, current_app.config['SECRET_KEY'])
+    token = generate_login_token(email)
     confirm_url = url_for('auth.login_with_token', token=token, email=email, _external=True)
     
     subject = "🎉 Welcome to MemeQA - Confirm Your Email"
@@ -389,4 +390,4 @@ The MemeQA Research Team
 THWS & CAIRO
     """.strip()
     
-    send_email(email, subject, body, current_app.config)
\ No newline at end of file
+    send_email(email, subject, body)
\ No newline at end of file
@@ -1,37 +1,24 @@
 # memeqa/routes/evaluations.py
 from flask import Blueprint, render_template, redirect, url_for, flash, session, current_app, request
 from memeqa.database import get_db
-from memeqa.utils import get_current_user,AppSession
+from memeqa.utils import get_current_user,get_app_session
 import json
 import uuid
-import random
-import pandas as pd
+from memeqa import evaluation_queue
+from memeqa import jobs
+from memeqa import meme_stats
+from memeqa import labels
 
 bp = Blueprint('evaluations', __name__)
 
 
-def get_random_meme_for_evaluation(app_session):
-    """Get a random meme that the user hasn't uploaded"""
-    db = get_db()
-    own_meme_ids = app_session.get_own_meme_ids()
-    query = '''
-        SELECT * FROM memes 
-        WHERE humor_type IS NOT NULL 
-        AND emotions_conveyed IS NOT NULL 
-        AND id NOT IN ({})  -- Exclude user's own memes
-        ORDER BY RANDOM() LIMIT 1
-    '''.format(','.join('?' * len(own_meme_ids)) if own_meme_ids else '0')
-
-    meme = db.execute(query, tuple(own_meme_ids) if own_meme_ids else ()).fetchone()
-    return meme
-
 @bp.route('/')
 def evaluate():
     """Show next meme/description to evaluate."""
 
     db = get_db()
-    user = get_current_user(db)
-    app_session = AppSession(user)
+    app_session = get_app_session()
+    user = app_session.current_user
     config = current_app.config
     limits = app_session.check_limits()
 
@@ -47,98 +34,20 @@ def evaluate():
     user_id = user['id'] if user else None
     session_id = app_session.session_id if not user else None
 
-    # --- STEP 1: Get possible memes/descriptions ---
-    if user_id:
-        memes_desc_table = db.execute("""
-            SELECT
-                m.id AS meme_id,
-                COALESCE(md_other.id, -1) AS description_id,
-                (SELECT COUNT(*) FROM meme_descriptions md_all WHERE md_all.meme_id = m.id) AS total_descriptions,
-                CASE WHEN EXISTS (
-                    SELECT 1 FROM meme_descriptions md_user
-                    WHERE md_user.meme_id = m.id AND md_user.user_id = ?
-                ) THEN 1 ELSE 0 END AS has_user_description
-            FROM memes m
-            LEFT JOIN meme_descriptions md_other
-                ON m.id = md_other.meme_id AND md_other.user_id != ?
-            WHERE m.user_id != ?
-        """, (user_id, user_id, user_id)).fetchall()
-    else:
-        memes_desc_table = db.execute("""
-            SELECT
-                m.id AS meme_id,
-                COALESCE(md_other.id, -1) AS description_id,
-                (SELECT COUNT(*) FROM meme_descriptions md_all WHERE md_all.meme_id = m.id) AS total_descriptions,
-                CASE WHEN EXISTS (
-                    SELECT 1 FROM meme_descriptions md_user
-                    WHERE md_user.meme_id = m.id AND md_user.session_id = ?
-                ) THEN 1 ELSE 0 END AS has_user_description
-            FROM memes m
-            LEFT JOIN meme_descriptions md_other
-                ON m.id = md_other.meme_id AND md_other.session_id != ?
-            WHERE m.session_id != ?
-        """, (session_id, session_id, session_id)).fetchall()
-
-    if not memes_desc_table:
-        flash('No memes available to evaluate yet. Try uploading some!')
-        return redirect(url_for('memes.upload_file'))
-
-    # --- STEP 2: Get completed evaluations ---
-    if user_id:
-        evaluated_rows = db.execute("""
-            SELECT e.meme_id, COALESCE(de.description_id, -1) AS evaluated_description_id
-            FROM evaluations e
-            LEFT JOIN description_evaluations de
-                ON e.meme_id = de.meme_id AND de.user_id = e.user_id
-            WHERE e.user_id = ?
-        """, (user_id,)).fetchall()
-    else:
-        evaluated_rows = db.execute("""
-            SELECT e.meme_id, COALESCE(de.description_id, -1) AS evaluated_description_id
-            FROM evaluations e
-            LEFT JOIN description_evaluations de
-                ON e.meme_id = de.meme_id AND de.session_id = e.session_id
-            WHERE e.session_id = ?
-        """, (session_id,)).fetchall()
-
-    memes_df = pd.DataFrame([dict(row) for row in memes_desc_table])
-    if evaluated_rows:
-        evaluated_df = pd.DataFrame([dict(row) for row in evaluated_rows])
-    else:
-    # empty DataFrame with expected columns
-        evaluated_df = pd.DataFrame(columns=['meme_id', 'evaluated_description_id'])
-
-    print("Memes DataFrame:")
-    print(memes_df)
-    print("Evaluated DataFrame:")
-    print(evaluated_df)
-
-    # --- STEP 3: Merge and filter available pairs ---
-    merged_df = memes_df.merge(
-        evaluated_df,
-        left_on=['meme_id', 'description_id'],
-        right_on=['meme_id', 'evaluated_description_id'],
-        how='left',
-        suffixes=('_possible','_evaluated')
-    )
+    # --- STEP 1: Pick a random open pair from the actor's queue ---
+    selected_pair = evaluation_queue.pick_pair(db, user_id, session_id)
 
-    available_df = merged_df[
-        (merged_df['evaluated_description_id'].isna()) |
-        ((merged_df['description_id'] == -1) & (merged_df['has_user_description'] == 0) & (merged_df['total_descriptions'] < 4))
-    ]
+    if selected_pair is None:
+        if not evaluation_queue.has_candidates(db, user_id, session_id):
+            flash('No memes available to evaluate yet. Try uploading some!')
+            return redirect(url_for('memes.upload_file'))
 
-    if available_df.empty:
         flash('🎉 You have evaluated all available memes/descriptions!')
         return render_template('evaluations/evaluate.html', meme=None)
 
-    # --- STEP 4: Build options set and pick random ---
-    options_set = set(
-        zip(available_df['meme_id'], available_df['description_id'])
-    )
-    selected_pair = random.choice(list(options_set))
     meme_id, description_id = selected_pair
 
-    # --- STEP 5: Get full meme and description data ---
+    # --- STEP 2: Get full meme and description data ---
     meme = db.execute('SELECT * FROM memes WHERE id = ?', (meme_id,)).fetchone()
     description = None
     if description_id != -1:
@@ -150,7 +59,7 @@ def evaluate():
         (meme_id,)
     ).fetchone()['count']
 
-    # --- STEP 6: Current evaluation status ---
+    # --- STEP 3: Current evaluation status ---
     eval_row = db.execute('''
         SELECT evaluated_humor_type, evaluated_emotions, evaluated_context_level, de.vote
         FROM evaluations e
@@ -411,15 +320,21 @@ def evaluate_meme():
                     evaluation_date = CURRENT_TIMESTAMP
                 WHERE id = ?
             ''', (humor_json, emotion_json, context_level, evaluation_time, existing_eval['id']))
+            evaluation_id = existing_eval['id']
         else:
             print("Inserting new evaluation for meme_id:", meme_id)
-            db.execute('''
+            evaluation_id = db.execute('''
                 INSERT INTO evaluations (session_id, user_id, meme_id, evaluated_humor_type,
                                          evaluated_emotions, evaluated_context_level, evaluation_time_seconds)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (session_id, user_id, meme_id, humor_json, emotion_json, context_level, evaluation_time))
+            ''', (session_id, user_id, meme_id, humor_json, emotion_json, context_level, evaluation_time)).lastrowid
             print("Inserted new evaluation for meme_id:", meme_id)
 
+        # Score it against the uploader's labels; the meme's agreement is refreshed in the background
+        labels.score_evaluation(db, evaluation_id)
+        jobs.enqueue(db, 'scoring.meme', {'meme_id': int(meme_id)},
+                     delay=current_app.config['SCORING_AGREEMENT_DELAY'], unique=True)
+
         if user_id:
             # --- Handle meme like ---
             if like_meme == '1':
@@ -463,7 +378,17 @@ def evaluate_meme():
                 str_flash = '⚠️ This meme already has {} descriptions. New ones won’t be saved.'.format(config['MAX_DESCRIPTIONS_PER_MEME'])
                 flash(str_flash)
 
+        # --- Keep evaluation queues in sync ---
+        if new_description and new_description.strip():
+            evaluation_queue.refresh_meme(db, meme_id)
+        else:
+            evaluation_queue.refresh_meme(db, meme_id, user_id, session_id)
+
+        # meme_analytics catches up in the background (the change itself was logged by a trigger)
+        meme_stats.schedule(db)
+
         db.commit()
+        jobs.wake()
         flash('✅ Evaluation saved!')
         return redirect(url_for('evaluations.evaluate'))
 
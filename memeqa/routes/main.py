@@ -1,6 +1,10 @@
-from flask import Blueprint, render_template, session, current_app, abort, jsonify, flash, redirect, url_for
-from memeqa.database import get_db
-from memeqa.utils import get_current_user,AppSession
+from flask import Blueprint, render_template, session, current_app, abort, jsonify, flash, redirect, url_for, request, Response, stream_with_context
+from memeqa.database import get_db, get_pool
+from memeqa.utils import get_current_user,get_app_session
+from memeqa import aggregates
+from memeqa import export
+from memeqa import jobs
+from memeqa import mailer
 import uuid
 import json
 from datetime import datetime
@@ -76,15 +80,11 @@ def stats():
     """Show basic statistics"""
     db = get_db()
     
-    total_memes = db.execute('SELECT COUNT(*) as count FROM memes').fetchone()['count']
-    total_evaluations = db.execute('SELECT COUNT(*) as count FROM evaluations').fetchone()['count']
-    unique_evaluators = db.execute('SELECT COUNT(DISTINCT session_id) as count FROM evaluations').fetchone()['count']
-    
-    # Get registered users count safely
-    try:
-        registered_users = db.execute('SELECT COUNT(*) as count FROM users WHERE is_active = 1').fetchone()['count']
-    except:
-        registered_users = 0
+    totals = aggregates.counters(db)
+    total_memes = totals['memes']
+    total_evaluations = totals['evaluations']
+    unique_evaluators = totals['evaluators']
+    registered_users = totals['active_users']
     
     return render_template('main/stats.html', 
                          total_memes=total_memes,
@@ -94,133 +94,38 @@ def stats():
 
 @bp.route('/analytics')
 def analytics():
-    """Research analytics dashboard"""
+    """Research analytics dashboard, read from the summary tables (memeqa/aggregates.py)"""
     db = get_db()
     
     try:
-        # Basic stats
-        total_memes = db.execute('SELECT COUNT(*) as count FROM memes').fetchone()['count']
-        total_evaluations = db.execute('SELECT COUNT(*) as count FROM evaluations').fetchone()['count']
-        unique_evaluators = db.execute('SELECT COUNT(DISTINCT session_id) as count FROM evaluations').fetchone()['count']
-        
-        try:
-            registered_contributors = db.execute('SELECT COUNT(*) as count FROM users WHERE is_active = 1').fetchone()['count']
-        except:
-            registered_contributors = 0
+        totals = aggregates.counters(db)
+        total_memes = totals['memes']
+        total_evaluations = totals['evaluations']
+        unique_evaluators = totals['evaluators']
+        registered_contributors = totals['active_users']
         
         # Accuracy statistics
-        accuracy_query = '''
-            SELECT 
-                AVG(CASE WHEN was_correct THEN 1.0 ELSE 0.0 END) as overall_accuracy,
-                COUNT(CASE WHEN was_correct THEN 1 END) as correct_evaluations,
-                COUNT(*) as total_evaluations
-            FROM evaluations
-            WHERE was_correct IS NOT NULL
-        '''
-        
-        try:
-            accuracy_stats_raw = db.execute(accuracy_query).fetchone()
-            
-            if accuracy_stats_raw and accuracy_stats_raw['total_evaluations'] > 0:
-                accuracy_stats = {
-                    'overall_accuracy': accuracy_stats_raw['overall_accuracy'] or 0.0,
-                    'correct_evaluations': accuracy_stats_raw['correct_evaluations'] or 0,
-                    'total_evaluations': accuracy_stats_raw['total_evaluations'] or 0
-                }
-            else:
-                accuracy_stats = {
-                    'overall_accuracy': 0.0,
-                    'correct_evaluations': 0,
-                    'total_evaluations': 0
-                }
-        except Exception as e:
-            print(f"Error getting accuracy stats: {e}")
-            accuracy_stats = {
-                'overall_accuracy': 0.0,
-                'correct_evaluations': 0,
-                'total_evaluations': 0
-            }
-        
-        # Country distribution
-        try:
-            country_stats = db.execute('''
-                SELECT contributor_country as country_of_submission, COUNT(*) as count 
-                FROM memes 
-                WHERE contributor_country IS NOT NULL AND contributor_country != ''
-                GROUP BY contributor_country 
-                ORDER BY count DESC 
-                LIMIT 10
-            ''').fetchall()
-        except:
-            country_stats = []
-        
-        # Platform distribution
-        try:
-            platform_stats = db.execute('''
-                SELECT platform_found, COUNT(*) as count 
-                FROM memes 
-                WHERE platform_found IS NOT NULL AND platform_found != ''
-                GROUP BY platform_found 
-                ORDER BY count DESC
-            ''').fetchall()
-        except:
-            platform_stats = []
+        judged = totals['judged_evaluations']
+        accuracy_stats = {
+            'overall_accuracy': totals['correct_evaluations'] / judged if judged else 0.0,
+            'correct_evaluations': totals['correct_evaluations'],
+            'total_evaluations': judged
+        }
         
-        # Humor type distribution
-        try:
-            humor_stats = db.execute('''
-                SELECT humor_type, COUNT(*) as count 
-                FROM memes 
-                WHERE humor_type IS NOT NULL AND humor_type != ''
-                GROUP BY humor_type 
-                ORDER BY count DESC
-            ''').fetchall()
-        except:
-            humor_stats = []
+        # Country, platform, humor type and cultural reach (context level) distributions
+        distributions = aggregates.breakdowns(db)
+        country_stats = [{'country_of_submission': value, 'count': count}
+                         for value, count in distributions['country'][:10]]
+        platform_stats = [{'platform_found': value, 'count': count}
+                          for value, count in distributions['platform']]
+        humor_stats = [{'humor_type': value, 'count': count}
+                       for value, count in distributions['humor_type']]
+        cultural_stats = [{'cultural_reach': value, 'count': count}
+                          for value, count in distributions['context_level']]
         
-        # Cultural reach distribution
-        try:
-            cultural_stats = db.execute('''
-                SELECT cultural_reach, COUNT(*) as count 
-                FROM memes 
-                WHERE cultural_reach IS NOT NULL AND cultural_reach != ''
-                GROUP BY cultural_reach 
-                ORDER BY count DESC
-            ''').fetchall()
-        except:
-            cultural_stats = []
-        
-        # Most difficult memes (lowest accuracy)
-        try:
-            difficult_memes = db.execute('''
-                SELECT m.id, m.original_filename, 
-                       COALESCE(m.meme_content, 'No description') as meme_content, 
-                       COALESCE(a.accuracy_rate, 0.0) as accuracy_rate, 
-                       COALESCE(a.total_evaluations, 0) as total_evaluations
-                FROM memes m
-                LEFT JOIN meme_analytics a ON m.id = a.meme_id
-                WHERE COALESCE(a.total_evaluations, 0) >= 5
-                ORDER BY COALESCE(a.accuracy_rate, 1.0) ASC
-                LIMIT 10
-            ''').fetchall()
-        except:
-            difficult_memes = []
-        
-        # Easiest memes (highest accuracy)
-        try:
-            easy_memes = db.execute('''
-                SELECT m.id, m.original_filename, 
-                       COALESCE(m.meme_content, 'No description') as meme_content, 
-                       COALESCE(a.accuracy_rate, 0.0) as accuracy_rate, 
-                       COALESCE(a.total_evaluations, 0) as total_evaluations
-                FROM memes m
-                LEFT JOIN meme_analytics a ON m.id = a.meme_id
-                WHERE COALESCE(a.total_evaluations, 0) >= 5
-                ORDER BY COALESCE(a.accuracy_rate, 0.0) DESC
-                LIMIT 10
-            ''').fetchall()
-        except:
-            easy_memes = []
+        # Most difficult and easiest memes (lowest / highest accuracy)
+        difficult_memes = aggregates.accuracy_ranking(db, hardest=True)
+        easy_memes = aggregates.accuracy_ranking(db, hardest=False)
         
     except Exception as e:
         print(f"Error in analytics route: {e}")
@@ -252,77 +157,85 @@ def analytics():
 
 @bp.route('/export_data')
 def export_data():
-    """Export research data (for researchers)"""
+    """Export research data (for researchers), streamed page by page.
+
+    ?table= one of memes, evaluations, contributors (default: all of them, NDJSON only),
+    ?format= ndjson or csv, ?after= resume after this id of the (first) table,
+    ?since= only rows changed after this watermark, with tombstones (NDJSON).
+    The X-Export-Watermark header holds the watermark for the next ?since=.
+    """
     if not current_app.config.get('DEVELOPMENT', False):
         abort(403)
-    
+
+    table = request.args.get('table')
+    fmt = request.args.get('format', 'ndjson')
+    after = request.args.get('after', 0, type=int)
+    since = request.args.get('since', type=int)
+    if table is not None and table not in export.TABLES:
+        abort(400, f'Unknown table {table!r}')
+    if fmt not in ('ndjson', 'csv') or (fmt == 'csv' and table is None):
+        abort(400, 'format must be ndjson, or csv together with table')
+    if since is not None and fmt != 'ndjson':
+        abort(400, 'since is only supported with format=ndjson')
+
     db = get_db()
-    
-    # Get all meme data with analytics
-    memes_data = db.execute('''
-        SELECT m.*, a.accuracy_rate, a.total_evaluations as analytics_evaluations,
-               a.difficulty_score, a.avg_evaluation_time, a.avg_confidence_level
-        FROM memes m
-        LEFT JOIN meme_analytics a ON m.id = a.meme_id
-        ORDER BY m.upload_date DESC
-    ''').fetchall()
-    
-    # Get all evaluation data
-    evaluations_data = db.execute('''
-        SELECT e.*, m.cultural_reach, m.humor_type, m.estimated_year
-        FROM evaluations e
-        JOIN memes m ON e.meme_id = m.id
-        ORDER BY e.evaluation_date DESC
-    ''').fetchall()
-    
-    # Get user data (anonymized)
-    users_data = db.execute('''
-        SELECT country, research_interest, total_submissions, total_evaluations, 
-               evaluation_accuracy, registration_date
-        FROM users 
-        WHERE is_active = 1
-        ORDER BY total_submissions DESC
-    ''').fetchall()
-    
-    # Convert to JSON for easy export
-    memes_json = []
-    for meme in memes_data:
-        meme_dict = dict(meme)
-        # Parse emotions JSON
-        if meme_dict.get('emotions_conveyed'):
-            try:
-                meme_dict['emotions_conveyed'] = json.loads(meme_dict['emotions_conveyed'])
-            except:
-                meme_dict['emotions_conveyed'] = []
-        # Remove sensitive data
-        meme_dict.pop('contributor_email', None)
-        if not current_app.config.get('DEVELOPMENT', False):
-            meme_dict.pop('contributor_name', None)
-        memes_json.append(meme_dict)
-    
-    evaluations_json = [dict(eval) for eval in evaluations_data]
-    users_json = [dict(user) for user in users_data]
-    
-    export_data = {
-        'export_timestamp': datetime.now().isoformat(),
-        'dataset_info': {
-            'name': 'MemeQA',
-            'version': '2.0',
-            'description': 'Comprehensive meme understanding dataset with cultural and humor classifications',
-            'institutions': ['THWS', 'CAIRO'],
-            'license': 'Research Use Only'
-        },
-        'statistics': {
-            'total_memes': len(memes_json),
-            'total_evaluations': len(evaluations_json),
-            'total_contributors': len(users_json)
-        },
-        'memes': memes_json,
-        'evaluations': evaluations_json,
-        'contributors': users_json
-    }
-    
-    return jsonify(export_data)
+    export.register_pseudonym(db, export.pseudonym_key(current_app.config))
+    page_size = current_app.config['EXPORT_PAGE_SIZE']
+    tables = [table] if table else list(export.TABLES)
+    until = export.watermark(db)  # taken first: changes made while streaming show up next time
+    if since is not None:
+        chunks = export.stream_changes(db, tables, since, until, page_size)
+        mimetype = 'application/x-ndjson'
+    elif fmt == 'csv':
+        chunks = export.stream_csv(db, table, after, page_size)
+        mimetype = 'text/csv'
+    else:
+        chunks = export.stream_ndjson(db, tables, after, page_size, until)
+        mimetype = 'application/x-ndjson'
+
+    kind = f'changes-{since}' if since is not None else table or 'dataset'
+    filename = f"memeqa-{kind}-{datetime.now():%Y%m%d-%H%M%S}.{fmt}"
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'X-Export-Watermark': str(until),
+    })
+
+@bp.route('/db_stats')
+def db_stats():
+    """Connection pool statistics for this worker"""
+    if not current_app.config.get('DEVELOPMENT', False):
+        abort(403)
+
+    return jsonify(get_pool().stats())
+
+@bp.route('/jobs/<int:job_id>')
+def job_status(job_id):
+    """Progress of a background job"""
+    if not current_app.config.get('DEVELOPMENT', False):
+        abort(403)
+
+    job = jobs.job_status(get_db(), job_id)
+    if job is None:
+        abort(404)
+
+    return jsonify({key: job[key] for key in ('id', 'kind', 'status', 'attempts', 'max_attempts',
+                                              'run_after', 'created_at', 'finished_at', 'last_error')})
+
+@bp.route('/job_stats')
+def job_stats():
+    """Background job counts by status"""
+    if not current_app.config.get('DEVELOPMENT', False):
+        abort(403)
+
+    return jsonify(jobs.queue_stats(get_db()))
+
+@bp.route('/mail_stats')
+def mail_stats():
+    """Email outbox depth by status"""
+    if not current_app.config.get('DEVELOPMENT', False):
+        abort(403)
+
+    return jsonify(mailer.outbox_stats(get_db()))
 
 @bp.route('/reset_session')
 def reset_session():
@@ -337,7 +250,7 @@ def reset_session():
 
 @bp.route('/test_session')
 def test_session():
-    app_session = AppSession(get_current_user(get_db()))
+    app_session = get_app_session()
     return jsonify({
         'uploads': app_session.upload_count,
         'evals': app_session.eval_count,
@@ -1,18 +1,30 @@
 # memeqa/routes/memes.py
-from flask import Blueprint, render_template, request, abort, send_from_directory, current_app, flash, redirect, url_for, session,jsonify
+from flask import Blueprint, render_template, request, abort, current_app, flash, redirect, url_for, session,jsonify
 from memeqa.database import get_db
-from memeqa.utils import Pagination, allowed_file, get_upload_folder, get_current_user, AppSession, save_uploaded_file, list_to_string,parse_json_columns
+from memeqa.storage import get_storage
+from memeqa.utils import Pagination, is_accepted_image, get_upload_folder, get_current_user, get_app_session, save_uploaded_file, send_upload, resolve_upload, list_to_string,parse_json_columns
+from memeqa import evaluation_queue
+from memeqa import fingerprints
+from memeqa import gallery as gallery_data
+from memeqa import images
+from memeqa import jobs
+from werkzeug.exceptions import RequestEntityTooLarge
 import json
 import datetime
+import os
+import sqlite3
+import traceback
 
 bp = Blueprint('memes', __name__)
 
 @bp.route('/gallery')
 def gallery():
-    """Display uploaded memes with enhanced pagination"""
+    """Display uploaded memes with keyset pagination"""
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 4, type=int)
     filter_type = request.args.get('filter', 'all')
+    after_token = request.args.get('after')
+    before_token = request.args.get('before')
     
     # Limit per_page options for security
     if per_page not in [4, 8, 16]:
@@ -21,8 +33,15 @@ def gallery():
     # Validate page number is positive
     if page < 1:
         abort(404)
-    
-    offset = (page - 1) * per_page
+
+    if filter_type not in gallery_data.FILTERS:
+        abort(400)
+
+    # Prev/next links carry the key of the page edge; page numbers are for display
+    after = gallery_data.decode_cursor(after_token) if after_token else None
+    before = gallery_data.decode_cursor(before_token) if before_token else None
+    if (after_token and after is None) or (before_token and before is None):
+        abort(400)
     
     # Get database connection
     db = get_db()
@@ -34,133 +53,35 @@ def gallery():
         flash('Please register or log in to access the gallery.', 'error')
         return redirect(url_for('auth.register'))
     user_id = current_user['id'] if current_user else None
-    
-    # Build base queries depending on filter
-    if filter_type == 'all':
-        id_query = '''
-            SELECT m.id
-            FROM memes AS m
-            LEFT JOIN evaluations AS e
-                ON m.id = e.meme_id
-                AND e.user_id = ?
-            WHERE m.user_id = ? OR e.user_id = ?
-            ORDER BY m.upload_date DESC
-            LIMIT ? OFFSET ?
-        '''
-        count_query = '''
-            SELECT COUNT(*) AS count
-            FROM (
-                SELECT m.id
-                FROM memes AS m
-                LEFT JOIN evaluations AS e
-                    ON m.id = e.meme_id
-                    AND e.user_id = ?
-                WHERE m.user_id = ? OR e.user_id = ?
-            )
-        '''
-        id_params = [user_id, user_id, user_id, per_page, offset]
-        count_params = [user_id, user_id, user_id]
-
-    elif filter_type == 'evaluated':
-        id_query = '''
-            SELECT m.id
-            FROM memes AS m
-            LEFT JOIN evaluations AS e
-                ON m.id = e.meme_id
-                AND e.user_id = ?
-            WHERE e.user_id = ?
-            ORDER BY m.upload_date DESC
-            LIMIT ? OFFSET ?
-        '''
-        count_query = '''
-            SELECT COUNT(*) AS count
-            FROM (
-                SELECT m.id
-                FROM memes AS m
-                LEFT JOIN evaluations AS e
-                    ON m.id = e.meme_id
-                    AND e.user_id = ?
-                WHERE e.user_id = ?
-            )
-        '''
-        id_params = [user_id, user_id, per_page, offset]
-        count_params = [user_id, user_id]
-    elif filter_type == 'own':
-        id_query = '''
-            SELECT m.id
-            FROM memes AS m
-            WHERE m.user_id = ?
-            ORDER BY m.upload_date DESC
-            LIMIT ? OFFSET ?
-        '''
-        count_query = '''
-            SELECT COUNT(*) AS count
-            FROM memes AS m
-            WHERE m.user_id = ?
-        '''
-        id_params = [user_id, per_page, offset]
-        count_params = [user_id]
-
-    elif filter_type == 'liked':
-        id_query = '''
-            SELECT m.id
-            FROM memes AS m
-            LEFT JOIN meme_likes AS ml
-                ON m.id = ml.meme_id
-                AND ml.user_id = ?
-            WHERE ml.user_id = ?
-            ORDER BY m.upload_date DESC
-            LIMIT ? OFFSET ?
-        '''
-        count_query = '''
-            SELECT COUNT(*) AS count
-            FROM (
-                SELECT m.id
-                FROM memes AS m
-                LEFT JOIN meme_likes AS ml
-                    ON m.id = ml.meme_id
-                    AND ml.user_id = ?
-                WHERE ml.user_id = ?
-            )
-        '''
-        id_params = [user_id, user_id, per_page, offset]
-        count_params = [user_id, user_id]
-    else:
-        abort(400)
 
-    # Execute count
-    total_count = db.execute(count_query, count_params).fetchone()['count']
-   
-    # Check if page is out of range
-    max_page = (total_count + per_page - 1) // per_page if total_count > 0 else 1
-    if page > max_page and total_count > 0:
+    # One statement for the page, its liked flags and, on a cache miss, the total.
+    # The user's counters version the cached total so it moves with uploads and evaluations
+    rows, more, total_count = gallery_data.fetch_page(
+        db, filter_type, user_id, per_page, page=page, after=after, before=before,
+        version=(current_user['total_submissions'], current_user['total_evaluations'])
+    )
+
+    # Direct page-number jump past the end
+    if not rows and page > 1 and not (after or before):
         abort(404)
 
-    # Fetch meme IDs
-    rows = db.execute(id_query, id_params).fetchall()
-    meme_ids = [row['id'] for row in rows]
-
-    # Fetch meme details
-    if meme_ids:
-        placeholders = ','.join('?' for _ in meme_ids)
-        memes = db.execute(f'''
-            SELECT m.*,
-                CASE WHEN ml.user_id IS NOT NULL THEN 1 ELSE 0 END AS liked_by_user
-            FROM memes m
-            LEFT JOIN meme_likes AS ml
-                ON m.id = ml.meme_id AND ml.user_id = ?
-            WHERE m.id IN ({placeholders})
-            ORDER BY m.upload_date DESC
-            ''', [user_id] + meme_ids).fetchall()
-        
-    # Parse JSON fields for each meme
-        memes = parse_json_columns(memes, ['humor_type', 'emotions_conveyed','languages'])
-        
+    # Older memes come next, newer ones before; the seek itself tells whether more exist
+    if before:
+        has_prev, has_next = more, True
+        page = max(page, 2) if more else 1  # keep the displayed number sane if it went stale
     else:
-        memes = []
+        has_prev, has_next = page > 1 or after is not None, more
+        if after:
+            page = max(page, 2)
+    next_cursor = gallery_data.encode_cursor(rows[-1]['sort_date'], rows[-1]['id']) if has_next and rows else None
+    prev_cursor = gallery_data.encode_cursor(rows[0]['sort_date'], rows[0]['id']) if has_prev and rows else None
+
+    # Parse JSON fields for each meme
+    memes = parse_json_columns(rows, ['humor_type', 'emotions_conveyed','languages'])
     
     # Create pagination object
-    pagination = Pagination(page, per_page, total_count)
+    pagination = Pagination(page, per_page, total_count,
+                            next_cursor=next_cursor, prev_cursor=prev_cursor, keyset=True)
     pagination.items = memes
     
     return render_template('memes/gallery.html', 
@@ -196,6 +117,7 @@ def like_meme(meme_id):
         liked = True
 
     db.commit()
+    gallery_data.forget_totals(user_id)
 
     # Get updated like count
     likes_count = db.execute(
@@ -211,7 +133,7 @@ def like_meme(meme_id):
 @bp.route('/upload', methods=['GET', 'POST'])
 def upload_file():
     """Handle meme upload with improved validation and UX"""
-    app_session = AppSession(get_current_user(get_db()))
+    app_session = get_app_session()
     config = current_app.config
     limits = app_session.check_limits()
 
@@ -227,6 +149,7 @@ def upload_file():
     if request.method == 'POST':
         # Initialize form_data for template rendering
         form_data = {}
+        db = get_db()
         # DEBUG
         print(f'Initial form_data: {form_data}')
         try:
@@ -239,21 +162,11 @@ def upload_file():
             
             file = request.files['file']
             
-            # Check if file is valid
+            # Check if file is valid: the ingest stream sniffed its type from the first bytes
+            # (size was enforced while it streamed in, see memeqa/ingest.py)
             allowed_extensions = config['ALLOWED_EXTENSIONS']
-            if file.filename == '' or not allowed_file(file.filename, allowed_extensions):
-                flash(f'Please select a valid image file ({list_to_string(allowed_extensions)}).', 'error')
-                return render_template('memes/upload.html', 
-                                     current_user=app_session.current_user, 
-                                     form_data=form_data)
-            
-            # Check file size (16MB limit)
-            file.seek(0, 2)  # Seek to end
-            file_size = file.tell()
-            file.seek(0)     # Reset to beginning
-            
-            if file_size > 16 * 1024 * 1024:  # 16MB
-                flash('File size must be less than 16MB.', 'error')
+            if file.filename == '' or not is_accepted_image(file):
+                flash(f'Please select a valid image file ({list_to_string(sorted(allowed_extensions))}).', 'error')
                 return render_template('memes/upload.html', 
                                      current_user=app_session.current_user, 
                                      form_data=form_data)
@@ -276,10 +189,18 @@ def upload_file():
                                      current_user=app_session.current_user, 
                                      form_data=form_data)
             
+            # Byte-identical memes are refused outright
+            content_hash = fingerprints.upload_sha256(file)
+            if fingerprints.find_duplicate(db, content_hash):
+                flash('This meme has already been uploaded. Please choose a different one.', 'error')
+                return render_template('memes/upload.html', 
+                                     current_user=app_session.current_user, 
+                                     form_data=form_data)
+
             # Process and save file
             try:
                 upload_folder = get_upload_folder(current_app)
-                filename, original_filename = save_uploaded_file(file, upload_folder)
+                filename, original_filename = save_uploaded_file(file, upload_folder, content_hash)
             except Exception as e:
                 current_app.logger.error(f"File save error: {str(e)}\n{traceback.format_exc()}")
                 flash(f'Error saving file: {str(e)}', 'error')
@@ -313,7 +234,6 @@ def upload_file():
                                      form_data=form_data)
             
             # Save to database
-            db = get_db()
             cursor = db.cursor()
             
             try:
@@ -322,20 +242,42 @@ def upload_file():
                         filename, original_filename, contributor_name, contributor_email,
                         contributor_country, platform_found, session_id, user_id,
                         languages, humor_type, emotions_conveyed, context_level,
-                        terms_agreement
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        terms_agreement, content_hash
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 ''', (
                     filename, original_filename, contributor_name, contributor_email,
                     contributor_country, form_data['platform_found'], 
                     app_session.session_id, uploader_user_id,
                     languages_json, humors_json, emotions_json, form_data['context_level'],
-                    form_data['terms_agreement']
+                    form_data['terms_agreement'], content_hash
                 ))
                 
                 meme_id = cursor.lastrowid
+            except sqlite3.IntegrityError:
+                # The same bytes were uploaded concurrently and committed first
+                # (memes.content_hash is UNIQUE). The stored file is named by the
+                # hash, so it is that meme's file too and stays.
+                db.rollback()
+                if fingerprints.find_duplicate(db, content_hash) is None:
+                    raise
+                flash('This meme has already been uploaded. Please choose a different one.', 'error')
+                return render_template('memes/upload.html', 
+                                     current_user=app_session.current_user, 
+                                     form_data=form_data)
             except Exception as e:
                 current_app.logger.error(f"Database insert error for memes: {str(e)}\n{traceback.format_exc()}")
                 raise e
+
+            # Near duplicates (re-encodes, resizes) are accepted but flagged to the uploader
+            try:
+                image_hash = fingerprints.dhash(get_storage().local_path(filename))
+            except (OSError, ValueError) as e:
+                current_app.logger.error(f"dHash failed for {filename}: {str(e)}")
+                image_hash = None
+            similar = []
+            if image_hash is not None:
+                similar = fingerprints.find_similar(db, image_hash, config['NEAR_DUPLICATE_DISTANCE'])
+            fingerprints.index_meme(db, meme_id, content_hash, image_hash)
             
             # If humor_explanation is provided, insert into meme_descriptions table
             humor_explanation = form_data.get('humor_explanation')
@@ -357,6 +299,12 @@ def upload_file():
                     current_app.logger.error(f"Database insert error for meme_descriptions: {str(e)}\n{traceback.format_exc()}")
                     raise e
             
+            # Offer the new meme to every evaluation queue
+            evaluation_queue.refresh_meme(db, meme_id)
+
+            # Resized copies are made in the background, committed with the meme
+            jobs.enqueue(db, 'image.derivatives', {'filename': filename, 'meme_id': meme_id})
+
             # Update user stats if logged in
             # DEBUG 
             print(f'Check increment')
@@ -370,8 +318,11 @@ def upload_file():
                     raise e
             
             db.commit()
+            jobs.wake()
             
             flash('Meme uploaded and classified successfully! Thank you for your detailed contribution to our research.', 'success')
+            if similar:
+                flash('Heads up: this meme looks very similar to {} meme(s) already in the collection.'.format(len(similar)), 'warning')
             
             # Check if we should prompt for evaluation
             if app_session.current_user and app_session.upload_count % config['PROMPT_EVAL_EVERY'] == 0 and app_session.upload_count >0:
@@ -380,6 +331,11 @@ def upload_file():
             print(f"Redirecting user to Gallery")
             return redirect(url_for('memes.gallery'))
             
+        except RequestEntityTooLarge:
+            flash('File size must be less than 16MB.', 'error')
+            return render_template('memes/upload.html', 
+                                 current_user=app_session.current_user, 
+                                 form_data=form_data)
         except Exception as e:
             print(f"Error {str(e)}")
             current_app.logger.error(f"Upload error: {str(e)}\n{traceback.format_exc()}")
@@ -462,11 +418,20 @@ def validate_form_data(form_data, current_user, config):
     
     return errors
 
-@bp.route('/uploaded_file/<filename>')
+@bp.route('/uploaded_file/<path:filename>')
 def uploaded_file(filename):
-    """Serve uploaded files"""
-    upload_folder = get_upload_folder(current_app)
-    return send_from_directory(upload_folder, filename)
+    """Serve uploaded files, or a resized copy when ?size= asks for a width"""
+    storage = get_storage()
+    # Links to files from before the sharded layout keep working
+    filename = resolve_upload(storage, filename, current_app.config['UPLOAD_SHARD_LEVELS'])
+    size = request.args.get('size', type=int)
+    if size:
+        key = images.pick_derivative(storage, filename, size, request.accept_mimetypes)
+        if key:
+            response = send_upload(storage, key)
+            response.vary.add('Accept')
+            return response
+    return send_upload(storage, filename)
 
 @bp.route('/meme/<int:meme_id>')
 def meme_detail(meme_id):
@@ -561,75 +526,20 @@ def meme_detail(meme_id):
         return redirect(url_for('memes.gallery'))
     
 
-    # Build filtered meme id list for navigation consistency
-    base_query = None
-    params = None
-
-    if filter_type == 'all':
-        base_query = '''
-            SELECT m.id
-            FROM memes AS m
-            LEFT JOIN evaluations AS e
-                ON m.id = e.meme_id AND e.user_id = ?
-            WHERE m.user_id = ? OR e.user_id = ?
-            ORDER BY m.upload_date DESC
-        '''
-        params = [user_id, user_id, user_id]
-
-    elif filter_type == 'evaluated':
-        base_query = '''
-            SELECT m.id
-            FROM memes AS m
-            JOIN evaluations AS e
-                ON m.id = e.meme_id
-            WHERE e.user_id = ?
-            ORDER BY m.upload_date DESC
-        '''
-        params = [user_id]
-
-    elif filter_type == 'own':
-        base_query = '''
-            SELECT id
-            FROM memes
-            WHERE user_id = ?
-            ORDER BY upload_date DESC
-        '''
-        params = [user_id]
-
-    elif filter_type == 'liked':
-        base_query = '''
-            SELECT m.id
-            FROM memes AS m
-            JOIN meme_likes AS ml
-                ON m.id = ml.meme_id
-            WHERE ml.user_id = ?
-            ORDER BY m.upload_date DESC
-        '''
-        params = [user_id]
-
-    # Fetch list of meme IDs in correct order
-    meme_list = [row["id"] for row in db.execute(base_query, params).fetchall()]
-
-    prev_id = None
-    prev_page = gallery_page
-    next_id = None
-    next_page = gallery_page
-
-    if meme_id in meme_list:
-        idx = meme_list.index(meme_id)
-        
-        # Next meme
-        if idx > 0:
-            next_id = meme_list[idx - 1]
-            next_page = get_meme_page(meme_list, next_id, per_page)
-            
-        # Previous meme
-        if idx < len(meme_list) - 1:
-            prev_id = meme_list[idx + 1]
-            prev_page = get_meme_page(meme_list, prev_id, per_page)
+    if filter_type not in gallery_data.FILTERS:
+        abort(400)
+
+    # Neighbours and gallery page from indexed seeks around this meme
+    position = gallery_data.neighbours(db, filter_type, user_id, meme_id, per_page)
+
+    # Next is the newer meme, previous the older one, as laid out in the gallery
+    next_id = position['newer_id']
+    next_page = (position['position'] - 1) // per_page + 1 if next_id else gallery_page
+    prev_id = position['older_id']
+    prev_page = (position['position'] + 1) // per_page + 1 if prev_id else gallery_page
 
     # Page for back-to-gallery
-    gallery_page_for_current_meme = get_meme_page(meme_list, meme_id, per_page)
+    gallery_page_for_current_meme = position['page']
 
     # Likes count
     likes_count = db.execute(
@@ -706,10 +616,3 @@ def meme_detail(meme_id):
         avg_emotions=avg_emotions,
         avg_context=avg_context,
     )
-
-def get_meme_page(meme_list, target_id, per_page):
-    """Return the page number where the target meme appears in meme_list"""
-    if target_id not in meme_list:
-        return 1
-    idx = meme_list.index(target_id)  # 0-based index
-    return (idx // per_page) + 1      # 1-based page number
\ No newline at end of file
@@ -0,0 +1,241 @@
+# memeqa/scoring.py
+"""Agreement between evaluations and the uploader's labels, scored with NumPy.
+
+Humor types and emotions are encoded as bitmasks over Config.HUMOR_TYPES
+and Config.EMOTIONS_TYPES (one bit per label, unknown labels dropped), so
+a whole batch of evaluations is compared with a few array operations:
+
+- per evaluation: humor/emotion Jaccard and F1 against the meme's labels,
+  stored as matches_humor_type (any shared humor type),
+  emotion_overlap_score (emotion Jaccard) and was_correct (shared humor
+  type and emotion Jaccard >= SCORING_EMOTION_THRESHOLD);
+- per meme (meme_agreement): mean Jaccard/F1 over its evaluations, the
+  share of evaluators picking the uploader's context level, and
+  Krippendorff's alpha among all coders (uploader and evaluators), with
+  every label a binary unit;
+- over the dataset: the same alphas with every (meme, label) pair, or
+  every meme for context levels, as a unit.
+
+This module is only imported by the 'scoring.meme' job and `flask
+score-evaluations` (memeqa/labels.py), so requests do not load NumPy;
+evaluate_meme scores its one new evaluation with labels.score_evaluation.
+"""
+import numpy as np
+from flask import current_app
+
+from memeqa.labels import label_sets
+
+
+def encode(label_set, values):
+    """Return (masks, present) arrays for a sequence of stored label values.
+
+    Stored values repeat a lot, so each distinct one is parsed once.
+    """
+    distinct = {}
+    index = np.empty(len(values), dtype=np.int64)
+    for i, value in enumerate(values):
+        index[i] = distinct.setdefault(value, len(distinct))
+    parsed = [label_set.mask(value) for value in distinct]
+    masks = np.array([mask or 0 for mask in parsed], dtype=np.uint64)
+    present = np.array([mask is not None for mask in parsed], dtype=bool)
+    return masks[index], present[index]
+
+
+def bit_matrix(label_set, masks):
+    """(rows, labels) 0/1 matrix of masks"""
+    shifts = np.arange(len(label_set.labels), dtype=np.uint64)
+    return ((masks[:, None] >> shifts) & np.uint64(1)).astype(np.int64)
+
+
+def overlap(a, b, present):
+    """Jaccard and F1 of two mask arrays, NaN where either side is missing or both are empty"""
+    inter = np.bitwise_count(a & b).astype(float)
+    union = np.bitwise_count(a | b).astype(float)
+    sizes = (np.bitwise_count(a) + np.bitwise_count(b)).astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        jaccard = np.where(present & (union > 0), inter / union, np.nan)
+        f1 = np.where(present & (sizes > 0), 2 * inter / sizes, np.nan)
+    return jaccard, f1
+
+
+def nominal_alpha(counts):
+    """Krippendorff's alpha for nominal data from per-unit value counts.
+
+    counts has shape (..., units, categories): how many coders gave each
+    value to each unit. The last two axes are reduced, so a stack of
+    per-meme count tables gives one alpha per meme. Units with fewer than
+    two coders are not pairable and are ignored; NaN where the data has
+    no variation at all.
+    """
+    counts = np.asarray(counts, dtype=float)
+    m = counts.sum(axis=-1)
+    pairable = m >= 2
+    counts = np.where(pairable[..., None], counts, 0.0)
+    m = np.where(pairable, m, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        disagreement = np.where(pairable, (m ** 2 - (counts ** 2).sum(axis=-1)) / np.where(pairable, m - 1, 1), 0.0)
+        n = m.sum(axis=-1)
+        expected = n ** 2 - (counts.sum(axis=-2) ** 2).sum(axis=-1)
+        return np.where(expected > 0, 1 - (n - 1) * disagreement.sum(axis=-1) / expected, np.nan)
+
+
+def _nullable(values):
+    return [None if np.isnan(value) else float(value) for value in values]
+
+
+def score_evaluations(db, evaluation_ids=None, after_id=0, limit=None):
+    """Score evaluations against their meme's labels and store the results.
+
+    Scores the given ids, or with evaluation_ids=None the next `limit`
+    evaluations after `after_id`. Returns the ids scored, in id order.
+    """
+    config = current_app.config
+    humor, emotions = label_sets(config)
+    sql = '''
+        SELECT e.id, e.evaluated_humor_type, e.evaluated_emotions, m.humor_type, m.emotions_conveyed
+        FROM evaluations AS e
+        JOIN memes AS m ON m.id = e.meme_id
+    '''
+    if evaluation_ids is not None:
+        ids = sorted(set(int(i) for i in evaluation_ids))
+        if not ids:
+            return []
+        rows = db.execute(f"{sql} WHERE e.id IN ({', '.join('?' * len(ids))}) ORDER BY e.id", ids).fetchall()
+    else:
+        rows = db.execute(f'{sql} WHERE e.id > ? ORDER BY e.id LIMIT ?', (after_id, limit or -1)).fetchall()
+    if not rows:
+        return []
+
+    ids = [row['id'] for row in rows]
+    eval_humor, eval_humor_present = encode(humor, [row['evaluated_humor_type'] for row in rows])
+    meme_humor, meme_humor_present = encode(humor, [row['humor_type'] for row in rows])
+    eval_emotions, eval_emotions_present = encode(emotions, [row['evaluated_emotions'] for row in rows])
+    meme_emotions, meme_emotions_present = encode(emotions, [row['emotions_conveyed'] for row in rows])
+
+    humor_present = eval_humor_present & meme_humor_present
+    emotions_present = eval_emotions_present & meme_emotions_present
+    matches_humor = np.bitwise_count(eval_humor & meme_humor) > 0
+    emotion_jaccard, _ = overlap(eval_emotions, meme_emotions, emotions_present)
+    correct = matches_humor & (emotion_jaccard >= config['SCORING_EMOTION_THRESHOLD'])
+
+    db.executemany('''
+        UPDATE evaluations
+        SET matches_humor_type = ?, emotion_overlap_score = ?, was_correct = ?
+        WHERE id = ?
+    ''', [
+        (
+            bool(matches_humor[i]) if humor_present[i] else None,
+            None if np.isnan(emotion_jaccard[i]) else float(emotion_jaccard[i]),
+            bool(correct[i]) if humor_present[i] and emotions_present[i] else None,
+            ids[i],
+        )
+        for i in range(len(ids))
+    ])
+    return ids
+
+
+def _coder_tables(db, meme_ids=None):
+    """Labels of every coder of the memes: the uploader (first, per meme) and each evaluator"""
+    where, params = '', []
+    if meme_ids is not None:
+        where = f"WHERE m.id IN ({', '.join('?' * len(meme_ids))})"
+        params = list(meme_ids)
+    return db.execute(f'''
+        SELECT m.id AS meme_id, 1 AS uploader, m.humor_type, m.emotions_conveyed, m.context_level
+        FROM memes AS m {where}
+        UNION ALL
+        SELECT e.meme_id, 0, e.evaluated_humor_type, e.evaluated_emotions, e.evaluated_context_level
+        FROM evaluations AS e JOIN memes AS m ON m.id = e.meme_id {where}
+    ''', params * 2).fetchall()
+
+
+def _per_meme_alpha(meme_index, bits, present, meme_count):
+    """Alpha per meme with each label as a binary unit"""
+    coders = np.bincount(meme_index[present], minlength=meme_count).astype(float)
+    ones = np.zeros((meme_count, bits.shape[1]))
+    np.add.at(ones, meme_index[present], bits[present])
+    counts = np.stack([coders[:, None] - ones, ones], axis=-1)  # (memes, labels, [absent, present])
+    return nominal_alpha(counts), counts
+
+
+def agreement(db, meme_ids=None):
+    """Compute meme_agreement rows (and dataset-wide alphas) for some memes, or all"""
+    config = current_app.config
+    humor, emotions = label_sets(config)
+    rows = _coder_tables(db, meme_ids)
+    if not rows:
+        return [], {}
+
+    meme_order, meme_index = np.unique(np.array([row['meme_id'] for row in rows]), return_inverse=True)
+    meme_count = len(meme_order)
+    uploader = np.array([row['uploader'] == 1 for row in rows])
+
+    humor_masks, humor_present = encode(humor, [row['humor_type'] for row in rows])
+    emotion_masks, emotion_present = encode(emotions, [row['emotions_conveyed'] for row in rows])
+    contexts = np.array([row['context_level'] or '' for row in rows], dtype=object)
+
+    # Every evaluator row against its meme's uploader row
+    upload_row = np.full(meme_count, -1)
+    upload_row[meme_index[uploader]] = np.nonzero(uploader)[0]
+    evaluator = ~uploader
+    target = upload_row[meme_index[evaluator]]
+
+    def mean_per_meme(values):
+        valid = ~np.isnan(values)
+        index = meme_index[evaluator][valid]
+        totals = np.bincount(index, weights=values[valid], minlength=meme_count)
+        counts = np.bincount(index, minlength=meme_count)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(counts > 0, totals / counts, np.nan)
+
+    humor_jaccard, humor_f1 = overlap(humor_masks[evaluator], humor_masks[target],
+                                      humor_present[evaluator] & humor_present[target])
+    emotion_jaccard, emotion_f1 = overlap(emotion_masks[evaluator], emotion_masks[target],
+                                          emotion_present[evaluator] & emotion_present[target])
+    context_valid = (contexts[evaluator] != '') & (contexts[target] != '')
+    context_match = np.where(context_valid, (contexts[evaluator] == contexts[target]).astype(float), np.nan)
+
+    humor_alpha, humor_counts = _per_meme_alpha(meme_index, bit_matrix(humor, humor_masks),
+                                                humor_present, meme_count)
+    emotion_alpha, emotion_counts = _per_meme_alpha(meme_index, bit_matrix(emotions, emotion_masks),
+                                                    emotion_present, meme_count)
+
+    # Context levels are one nominal value per coder and meme
+    levels, level_index = np.unique(contexts, return_inverse=True)
+    chosen = contexts != ''
+    context_counts = np.zeros((meme_count, len(levels)))
+    np.add.at(context_counts, (meme_index[chosen], level_index[chosen]), 1)
+
+    coders = np.bincount(meme_index, minlength=meme_count)
+    results = list(zip(
+        meme_order.tolist(), coders.tolist(),
+        _nullable(mean_per_meme(humor_jaccard)), _nullable(mean_per_meme(humor_f1)),
+        _nullable(mean_per_meme(emotion_jaccard)), _nullable(mean_per_meme(emotion_f1)),
+        _nullable(humor_alpha), _nullable(emotion_alpha),
+        _nullable(mean_per_meme(context_match)),
+    ))
+    dataset = {
+        'humor_alpha': nominal_alpha(humor_counts.reshape(1, -1, 2))[0],
+        'emotion_alpha': nominal_alpha(emotion_counts.reshape(1, -1, 2))[0],
+        'context_alpha': nominal_alpha(context_counts[None])[0],
+    }
+    return results, dataset
+
+
+def store_agreement(db, results):
+    db.executemany('''
+        INSERT INTO meme_agreement (
+            meme_id, coders, humor_jaccard, humor_f1, emotion_jaccard, emotion_f1,
+            humor_alpha, emotion_alpha, context_agreement, updated_at
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT (meme_id) DO UPDATE SET
+            coders = excluded.coders,
+            humor_jaccard = excluded.humor_jaccard,
+            humor_f1 = excluded.humor_f1,
+            emotion_jaccard = excluded.emotion_jaccard,
+            emotion_f1 = excluded.emotion_f1,
+            humor_alpha = excluded.humor_alpha,
+            emotion_alpha = excluded.emotion_alpha,
+            context_agreement = excluded.context_agreement,
+            updated_at = CURRENT_TIMESTAMP
+    ''', results)
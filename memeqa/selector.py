@@ -0,0 +1,55 @@
+# memeqa/selector.py
+"""Which (meme, description) pairs an actor can still evaluate.
+
+The whole computation is one SQL statement: candidate pairs are anti-joined
+against the actor's evaluations with NOT EXISTS, so nothing has to be pulled
+into Python (or pandas) to find out what is left.
+"""
+
+
+def pairs_query(column, actor, select_actor, actors_from='', meme_filter=''):
+    """Build the SELECT of every pair still open for the actor(s).
+
+    `column` is the ownership column (user_id or session_id) and `actor` the
+    SQL expression holding the actor's value for it. A pair is open when the
+    actor has not evaluated it yet; a meme without descriptions from others
+    stays open while the actor can still add the first description to it.
+    Rows are (actor, meme_id, description_id, random key) with -1 standing
+    for "no description".
+    """
+    return f'''
+        SELECT {select_actor} AS actor, m.id AS meme_id, COALESCE(md.id, -1) AS description_id, random()
+        FROM {actors_from} memes m
+        LEFT JOIN meme_descriptions md
+            ON md.meme_id = m.id AND md.{column} != {actor}
+        WHERE m.{column} != {actor}
+        {meme_filter}
+        AND (
+            NOT EXISTS (
+                SELECT 1
+                FROM evaluations e
+                LEFT JOIN description_evaluations de
+                    ON de.meme_id = e.meme_id AND de.{column} = e.{column}
+                WHERE e.meme_id = m.id AND e.{column} = {actor}
+                AND COALESCE(de.description_id, -1) = COALESCE(md.id, -1)
+            )
+            OR (
+                md.id IS NULL
+                AND NOT EXISTS (
+                    SELECT 1 FROM meme_descriptions mu
+                    WHERE mu.meme_id = m.id AND mu.{column} = {actor}
+                )
+                AND (SELECT COUNT(*) FROM meme_descriptions ma WHERE ma.meme_id = m.id) < :max_descriptions
+            )
+        )
+    '''
+
+
+def available_pairs(db, user_id, session_id, max_descriptions):
+    """Return the set of (meme_id, description_id) pairs open for a user or session"""
+    column = 'user_id' if user_id else 'session_id'
+    rows = db.execute(
+        pairs_query(column, ':actor_value', 'NULL'),
+        {'actor_value': user_id if user_id else session_id, 'max_descriptions': max_descriptions}
+    ).fetchall()
+    return {(row['meme_id'], row['description_id']) for row in rows}
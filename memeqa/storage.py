@@ -0,0 +1,218 @@
+# memeqa/storage.py
+"""Where uploaded images and their derivatives are kept.
+
+Files are addressed by key, the relative path stored in memes.filename
+(derivatives live under derivatives/). Two backends share one interface:
+
+- FilesystemStorage keeps everything in the upload folder, as before.
+- S3Storage keeps the files in an S3-compatible bucket (AWS, or MinIO /
+  moto locally through S3_ENDPOINT_URL) so several app nodes can share
+  them. Large files go up as multipart uploads, url() hands out presigned
+  GET URLs so browsers fetch the bytes from the bucket instead of Flask,
+  and the upload folder becomes a read-through cache for the files the
+  app itself needs (image processing, or serving when presigning is off).
+
+Code that needs the bytes asks for local_path(key); code that writes puts
+a finished local file with put_file(key, path).
+"""
+import mimetypes
+import os
+import threading
+import uuid
+
+from cachetools import TTLCache
+from flask import current_app
+from werkzeug.security import safe_join
+
+
+class FilesystemStorage:
+    """Files kept in a local (or shared network) folder"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def cache_path(self, key):
+        """Return the local path a key is stored at"""
+        path = safe_join(self.root, key)
+        if path is None:
+            raise ValueError(f'Invalid storage key {key!r}')
+        return path
+
+    def exists(self, key):
+        return os.path.isfile(self.cache_path(key))
+
+    def local_path(self, key):
+        """Return a local path holding the file, raising FileNotFoundError if there is none"""
+        path = self.cache_path(key)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(key)
+        return path
+
+    def put_file(self, key, path):
+        """Store a local file under key; the file is moved, not copied"""
+        target = self.cache_path(key)
+        if os.path.abspath(path) != os.path.abspath(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(path, target)
+
+    def delete(self, key):
+        try:
+            os.unlink(self.cache_path(key))
+        except FileNotFoundError:
+            pass
+
+    def url(self, key):
+        """Return a URL serving the file directly, or None to serve it through Flask"""
+        return None
+
+
+class S3Storage(FilesystemStorage):
+    """Files kept in an S3 bucket, with root as the local read-through cache"""
+
+    def __init__(self, root, bucket, prefix='', endpoint_url=None, region=None,
+                 access_key_id=None, secret_access_key=None, presign_expires=3600,
+                 multipart_threshold=8 * 1024 * 1024, multipart_chunksize=8 * 1024 * 1024,
+                 max_concurrency=4, cache_control=None):
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+        except ImportError:
+            raise RuntimeError('STORAGE_BACKEND=s3 needs boto3 (pip install boto3)')
+
+        super().__init__(root)
+        self.bucket = bucket
+        self.prefix = prefix
+        self.presign_expires = presign_expires
+        self.cache_control = cache_control
+        # boto3 clients are thread-safe; one per storage object is shared by all requests
+        self.client = boto3.client(
+            's3',
+            endpoint_url=endpoint_url or None,
+            region_name=region or None,
+            aws_access_key_id=access_key_id or None,
+            aws_secret_access_key=secret_access_key or None,
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_chunksize,
+            max_concurrency=max_concurrency,
+        )
+        self._lock = threading.Lock()
+        # Presigned URLs are reused for half their lifetime so browsers can cache them
+        self._urls = TTLCache(maxsize=10000, ttl=max(1, presign_expires // 2))
+        # HEAD results, so missing derivatives do not cost a request each time
+        self._missing = TTLCache(maxsize=10000, ttl=60)
+
+    def object_key(self, key):
+        return self.prefix + key
+
+    def _is_missing(self, error):
+        return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+    def exists(self, key):
+        if os.path.isfile(self.cache_path(key)):
+            return True
+        with self._lock:
+            if key in self._missing:
+                return False
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))
+            return True
+        except ClientError as e:
+            if not self._is_missing(e):
+                raise
+        with self._lock:
+            self._missing[key] = True
+        return False
+
+    def local_path(self, key):
+        path = self.cache_path(key)
+        if os.path.isfile(path):
+            return path
+
+        from botocore.exceptions import ClientError
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{uuid.uuid4().hex}.download'
+        try:
+            self.client.download_file(self.bucket, self.object_key(key), tmp_path, Config=self.transfer_config)
+            os.replace(tmp_path, path)
+        except ClientError as e:
+            if self._is_missing(e):
+                raise FileNotFoundError(key)
+            raise
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        return path
+
+    def put_file(self, key, path):
+        extra = {'ContentType': mimetypes.guess_type(key)[0] or 'application/octet-stream'}
+        if self.cache_control:
+            extra['CacheControl'] = self.cache_control
+        self.client.upload_file(path, self.bucket, self.object_key(key),
+                                ExtraArgs=extra, Config=self.transfer_config)
+        with self._lock:
+            self._missing.pop(key, None)
+        # Keep the local copy as the cache entry
+        super().put_file(key, path)
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self.object_key(key))
+        super().delete(key)
+
+    def url(self, key):
+        if not self.presign_expires:
+            return None
+        with self._lock:
+            url = self._urls.get(key)
+        if url is None:
+            url = self.client.generate_presigned_url(
+                'get_object',
+                Params={'Bucket': self.bucket, 'Key': self.object_key(key)},
+                ExpiresIn=self.presign_expires,
+            )
+            with self._lock:
+                self._urls[key] = url
+        return url
+
+
+def create_storage(app):
+    """Build the storage backend named by STORAGE_BACKEND"""
+    from memeqa.utils import get_upload_folder
+
+    config = app.config
+    backend = config['STORAGE_BACKEND']
+    root = get_upload_folder(app)
+    if backend == 'filesystem':
+        return FilesystemStorage(root)
+    if backend == 's3':
+        if not config['S3_BUCKET']:
+            raise RuntimeError('STORAGE_BACKEND=s3 needs S3_BUCKET')
+        return S3Storage(
+            root, config['S3_BUCKET'],
+            prefix=config['S3_PREFIX'],
+            endpoint_url=config['S3_ENDPOINT_URL'],
+            region=config['S3_REGION'],
+            access_key_id=config['S3_ACCESS_KEY_ID'],
+            secret_access_key=config['S3_SECRET_ACCESS_KEY'],
+            presign_expires=config['S3_PRESIGN_EXPIRES'],
+            multipart_threshold=config['S3_MULTIPART_THRESHOLD'],
+            multipart_chunksize=config['S3_MULTIPART_CHUNKSIZE'],
+            max_concurrency=config['S3_MAX_CONCURRENCY'],
+            cache_control=f"public, max-age={config['UPLOAD_CACHE_MAX_AGE']}, immutable",
+        )
+    raise RuntimeError(f'Unknown STORAGE_BACKEND {backend!r}')
+
+
+_storage_lock = threading.Lock()
+
+
+def get_storage(app=None):
+    """Return the app's storage backend, creating it on first use"""
+    app = app or current_app
+    if 'memeqa_storage' not in app.extensions:
+        with _storage_lock:
+            if 'memeqa_storage' not in app.extensions:
+                app.extensions['memeqa_storage'] = create_storage(app)
+    return app.extensions['memeqa_storage']
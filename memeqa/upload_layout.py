@@ -0,0 +1,137 @@
+# memeqa/upload_layout.py
+"""Moving uploads from the flat upload folder into the sharded layout.
+
+`flask shard-uploads` works through memes whose filename has no directory
+in batches while the app keeps serving. Each file (and its derivatives) is
+first hard-linked at its new path, then the batch's memes.filename values
+are rewritten in one transaction, and only after the commit are the old
+names unlinked. A reader therefore finds the file under whichever name it
+read from the database, and a failed batch leaves no row pointing at a
+missing file.
+"""
+import os
+import shutil
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from memeqa.images import MIME_TYPES, derivative_name, derivatives_folder
+
+
+def _link(source, target):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(source, target)
+    except FileExistsError:
+        pass
+    except OSError:
+        # No hard links on this filesystem: fall back to a copy
+        shutil.copy2(source, target)
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def _file_moves(upload_folder, filename, sharded, sizes):
+    """Return the (old path, new path) pairs for an upload and its existing derivatives"""
+    moves = [(os.path.join(upload_folder, filename), os.path.join(upload_folder, sharded))]
+    folder = derivatives_folder(upload_folder)
+    for size in sizes:
+        for fmt in MIME_TYPES:
+            old = os.path.join(folder, derivative_name(filename, size, fmt))
+            if os.path.exists(old):
+                moves.append((old, os.path.join(folder, derivative_name(sharded, size, fmt))))
+    return moves
+
+
+def shard_batch(db, upload_folder, rows, levels, sizes):
+    """Move one batch of flat uploads; return (moved, missing)"""
+    from memeqa.utils import shard_filename
+
+    planned = []  # (meme id, old filename, new filename, moves)
+    missing = 0
+    for row in rows:
+        sharded = shard_filename(row['filename'], levels)
+        moves = _file_moves(upload_folder, row['filename'], sharded, sizes)
+        if not os.path.exists(moves[0][0]):
+            missing += 1
+            continue
+        planned.append((row['id'], row['filename'], sharded, moves))
+
+    linked = []
+    try:
+        for _, _, _, moves in planned:
+            for old, new in moves:
+                _link(old, new)
+                linked.append(new)
+
+        moved = []
+        for meme_id, filename, sharded, moves in planned:
+            # Skip rows whose filename changed since the batch was read
+            cursor = db.execute('UPDATE memes SET filename = ? WHERE id = ? AND filename = ?',
+                                (sharded, meme_id, filename))
+            if cursor.rowcount:
+                moved.append(moves)
+        db.commit()
+    except Exception:
+        db.rollback()
+        for path in linked:
+            _unlink(path)
+        raise
+
+    stale = {new for moves in moved for _, new in moves}
+    for path in linked:
+        if path not in stale:
+            _unlink(path)
+    for moves in moved:
+        for old, _ in moves:
+            _unlink(old)
+    return len(moved), missing
+
+
+@click.command('shard-uploads')
+@click.option('--batch-size', default=500, show_default=True, help='Memes moved per transaction.')
+@click.option('--dry-run', is_flag=True, help='Only count the memes still stored flat.')
+@with_appcontext
+def shard_uploads_command(batch_size, dry_run):
+    """Move flat uploads into the sharded layout and rewrite memes.filename."""
+    from memeqa.database import get_db
+    from memeqa.utils import get_upload_folder
+
+    db = get_db()
+    levels = current_app.config['UPLOAD_SHARD_LEVELS']
+    if not levels:
+        click.echo('UPLOAD_SHARD_LEVELS is 0, nothing to do')
+        return
+    if current_app.config['STORAGE_BACKEND'] != 'filesystem':
+        # Object stores have no directories to fill up
+        click.echo('Only the filesystem storage backend is sharded, nothing to do')
+        return
+    if dry_run:
+        count = db.execute("SELECT COUNT(*) AS count FROM memes WHERE instr(filename, '/') = 0").fetchone()['count']
+        click.echo(f'{count} memes stored flat')
+        return
+
+    upload_folder = get_upload_folder(current_app)
+    sizes = current_app.config['IMAGE_DERIVATIVE_SIZES']
+    last_id = 0
+    moved = missing = 0
+    while True:
+        rows = db.execute('''
+            SELECT id, filename FROM memes
+            WHERE id > ? AND instr(filename, '/') = 0
+            ORDER BY id LIMIT ?
+        ''', (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1]['id']
+        batch_moved, batch_missing = shard_batch(db, upload_folder, rows, levels, sizes)
+        moved += batch_moved
+        missing += batch_missing
+        click.echo(f'Up to meme {last_id}: {moved} moved, {missing} missing files')
+    click.echo(f'{moved} memes moved, {missing} skipped because their file is missing')
@@ -2,102 +2,50 @@
 
 import os
 import uuid
-from werkzeug.utils import secure_filename
-import secrets
+import re
+import mimetypes
+from werkzeug.utils import secure_filename, send_file
 import hashlib
-import time
-import base64
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from flask import session, current_app
+from flask import session, current_app, g, request, abort, redirect
 from memeqa.database import get_db
+from memeqa import jobs
+from memeqa import mailer
+from memeqa.ingest import UploadStream
+from memeqa.storage import get_storage
 import json
 
+_SHA256_HEX = re.compile(r'[0-9a-f]{64}')
 
-def generate_login_token(email, secret_key):
-    """Generate a secure login token for email"""
-    timestamp = str(int(time.time()))
-    random_part = secrets.token_urlsafe(32)
-    token_data = f"{email}:{timestamp}:{random_part}"
-    token_hash = hashlib.sha256(f"{token_data}:{secret_key}".encode()).hexdigest()
-    final_token = base64.urlsafe_b64encode(f"{token_data}:{token_hash}".encode()).decode()
-    return final_token
 
-def verify_login_token(token, email, secret_key):
-    """Verify a login token is valid"""
-    try:
-        decoded = base64.urlsafe_b64decode(token.encode()).decode()
-        parts = decoded.split(':')
-        
-        if len(parts) != 4:
-            return False
-        
-        token_email, timestamp, random_part, token_hash = parts
-        
-        if token_email != email:
-            return False
-        
-        # Check token is not too old (24 hours)
-        token_time = int(timestamp)
-        if time.time() - token_time > 24 * 60 * 60:
-            return False
-        
-        # Verify hash
-        expected_hash = hashlib.sha256(f"{token_email}:{timestamp}:{random_part}:{secret_key}".encode()).hexdigest()
-        return token_hash == expected_hash
-        
-    except Exception as e:
-        print(f"Token verification error: {e}")
-        return False
-
-def send_email(to_email, subject, body, config):
-    """Send email based on environment"""
-    if config.get('DEVELOPMENT'):
-        print("="*50)
-        print(f"EMAIL TO: {to_email}")
-        print(f"SUBJECT: {subject}")
-        print(f"BODY:\n{body}")
-        print("="*50)
-        return True
-    else:
-        return send_email_gmail(to_email, subject, body, config)
-
-def send_email_gmail(to_email, subject, body, config):
-    """Send email via Gmail SMTP"""
-    sender_email = config.get('GMAIL_USER')
-    sender_password = config.get('GMAIL_APP_PASSWORD')
-    
-    if not sender_email or not sender_password:
-        print("Gmail credentials not configured")
-        return False
-    
-    msg = MIMEMultipart()
-    msg['From'] = sender_email
-    msg['To'] = to_email
-    msg['Subject'] = subject
-    msg.attach(MIMEText(body, 'plain'))
-    
-    try:
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(sender_email, sender_password)
-        server.send_message(msg)
-        server.quit()
-        return True
-    except Exception as e:
-        print(f"Email error: {e}")
-        return False
+def send_email(to_email, subject, body):
+    """Queue an email for the background sender (memeqa/mailer.py) and return at once"""
+    db = get_db()
+    mailer.queue_email(db, to_email, subject, body)
+    db.commit()
+    jobs.wake()
 
 def get_current_user(db):
-    """Get current user from session"""
+    """Get current user from session (looked up once per request)"""
     from flask import session
     if 'user_id' in session:
-        user = db.execute('SELECT * FROM users WHERE id = ?', 
-                         (session['user_id'],)).fetchone()
-        return user
+        if g.get('current_user_id') != session['user_id']:
+            g.current_user = db.execute('SELECT * FROM users WHERE id = ?', 
+                                        (session['user_id'],)).fetchone()
+            g.current_user_id = session['user_id']
+        return g.current_user
     return None
 
+def invalidate_current_user():
+    """Drop the request's cached user row after its counters changed"""
+    g.pop('current_user', None)
+    g.pop('current_user_id', None)
+
+def get_app_session():
+    """Get the AppSession for this request, built once and shared by routes and templates"""
+    if 'app_session' not in g:
+        g.app_session = AppSession(get_current_user(get_db()))
+    return g.app_session
+
 def get_upload_folder(app):
     """Get the absolute path to the upload folder"""
     import os
@@ -106,17 +54,118 @@ def get_upload_folder(app):
         upload_folder = os.path.join(os.path.dirname(app.root_path), upload_folder)
     return upload_folder
 
+def shard_filename(name, levels):
+    """Return the path of an upload below the upload folder, e.g. ab/cd/<name>.
+
+    Directories are named after the leading hex digits of the content hash
+    in the name, or of a hash of the name for uploads not named by content.
+    """
+    name = os.path.basename(name)
+    if not levels:
+        return name
+    stem = name.rsplit('.', 1)[0]
+    key = stem if _SHA256_HEX.fullmatch(stem) else hashlib.sha256(name.encode()).hexdigest()
+    return '/'.join([key[2 * i:2 * i + 2] for i in range(levels)] + [name])
+
+def resolve_upload(storage, filename, levels):
+    """Return the storage key of an upload, following flat names to their shard"""
+    if '/' not in filename and not storage.exists(filename):
+        sharded = shard_filename(filename, levels)
+        if storage.exists(sharded):
+            return sharded
+    return filename
+
+def send_upload(storage, name):
+    """Send an upload (or a derivative) from storage with long-lived caching.
+
+    Upload names never change content: new uploads are named by their
+    SHA-256 and older ones by a UUID, so responses are marked immutable and
+    carry a strong ETag (the content hash, or a hash of the name). Range and
+    If-None-Match / If-Modified-Since are handled by werkzeug's send_file.
+    UPLOAD_OFFLOAD hands the bytes to the front-end server instead:
+    'x-sendfile' (Apache, lighttpd) or 'x-accel-redirect' (nginx, with an
+    internal location at UPLOAD_ACCEL_PREFIX aliased to the upload folder).
+    Storage backends that hand out their own URLs (presigned S3 GETs) get a
+    redirect instead, so the bytes bypass the app entirely.
+    """
+    url = storage.url(name)
+    if url:
+        response = redirect(url)
+        # The URL stays valid for a while: let the browser reuse the redirect, but not shared caches
+        response.cache_control.private = True
+        response.cache_control.max_age = max(0, storage.presign_expires // 2 - 60)
+        return response
+
+    try:
+        path = storage.local_path(name)
+    except (FileNotFoundError, ValueError):
+        abort(404)
+
+    stem = os.path.basename(name).rsplit('.', 1)[0]
+    etag = stem if _SHA256_HEX.fullmatch(stem) else hashlib.sha256(name.encode()).hexdigest()
+    offload = current_app.config.get('UPLOAD_OFFLOAD')
+
+    if offload == 'x-accel-redirect':
+        if request.if_none_match.contains(etag):
+            response = current_app.response_class(status=304)
+        else:
+            response = current_app.response_class(
+                mimetype=mimetypes.guess_type(name)[0] or 'application/octet-stream')
+            response.headers['X-Accel-Redirect'] = current_app.config['UPLOAD_ACCEL_PREFIX'].rstrip('/') + '/' + name
+        response.set_etag(etag)
+    else:
+        response = send_file(
+            path, request.environ,
+            etag=etag,
+            max_age=current_app.config['UPLOAD_CACHE_MAX_AGE'],
+            conditional=True,
+            use_x_sendfile=offload == 'x-sendfile',
+            response_class=current_app.response_class,
+        )
+
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['UPLOAD_CACHE_MAX_AGE']
+    response.cache_control.immutable = True
+    return response
+
 def allowed_file(filename, allowed_extensions):
     """Check if file extension is allowed"""
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in allowed_extensions
 
-def save_uploaded_file(file, upload_folder):
-    """Save uploaded file with unique filename"""
+def is_accepted_image(file):
+    """Check an uploaded file's sniffed content type, or its extension if it was not streamed"""
+    if isinstance(file.stream, UploadStream):
+        return not file.stream.rejected
+    return allowed_file(file.filename, current_app.config['ALLOWED_EXTENSIONS'])
+
+def save_uploaded_file(file, upload_folder, content_hash=None):
+    """Save uploaded file, named by its content hash when given, else with a unique filename.
+
+    The file is written to the upload folder first and then handed to the
+    storage backend (a no-op for the filesystem one).
+    """
     original_filename = secure_filename(file.filename)
-    unique_filename = str(uuid.uuid4()) + '_' + original_filename
-    file_path = os.path.join(upload_folder, unique_filename)
-    file.save(file_path)
+    if isinstance(file.stream, UploadStream):
+        extension = file.stream.image_type
+    else:
+        extension = original_filename.rsplit('.', 1)[-1].lower()
+
+    if content_hash:
+        unique_filename = f'{content_hash}.{extension}'
+    else:
+        unique_filename = str(uuid.uuid4()) + '_' + original_filename
+    unique_filename = shard_filename(unique_filename, current_app.config['UPLOAD_SHARD_LEVELS'])
+    os.makedirs(os.path.dirname(os.path.join(upload_folder, unique_filename)), exist_ok=True)
+
+    if isinstance(file.stream, UploadStream):
+        # Already on disk next to its destination: just rename it
+        path = file.stream.commit(unique_filename)
+    else:
+        path = os.path.join(upload_folder, unique_filename)
+        file.save(path)
+    get_storage().put_file(unique_filename, path)
     return unique_filename, original_filename
 
 # Add to memeqa/utils.py
@@ -178,6 +227,11 @@ def transfer_anonymous_data(db, session_id, user_id):
         'UPDATE users SET total_submissions = ?, total_evaluations = ? WHERE id = ?',
         (meme_count, eval_count, user_id)
     )
+
+    # Ownership changed, let both evaluation queues rebuild
+    from memeqa import evaluation_queue
+    evaluation_queue.drop_queue(db, session_id=session_id)
+    evaluation_queue.drop_queue(db, user_id=user_id)
     
     db.commit()
 
@@ -246,11 +300,13 @@ class AppSession:
         session['session_id'] = self.session_id  # Persist
         self.user_id = current_user['id'] if current_user else None
         self.name = current_user['name'] if current_user else 'Anonymous'
-        self._load_stats()
+        self._available_memes = None
+        self._load_stats(current_user)
 
-    def _load_stats(self):
+    def _load_stats(self, user=None):
         if self.current_user:
-            user = self.db.execute('SELECT total_submissions, total_evaluations, evaluation_accuracy FROM users WHERE id = ?', (self.user_id,)).fetchone()
+            if user is None:
+                user = self.db.execute('SELECT total_submissions, total_evaluations, evaluation_accuracy FROM users WHERE id = ?', (self.user_id,)).fetchone()
             self.upload_count = user['total_submissions'] if user else 0
             self.eval_count = user['total_evaluations'] if user else 0
             self.evaluation_accuracy = user['evaluation_accuracy'] if user else 0.0
@@ -282,12 +338,15 @@ class AppSession:
         if self.current_user:
             self.db.execute('UPDATE users SET total_submissions = total_submissions + 1 WHERE id = ?', (self.user_id,))
             self.db.commit()
+            invalidate_current_user()
+        self._available_memes = None
         self._load_stats()  # Refresh counts
 
     def increment_evaluation(self):
         if self.current_user:
             self.db.execute('UPDATE users SET total_evaluations = total_evaluations + 1 WHERE id = ?', (self.user_id,))
             self.db.commit()
+            invalidate_current_user()
         self._load_stats()
 
     def get_total_memes(self):
@@ -295,22 +354,31 @@ class AppSession:
         return result['count'] if result else 0
 
     def get_available_memes(self):
-        own_meme_ids = self.get_own_meme_ids()
-        if not own_meme_ids:
-            result = self.db.execute('SELECT COUNT(*) as count FROM memes').fetchone()
-        else:
-            result = self.db.execute(
-                'SELECT COUNT(*) as count FROM memes WHERE id NOT IN ({})'.format(','.join('?' * len(own_meme_ids))),
-                tuple(own_meme_ids)
-            ).fetchone()
-        return result['count'] if result else 0
+        # Templates call this several times per page, so count once
+        if self._available_memes is None:
+            if self.current_user:
+                own = self.db.execute('SELECT COUNT(*) as count FROM memes WHERE user_id = ?', (self.user_id,)).fetchone()
+            else:
+                own = self.db.execute('SELECT COUNT(*) as count FROM memes WHERE session_id = ? AND user_id IS NULL', (self.session_id,)).fetchone()
+            self._available_memes = self.get_total_memes() - own['count']
+        return self._available_memes
 
 
 class Pagination:
-    def __init__(self, page, per_page, total_count):
+    """Page state for templates.
+
+    Offset pages derive prev/next from page and total_count. Keyset pages
+    (see memeqa/gallery.py) pass the cursors of their neighbours instead;
+    a missing cursor means there is no page in that direction. total_count
+    may then be a cached, slightly stale figure used for display only.
+    """
+    def __init__(self, page, per_page, total_count, next_cursor=None, prev_cursor=None, keyset=False):
         self.page = page
         self.per_page = per_page
         self.total_count = total_count
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.keyset = keyset
         self._items = []
     
     @property
@@ -331,15 +399,21 @@ class Pagination:
     
     @property
     def has_prev(self):
+        if self.keyset:
+            return self.prev_cursor is not None
         return self.page > 1
     
     @property
     def has_next(self):
+        if self.keyset:
+            return self.next_cursor is not None
         return self.page < self.pages
     
     @property
     def pages(self):
-        return int((self.total_count - 1) / self.per_page) + 1 if self.total_count > 0 else 1
+        pages = int((self.total_count - 1) / self.per_page) + 1 if self.total_count > 0 else 1
+        # A cached total can lag behind the page we are actually on
+        return max(pages, self.page + 1 if self.has_next and self.keyset else self.page)
     
     @property
     def total(self):
@@ -347,10 +421,12 @@ class Pagination:
     
     @property
     def first(self):
-        return ((self.page - 1) * self.per_page) + 1 if self.total_count > 0 else 0
+        return ((self.page - 1) * self.per_page) + 1 if self.total_count > 0 or self._items else 0
     
     @property
     def last(self):
+        if self.keyset:
+            return self.first + len(self._items) - 1 if self._items else 0
         return min(self.first + self.per_page - 1, self.total_count)
     
     def iter_pages(self, left_edge=2, left_current=2, right_current=3, right_edge=2):
@@ -1,4 +1,4 @@
--- MemeQA Database Schema
+-- MemeQA Database Schema (migration 0001, baseline)
 
 -- Memes table
 CREATE TABLE IF NOT EXISTS memes (
@@ -149,6 +149,27 @@ CREATE TABLE IF NOT EXISTS user_sessions (
     FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE SET NULL
 );
 
+-- Open (meme, description) pairs per actor, see memeqa/evaluation_queue.py
+CREATE TABLE IF NOT EXISTS evaluation_queue (
+    actor TEXT NOT NULL, -- 'user:<id>' or 'session:<id>'
+    meme_id INTEGER NOT NULL,
+    description_id INTEGER NOT NULL, -- -1 when the meme is shown without a description
+    sort_key INTEGER NOT NULL, -- Random key used to sample the queue
+    PRIMARY KEY (actor, meme_id, description_id),
+    FOREIGN KEY (meme_id) REFERENCES memes (id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS idx_evaluation_queue_sort ON evaluation_queue (actor, sort_key);
+CREATE INDEX IF NOT EXISTS idx_evaluation_queue_meme ON evaluation_queue (meme_id);
+
+-- Actors whose evaluation queue has been materialised
+CREATE TABLE IF NOT EXISTS evaluation_queue_actors (
+    actor TEXT PRIMARY KEY,
+    user_id INTEGER,
+    session_id TEXT,
+    built_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
 -- TRIGGERS
 
 CREATE TRIGGER IF NOT EXISTS increment_meme_likes
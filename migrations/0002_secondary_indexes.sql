@@ -0,0 +1,29 @@
+-- Secondary indexes for the filters and joins used by memeqa/routes/*.py
+-- Checked with `flask audit-queries` (memeqa/query_audit.py)
+
+-- memes: own uploads (profile, gallery 'own', transfer) and anonymous session lookups
+CREATE INDEX IF NOT EXISTS idx_memes_user_upload ON memes (user_id, upload_date);
+CREATE INDEX IF NOT EXISTS idx_memes_session_user ON memes (session_id, user_id);
+
+-- evaluations: per-user and per-session history; (meme_id, user_id) is already UNIQUE
+CREATE INDEX IF NOT EXISTS idx_evaluations_user_meme ON evaluations (user_id, meme_id);
+CREATE INDEX IF NOT EXISTS idx_evaluations_session_user ON evaluations (session_id, user_id);
+CREATE INDEX IF NOT EXISTS idx_evaluations_meme_session ON evaluations (meme_id, session_id);
+
+-- meme_descriptions: descriptions of a meme, and whether the actor wrote one
+CREATE INDEX IF NOT EXISTS idx_meme_descriptions_meme_user ON meme_descriptions (meme_id, user_id);
+CREATE INDEX IF NOT EXISTS idx_meme_descriptions_meme_session ON meme_descriptions (meme_id, session_id);
+
+-- description_evaluations: the actor's votes on a meme's descriptions
+CREATE INDEX IF NOT EXISTS idx_description_evaluations_meme_user ON description_evaluations (meme_id, user_id);
+CREATE INDEX IF NOT EXISTS idx_description_evaluations_meme_session ON description_evaluations (meme_id, session_id);
+
+-- meme_likes: a user's liked memes; (meme_id, user_id) is already UNIQUE
+CREATE INDEX IF NOT EXISTS idx_meme_likes_user_meme ON meme_likes (user_id, meme_id);
+
+-- meme_analytics: one row per meme, joined from analytics and export
+CREATE INDEX IF NOT EXISTS idx_meme_analytics_meme ON meme_analytics (meme_id);
+
+-- users: leaderboards and contributor rank
+CREATE INDEX IF NOT EXISTS idx_users_total_submissions ON users (total_submissions);
+CREATE INDEX IF NOT EXISTS idx_users_total_evaluations ON users (total_evaluations);
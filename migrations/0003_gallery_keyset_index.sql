@@ -0,0 +1,3 @@
+-- Keyset pagination for the gallery: pages are sought by (upload_date, id),
+-- see memeqa/gallery.py. id is the rowid but is listed so the key is explicit.
+CREATE INDEX IF NOT EXISTS idx_memes_upload ON memes (upload_date, id);
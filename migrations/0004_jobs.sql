@@ -0,0 +1,19 @@
+-- Durable background jobs, claimed and run by memeqa/jobs.py
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL DEFAULT '{}', -- JSON
+    status TEXT NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'done', 'failed')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 5,
+    run_after TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    locked_by TEXT,
+    locked_at TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+-- Next job to claim: queued and due, oldest first; stale running jobs by lease
+CREATE INDEX IF NOT EXISTS idx_jobs_status_run_after ON jobs (status, run_after);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_locked_at ON jobs (status, locked_at);
@@ -0,0 +1,17 @@
+-- Content fingerprints for duplicate detection, see memeqa/fingerprints.py
+-- content_hash: SHA-256 of the uploaded bytes (also the stored file name)
+-- dhash: 64-bit difference hash of the image, stored as a signed integer
+ALTER TABLE memes ADD COLUMN content_hash TEXT;
+ALTER TABLE memes ADD COLUMN dhash INTEGER;
+
+-- Not UNIQUE: memes uploaded before fingerprinting may already repeat
+CREATE INDEX IF NOT EXISTS idx_memes_content_hash ON memes (content_hash);
+
+-- Multi-index hashing: each dHash split into four 16-bit bands
+CREATE TABLE IF NOT EXISTS meme_dhash_bands (
+    band INTEGER NOT NULL,
+    value INTEGER NOT NULL,
+    meme_id INTEGER NOT NULL,
+    PRIMARY KEY (band, value, meme_id),
+    FOREIGN KEY (meme_id) REFERENCES memes (id) ON DELETE CASCADE
+) WITHOUT ROWID;
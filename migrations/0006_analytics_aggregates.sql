@@ -0,0 +1,186 @@
+-- Materialised aggregates behind /analytics, see memeqa/aggregates.py
+-- Kept current by the triggers below; `flask rebuild-aggregates` recomputes them
+
+-- Named dashboard counters
+CREATE TABLE IF NOT EXISTS analytics_counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+
+-- Memes per value of the columns the dashboard breaks down
+-- dimension: 'country', 'platform', 'humor_type' or 'context_level'
+CREATE TABLE IF NOT EXISTS analytics_breakdowns (
+    dimension TEXT NOT NULL,
+    value TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (dimension, value)
+) WITHOUT ROWID;
+
+-- Evaluations per session, so distinct evaluators are counted without COUNT(DISTINCT)
+CREATE TABLE IF NOT EXISTS analytics_evaluator_sessions (
+    session_id TEXT PRIMARY KEY,
+    evaluations INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+
+-- Ranking memes by accuracy only looks at memes with enough evaluations
+CREATE INDEX IF NOT EXISTS idx_meme_analytics_accuracy
+    ON meme_analytics (accuracy_rate) WHERE total_evaluations >= 5;
+
+-- Initial fill (the same statements as memeqa.aggregates.rebuild)
+INSERT INTO analytics_counters (name, value)
+SELECT 'memes', COUNT(*) FROM memes
+UNION ALL SELECT 'evaluations', COUNT(*) FROM evaluations
+UNION ALL SELECT 'judged_evaluations', COUNT(was_correct) FROM evaluations
+UNION ALL SELECT 'correct_evaluations', COUNT(CASE WHEN was_correct THEN 1 END) FROM evaluations
+UNION ALL SELECT 'evaluators', COUNT(DISTINCT session_id) FROM evaluations
+UNION ALL SELECT 'active_users', COUNT(*) FROM users WHERE is_active = 1;
+
+INSERT INTO analytics_breakdowns (dimension, value, count)
+SELECT 'country', contributor_country, COUNT(*) FROM memes WHERE contributor_country != '' GROUP BY contributor_country
+UNION ALL SELECT 'platform', platform_found, COUNT(*) FROM memes WHERE platform_found != '' GROUP BY platform_found
+UNION ALL SELECT 'humor_type', humor_type, COUNT(*) FROM memes WHERE humor_type != '' GROUP BY humor_type
+UNION ALL SELECT 'context_level', context_level, COUNT(*) FROM memes WHERE context_level != '' GROUP BY context_level;
+
+INSERT INTO analytics_evaluator_sessions (session_id, evaluations)
+SELECT session_id, COUNT(*) FROM evaluations WHERE session_id IS NOT NULL GROUP BY session_id;
+
+-- memes: totals and breakdowns
+
+CREATE TRIGGER IF NOT EXISTS aggregates_meme_insert
+AFTER INSERT ON memes
+BEGIN
+    UPDATE analytics_counters SET value = value + 1 WHERE name = 'memes';
+
+    INSERT INTO analytics_breakdowns (dimension, value, count)
+    SELECT dimension, value, 1 FROM (
+        SELECT 'country' AS dimension, NEW.contributor_country AS value
+        UNION ALL SELECT 'platform', NEW.platform_found
+        UNION ALL SELECT 'humor_type', NEW.humor_type
+        UNION ALL SELECT 'context_level', NEW.context_level
+    ) WHERE value != ''
+    ON CONFLICT (dimension, value) DO UPDATE SET count = count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS aggregates_meme_delete
+AFTER DELETE ON memes
+BEGIN
+    UPDATE analytics_counters SET value = value - 1 WHERE name = 'memes';
+
+    UPDATE analytics_breakdowns SET count = count - 1
+    WHERE (dimension, value) IN (
+        VALUES ('country', OLD.contributor_country), ('platform', OLD.platform_found),
+               ('humor_type', OLD.humor_type), ('context_level', OLD.context_level)
+    );
+END;
+
+CREATE TRIGGER IF NOT EXISTS aggregates_meme_update
+AFTER UPDATE OF contributor_country, platform_found, humor_type, context_level ON memes
+BEGIN
+    UPDATE analytics_breakdowns SET count = count - 1
+    WHERE (dimension, value) IN (
+        VALUES ('country', OLD.contributor_country), ('platform', OLD.platform_found),
+               ('humor_type', OLD.humor_type), ('context_level', OLD.context_level)
+    );
+
+    INSERT INTO analytics_breakdowns (dimension, value, count)
+    SELECT dimension, value, 1 FROM (
+        SELECT 'country' AS dimension, NEW.contributor_country AS value
+        UNION ALL SELECT 'platform', NEW.platform_found
+        UNION ALL SELECT 'humor_type', NEW.humor_type
+        UNION ALL SELECT 'context_level', NEW.context_level
+    ) WHERE value != ''
+    ON CONFLICT (dimension, value) DO UPDATE SET count = count + 1;
+END;
+
+-- evaluations: totals, accuracy and distinct evaluators
+
+CREATE TRIGGER IF NOT EXISTS aggregates_evaluation_insert
+AFTER INSERT ON evaluations
+BEGIN
+    UPDATE analytics_counters SET value = value + CASE name
+        WHEN 'evaluations' THEN 1
+        WHEN 'judged_evaluations' THEN NEW.was_correct IS NOT NULL
+        WHEN 'correct_evaluations' THEN CASE WHEN NEW.was_correct THEN 1 ELSE 0 END
+    END
+    WHERE name IN ('evaluations', 'judged_evaluations', 'correct_evaluations');
+
+    INSERT INTO analytics_evaluator_sessions (session_id, evaluations)
+    SELECT NEW.session_id, 1 WHERE NEW.session_id IS NOT NULL
+    ON CONFLICT (session_id) DO UPDATE SET evaluations = evaluations + 1;
+
+    UPDATE analytics_counters SET value = value + 1
+    WHERE name = 'evaluators'
+    AND (SELECT evaluations FROM analytics_evaluator_sessions WHERE session_id = NEW.session_id) = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS aggregates_evaluation_delete
+AFTER DELETE ON evaluations
+BEGIN
+    UPDATE analytics_counters SET value = value - CASE name
+        WHEN 'evaluations' THEN 1
+        WHEN 'judged_evaluations' THEN OLD.was_correct IS NOT NULL
+        WHEN 'correct_evaluations' THEN CASE WHEN OLD.was_correct THEN 1 ELSE 0 END
+    END
+    WHERE name IN ('evaluations', 'judged_evaluations', 'correct_evaluations');
+
+    UPDATE analytics_evaluator_sessions SET evaluations = evaluations - 1 WHERE session_id = OLD.session_id;
+
+    UPDATE analytics_counters SET value = value - 1
+    WHERE name = 'evaluators'
+    AND (SELECT evaluations FROM analytics_evaluator_sessions WHERE session_id = OLD.session_id) = 0;
+
+    DELETE FROM analytics_evaluator_sessions WHERE session_id = OLD.session_id AND evaluations = 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS aggregates_evaluation_update_result
+AFTER UPDATE OF was_correct ON evaluations
+BEGIN
+    UPDATE analytics_counters SET value = value + CASE name
+        WHEN 'judged_evaluations' THEN (NEW.was_correct IS NOT NULL) - (OLD.was_correct IS NOT NULL)
+        WHEN 'correct_evaluations' THEN
+            CASE WHEN NEW.was_correct THEN 1 ELSE 0 END - CASE WHEN OLD.was_correct THEN 1 ELSE 0 END
+    END
+    WHERE name IN ('judged_evaluations', 'correct_evaluations');
+END;
+
+CREATE TRIGGER IF NOT EXISTS aggregates_evaluation_update_session
+AFTER UPDATE OF session_id ON evaluations
+WHEN NEW.session_id IS NOT OLD.session_id
+BEGIN
+    UPDATE analytics_evaluator_sessions SET evaluations = evaluations - 1 WHERE session_id = OLD.session_id;
+
+    UPDATE analytics_counters SET value = value - 1
+    WHERE name = 'evaluators'
+    AND (SELECT evaluations FROM analytics_evaluator_sessions WHERE session_id = OLD.session_id) = 0;
+
+    DELETE FROM analytics_evaluator_sessions WHERE session_id = OLD.session_id AND evaluations = 0;
+
+    INSERT INTO analytics_evaluator_sessions (session_id, evaluations)
+    SELECT NEW.session_id, 1 WHERE NEW.session_id IS NOT NULL
+    ON CONFLICT (session_id) DO UPDATE SET evaluations = evaluations + 1;
+
+    UPDATE analytics_counters SET value = value + 1
+    WHERE name = 'evaluators'
+    AND (SELECT evaluations FROM analytics_evaluator_sessions WHERE session_id = NEW.session_id) = 1;
+END;
+
+-- users: active registered contributors
+
+CREATE TRIGGER IF NOT EXISTS aggregates_user_insert
+AFTER INSERT ON users
+BEGIN
+    UPDATE analytics_counters SET value = value + (NEW.is_active IS 1) WHERE name = 'active_users';
+END;
+
+CREATE TRIGGER IF NOT EXISTS aggregates_user_delete
+AFTER DELETE ON users
+BEGIN
+    UPDATE analytics_counters SET value = value - (OLD.is_active IS 1) WHERE name = 'active_users';
+END;
+
+CREATE TRIGGER IF NOT EXISTS aggregates_user_update
+AFTER UPDATE OF is_active ON users
+BEGIN
+    UPDATE analytics_counters SET value = value + (NEW.is_active IS 1) - (OLD.is_active IS 1)
+    WHERE name = 'active_users';
+END;
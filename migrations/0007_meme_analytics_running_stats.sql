@@ -0,0 +1,80 @@
+-- Per-meme analytics maintained incrementally, see memeqa/meme_stats.py
+-- Evaluation triggers log signed deltas to meme_analytics_pending; a
+-- background job folds them into meme_analytics in batches.
+
+-- meme_analytics was only ever written by the legacy app and holds derived
+-- data: recompute it below rather than merge duplicate rows
+DELETE FROM meme_analytics;
+
+DROP INDEX IF EXISTS idx_meme_analytics_meme;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_meme_analytics_meme ON meme_analytics (meme_id);
+
+-- Evaluations with a was_correct verdict (accuracy_rate = correct_identifications / judged_evaluations)
+ALTER TABLE meme_analytics ADD COLUMN judged_evaluations INTEGER NOT NULL DEFAULT 0;
+-- Welford state of evaluation_time_seconds: count and sum of squared deviations from avg_evaluation_time
+ALTER TABLE meme_analytics ADD COLUMN timed_evaluations INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE meme_analytics ADD COLUMN evaluation_time_m2 REAL NOT NULL DEFAULT 0.0;
+
+-- Rank on judged evaluations: memes nobody was scored on have no accuracy yet
+DROP INDEX IF EXISTS idx_meme_analytics_accuracy;
+CREATE INDEX IF NOT EXISTS idx_meme_analytics_accuracy
+    ON meme_analytics (accuracy_rate) WHERE judged_evaluations >= 5;
+
+-- One row per evaluation added (sign 1) or taken away (sign -1)
+CREATE TABLE IF NOT EXISTS meme_analytics_pending (
+    id INTEGER PRIMARY KEY,
+    meme_id INTEGER NOT NULL,
+    sign INTEGER NOT NULL CHECK (sign IN (1, -1)),
+    was_correct BOOLEAN,
+    evaluation_time REAL
+);
+
+CREATE TRIGGER IF NOT EXISTS meme_stats_evaluation_insert
+AFTER INSERT ON evaluations
+BEGIN
+    INSERT INTO meme_analytics_pending (meme_id, sign, was_correct, evaluation_time)
+    VALUES (NEW.meme_id, 1, NEW.was_correct, NEW.evaluation_time_seconds);
+END;
+
+CREATE TRIGGER IF NOT EXISTS meme_stats_evaluation_delete
+AFTER DELETE ON evaluations
+BEGIN
+    INSERT INTO meme_analytics_pending (meme_id, sign, was_correct, evaluation_time)
+    VALUES (OLD.meme_id, -1, OLD.was_correct, OLD.evaluation_time_seconds);
+END;
+
+CREATE TRIGGER IF NOT EXISTS meme_stats_evaluation_update
+AFTER UPDATE OF meme_id, was_correct, evaluation_time_seconds ON evaluations
+WHEN NEW.meme_id IS NOT OLD.meme_id
+  OR NEW.was_correct IS NOT OLD.was_correct
+  OR NEW.evaluation_time_seconds IS NOT OLD.evaluation_time_seconds
+BEGIN
+    INSERT INTO meme_analytics_pending (meme_id, sign, was_correct, evaluation_time)
+    VALUES (OLD.meme_id, -1, OLD.was_correct, OLD.evaluation_time_seconds),
+           (NEW.meme_id, 1, NEW.was_correct, NEW.evaluation_time_seconds);
+END;
+
+-- Initial fill (the same statement as memeqa.meme_stats.REBUILD_SQL)
+INSERT INTO meme_analytics (
+    meme_id, total_evaluations, judged_evaluations, correct_identifications, accuracy_rate,
+    difficulty_score, timed_evaluations, avg_evaluation_time, evaluation_time_m2
+)
+SELECT meme_id,
+       COUNT(*),
+       COUNT(was_correct),
+       COUNT(CASE WHEN was_correct THEN 1 END),
+       COALESCE(AVG(CASE WHEN was_correct THEN 1.0 WHEN was_correct IS NOT NULL THEN 0.0 END), 0.0),
+       COALESCE(1.0 - AVG(CASE WHEN was_correct THEN 1.0 WHEN was_correct IS NOT NULL THEN 0.0 END), 0.0),
+       COUNT(t),
+       COALESCE(AVG(t), 0.0),
+       COALESCE(SUM((t - mean_t) * (t - mean_t)), 0.0)
+FROM (
+    SELECT meme_id, was_correct, t, AVG(t) OVER (PARTITION BY meme_id) AS mean_t
+    FROM (
+        SELECT meme_id, was_correct,
+               CASE WHEN typeof(evaluation_time_seconds) IN ('integer', 'real')
+                    THEN evaluation_time_seconds END AS t
+        FROM evaluations
+    )
+)
+GROUP BY meme_id;
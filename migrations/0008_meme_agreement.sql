@@ -0,0 +1,17 @@
+-- Agreement between evaluators and the uploader per meme, see memeqa/scoring.py
+CREATE TABLE IF NOT EXISTS meme_agreement (
+    meme_id INTEGER PRIMARY KEY,
+    coders INTEGER NOT NULL, -- the uploader plus every evaluator
+    -- Mean over evaluations of the overlap with the uploader's labels
+    humor_jaccard REAL,
+    humor_f1 REAL,
+    emotion_jaccard REAL,
+    emotion_f1 REAL,
+    -- Krippendorff's alpha among all coders, each label a binary unit
+    humor_alpha REAL,
+    emotion_alpha REAL,
+    -- Share of evaluators choosing the uploader's context level
+    context_agreement REAL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (meme_id) REFERENCES memes (id) ON DELETE CASCADE
+);
@@ -0,0 +1,146 @@
+-- Change tracking for delta exports, see memeqa/export.py
+-- Every row of an exported table that is inserted, updated or deleted gets
+-- a fresh seq here (its previous entry is dropped), so the log holds one
+-- entry per changed row and `seq > watermark` lists exactly what changed.
+
+CREATE TABLE IF NOT EXISTS change_log (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT, -- never reused, so watermarks stay valid
+    table_name TEXT NOT NULL, -- 'memes', 'evaluations' or 'users'
+    row_id INTEGER NOT NULL,
+    op TEXT NOT NULL CHECK (op IN ('upsert', 'delete')),
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_change_log_row ON change_log (table_name, row_id);
+CREATE INDEX IF NOT EXISTS idx_change_log_table_seq ON change_log (table_name, seq);
+
+-- Existing rows enter the log in the order they last changed
+INSERT INTO change_log (table_name, row_id, op, changed_at)
+SELECT 'memes', id, 'upsert', COALESCE(last_modified, upload_date) FROM memes
+ORDER BY COALESCE(last_modified, upload_date), id;
+
+INSERT INTO change_log (table_name, row_id, op, changed_at)
+SELECT 'evaluations', id, 'upsert', evaluation_date FROM evaluations
+ORDER BY evaluation_date, id;
+
+INSERT INTO change_log (table_name, row_id, op, changed_at)
+SELECT 'users', id, 'upsert', registration_date FROM users
+ORDER BY registration_date, id;
+
+-- memes (last_modified is kept current as well). Exported evaluation rows
+-- repeat their meme's labels, so those change along with the meme.
+
+CREATE TRIGGER IF NOT EXISTS change_log_meme_insert
+AFTER INSERT ON memes
+BEGIN
+    DELETE FROM change_log WHERE table_name = 'memes' AND row_id = NEW.id;
+    INSERT INTO change_log (table_name, row_id, op) VALUES ('memes', NEW.id, 'upsert');
+END;
+
+CREATE TRIGGER IF NOT EXISTS change_log_meme_update
+AFTER UPDATE OF filename, original_filename, contributor_name, contributor_country, platform_found,
+                user_id, languages, humor_type, emotions_conveyed, context_level, likes ON memes
+BEGIN
+    UPDATE memes SET last_modified = CURRENT_TIMESTAMP WHERE id = NEW.id;
+    DELETE FROM change_log WHERE table_name = 'memes' AND row_id = NEW.id;
+    INSERT INTO change_log (table_name, row_id, op) VALUES ('memes', NEW.id, 'upsert');
+END;
+
+CREATE TRIGGER IF NOT EXISTS change_log_meme_labels_update
+AFTER UPDATE OF humor_type, emotions_conveyed, context_level ON memes
+BEGIN
+    DELETE FROM change_log WHERE table_name = 'evaluations'
+    AND row_id IN (SELECT id FROM evaluations WHERE meme_id = NEW.id);
+    INSERT INTO change_log (table_name, row_id, op)
+    SELECT 'evaluations', id, 'upsert' FROM evaluations WHERE meme_id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS change_log_meme_delete
+AFTER DELETE ON memes
+BEGIN
+    DELETE FROM change_log WHERE table_name = 'memes' AND row_id = OLD.id;
+    INSERT INTO change_log (table_name, row_id, op) VALUES ('memes', OLD.id, 'delete');
+
+    -- Evaluations are only exported with their meme
+    DELETE FROM change_log WHERE table_name = 'evaluations'
+    AND row_id IN (SELECT id FROM evaluations WHERE meme_id = OLD.id);
+    INSERT INTO change_log (table_name, row_id, op)
+    SELECT 'evaluations', id, 'delete' FROM evaluations WHERE meme_id = OLD.id;
+END;
+
+-- Exported meme rows carry their analytics and agreement columns
+
+CREATE TRIGGER IF NOT EXISTS change_log_meme_analytics_insert
+AFTER INSERT ON meme_analytics
+BEGIN
+    DELETE FROM change_log WHERE table_name = 'memes' AND row_id = NEW.meme_id;
+    INSERT INTO change_log (table_name, row_id, op) VALUES ('memes', NEW.meme_id, 'upsert');
+END;
+
+CREATE TRIGGER IF NOT EXISTS change_log_meme_analytics_update
+AFTER UPDATE OF total_evaluations, accuracy_rate, difficulty_score, avg_evaluation_time ON meme_analytics
+BEGIN
+    DELETE FROM change_log WHERE table_name = 'memes' AND row_id = NEW.meme_id;
+    INSERT INTO change_log (table_name, row_id, op) VALUES ('memes', NEW.meme_id, 'upsert');
+END;
+
+CREATE TRIGGER IF NOT EXISTS change_log_meme_agreement_insert
+AFTER INSERT ON meme_agreement
+BEGIN
+    DELETE FROM change_log WHERE table_name = 'memes' AND row_id = NEW.meme_id;
+    INSERT INTO change_log (table_name, row_id, op) VALUES ('memes', NEW.meme_id, 'upsert');
+END;
+
+CREATE TRIGGER IF NOT EXISTS change_log_meme_agreement_update
+AFTER UPDATE OF humor_jaccard, emotion_jaccard, humor_alpha, emotion_alpha, context_agreement ON meme_agreement
+BEGIN
+    DELETE FROM change_log WHERE table_name = 'memes' AND row_id = NEW.meme_id;
+    INSERT INTO change_log (table_name, row_id, op) VALUES ('memes', NEW.meme_id, 'upsert');
+END;
+
+-- evaluations
+
+CREATE TRIGGER IF NOT EXISTS change_log_evaluation_insert
+AFTER INSERT ON evaluations
+BEGIN
+    DELETE FROM change_log WHERE table_name = 'evaluations' AND row_id = NEW.id;
+    INSERT INTO change_log (table_name, row_id, op) VALUES ('evaluations', NEW.id, 'upsert');
+END;
+
+CREATE TRIGGER IF NOT EXISTS change_log_evaluation_update
+AFTER UPDATE ON evaluations
+BEGIN
+    DELETE FROM change_log WHERE table_name = 'evaluations' AND row_id = NEW.id;
+    INSERT INTO change_log (table_name, row_id, op) VALUES ('evaluations', NEW.id, 'upsert');
+END;
+
+CREATE TRIGGER IF NOT EXISTS change_log_evaluation_delete
+AFTER DELETE ON evaluations
+BEGIN
+    DELETE FROM change_log WHERE table_name = 'evaluations' AND row_id = OLD.id;
+    INSERT INTO change_log (table_name, row_id, op) VALUES ('evaluations', OLD.id, 'delete');
+END;
+
+-- users: only the anonymized columns that are exported (logins do not count)
+
+CREATE TRIGGER IF NOT EXISTS change_log_user_insert
+AFTER INSERT ON users
+BEGIN
+    DELETE FROM change_log WHERE table_name = 'users' AND row_id = NEW.id;
+    INSERT INTO change_log (table_name, row_id, op) VALUES ('users', NEW.id, 'upsert');
+END;
+
+CREATE TRIGGER IF NOT EXISTS change_log_user_update
+AFTER UPDATE OF country, research_interest, total_submissions, total_evaluations,
+                evaluation_accuracy, is_active ON users
+BEGIN
+    DELETE FROM change_log WHERE table_name = 'users' AND row_id = NEW.id;
+    INSERT INTO change_log (table_name, row_id, op) VALUES ('users', NEW.id, 'upsert');
+END;
+
+CREATE TRIGGER IF NOT EXISTS change_log_user_delete
+AFTER DELETE ON users
+BEGIN
+    DELETE FROM change_log WHERE table_name = 'users' AND row_id = OLD.id;
+    INSERT INTO change_log (table_name, row_id, op) VALUES ('users', OLD.id, 'delete');
+END;
@@ -0,0 +1,19 @@
+-- Outgoing email, queued by requests and delivered by memeqa/mailer.py
+CREATE TABLE IF NOT EXISTS email_outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    to_email TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'sending', 'sent', 'failed')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 6,
+    run_after TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    locked_at TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    sent_at TIMESTAMP
+);
+
+-- Next batch to send: queued and due, oldest first; stale sending rows by lock time
+CREATE INDEX IF NOT EXISTS idx_email_outbox_status_run_after ON email_outbox (status, run_after);
+CREATE INDEX IF NOT EXISTS idx_email_outbox_status_locked_at ON email_outbox (status, locked_at);
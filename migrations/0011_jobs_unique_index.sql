@@ -0,0 +1,3 @@
+-- enqueue(unique=True) looks for a waiting job of the same kind and payload
+-- (memeqa/jobs.py); only queued jobs are indexed, so the index stays small
+CREATE INDEX IF NOT EXISTS idx_jobs_queued_kind_payload ON jobs (kind, payload) WHERE status = 'queued';
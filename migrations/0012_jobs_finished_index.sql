@@ -0,0 +1,2 @@
+-- Finished jobs past JOB_RETENTION_SECONDS are deleted by memeqa/jobs.py
+CREATE INDEX IF NOT EXISTS idx_jobs_status_finished_at ON jobs (status, finished_at);
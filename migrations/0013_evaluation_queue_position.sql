@@ -0,0 +1,3 @@
+-- Where each actor is in its shuffled evaluation queue, see pick_pair() in
+-- memeqa/evaluation_queue.py; NULL until the first pick
+ALTER TABLE evaluation_queue_actors ADD COLUMN last_sort_key INTEGER;
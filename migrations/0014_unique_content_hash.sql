@@ -0,0 +1,11 @@
+-- One meme per content hash, so concurrent uploads of the same bytes cannot
+-- both pass the duplicate check in upload_file (memeqa/routes/memes.py).
+-- Copies fingerprinted before this migration keep their rows; only the
+-- oldest keeps the hash (backfill-fingerprints reports the others).
+UPDATE memes SET content_hash = NULL
+WHERE content_hash IS NOT NULL
+  AND id > (SELECT MIN(first.id) FROM memes AS first WHERE first.content_hash = memes.content_hash);
+
+DROP INDEX IF EXISTS idx_memes_content_hash;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_memes_content_hash ON memes (content_hash)
+    WHERE content_hash IS NOT NULL;
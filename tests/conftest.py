@@ -0,0 +1,31 @@
+# tests/conftest.py
+import pytest
+
+from config import Config
+from memeqa import create_app
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """An app on a fresh, migrated database with no background job threads"""
+    settings = {
+        'DATABASE_PATH': str(tmp_path / 'memes.db'),
+        'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+        'JOB_WORKERS': 0,
+        'AUTO_MIGRATE': True,
+        'DEVELOPMENT': False,
+        'DEBUG': False,
+        'TESTING': True,
+    }
+    for name, value in settings.items():
+        monkeypatch.setattr(Config, name, value, raising=False)
+    app = create_app()
+    with app.app_context():
+        yield app
+
+
+@pytest.fixture
+def db(app):
+    from memeqa.database import get_db
+
+    return get_db()
@@ -0,0 +1,54 @@
+# tests/test_aggregates.py
+from memeqa import aggregates
+
+
+def add_meme(db, country='Germany', platform='Reddit', humor_type='["Wholesome"]'):
+    return db.execute('''
+        INSERT INTO memes (filename, original_filename, contributor_country, platform_found, session_id,
+                           languages, humor_type, emotions_conveyed, context_level)
+        VALUES ('a.jpg', 'a.jpg', ?, ?, 'uploader', '[]', ?, '[]', 'Universal')
+    ''', (country, platform, humor_type)).lastrowid
+
+
+def add_evaluation(db, meme_id, session_id, was_correct=None):
+    return db.execute('''
+        INSERT INTO evaluations (session_id, meme_id, evaluated_context_level, was_correct)
+        VALUES (?, ?, 'None', ?)
+    ''', (session_id, meme_id, was_correct)).lastrowid
+
+
+def snapshot(db):
+    sessions = db.execute('SELECT session_id, evaluations FROM analytics_evaluator_sessions ORDER BY session_id')
+    return aggregates.counters(db), aggregates.breakdowns(db), [tuple(row) for row in sessions]
+
+
+def test_triggers_match_a_rebuild(db):
+    first = add_meme(db)
+    second = add_meme(db, country='Spain', platform='Imgur')
+    third = add_meme(db, humor_type='["Absurdist"]')
+    db.execute('''
+        INSERT INTO users (name, email, country, languages, birth_year, is_active)
+        VALUES ('A', 'a@example.org', 'Germany', '[]', 1990, 1), ('B', 'b@example.org', 'Spain', '[]', 1990, 0)
+    ''')
+    add_evaluation(db, first, 'session-1', 1)
+    add_evaluation(db, first, 'session-2', 0)
+    add_evaluation(db, second, 'session-1')
+    moved = add_evaluation(db, second, 'session-3', 1)
+    dropped = add_evaluation(db, third, 'session-4', 1)
+
+    # Every kind of write the triggers follow
+    db.execute("UPDATE evaluations SET was_correct = 1 WHERE meme_id = ? AND session_id = 'session-1'", (second,))
+    db.execute("UPDATE evaluations SET session_id = 'session-2' WHERE id = ?", (moved,))
+    db.execute('DELETE FROM evaluations WHERE id = ?', (dropped,))
+    db.execute("UPDATE memes SET platform_found = 'Reddit', humor_type = '[\"Dark\"]' WHERE id = ?", (second,))
+    db.execute('DELETE FROM memes WHERE id = ?', (third,))
+    db.execute("UPDATE users SET is_active = 1 WHERE email = 'b@example.org'")
+    db.commit()
+
+    maintained = snapshot(db)
+    assert maintained[0] == {
+        'memes': 2, 'evaluations': 4, 'judged_evaluations': 4, 'correct_evaluations': 3,
+        'evaluators': 2, 'active_users': 2,
+    }
+    aggregates.rebuild(db)
+    assert snapshot(db) == maintained
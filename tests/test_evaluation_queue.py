@@ -0,0 +1,50 @@
+# tests/test_evaluation_queue.py
+import sqlite3
+
+from memeqa import evaluation_queue
+
+
+def add_memes(db, count, user_id=None, session_id='uploader'):
+    db.executemany('''
+        INSERT INTO memes (filename, original_filename, contributor_country, platform_found, session_id, user_id,
+                           languages, humor_type, emotions_conveyed, context_level)
+        VALUES (?, ?, 'Germany', 'Reddit', ?, ?, '["English"]', '["Wholesome"]', '["Joy"]', 'None')
+    ''', [(f'{i}.jpg', f'{i}.jpg', session_id, user_id) for i in range(count)])
+    db.commit()
+
+
+def test_picking_from_a_built_queue_leaves_no_write_transaction(app, db):
+    add_memes(db, 3)
+    assert evaluation_queue.pick_pair(db, None, 'visitor') is not None
+    assert not db.in_transaction
+    assert evaluation_queue.pick_pair(db, None, 'visitor') is not None
+    assert not db.in_transaction
+
+    # Another connection can still write
+    other = sqlite3.connect(app.config['DATABASE_PATH'], timeout=0)
+    try:
+        other.execute("UPDATE memes SET likes = likes + 1 WHERE id = 1")
+        other.commit()
+    finally:
+        other.close()
+
+
+def test_every_pair_comes_up_once_per_round(app, db):
+    add_memes(db, 20)
+    first_round = [evaluation_queue.pick_pair(db, None, 'visitor') for _ in range(20)]
+    assert len(set(first_round)) == 20
+
+    counts = {}
+    for _ in range(180):
+        pair = evaluation_queue.pick_pair(db, None, 'visitor')
+        counts[pair] = counts.get(pair, 0) + 1
+    assert set(counts.values()) == {9}
+
+
+def test_actors_get_different_orders(app, db):
+    add_memes(db, 20)
+    orders = {
+        tuple(evaluation_queue.pick_pair(db, None, f'visitor{i}') for _ in range(20))
+        for i in range(5)
+    }
+    assert len(orders) == 5
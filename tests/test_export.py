@@ -0,0 +1,99 @@
+# tests/test_export.py
+import json
+
+import pytest
+
+from test_release import add_meme
+
+
+@pytest.fixture
+def client(app):
+    app.config['DEVELOPMENT'] = True  # /export_data is for researchers only
+    return app.test_client()
+
+
+def export_lines(client, **args):
+    response = client.get('/export_data', query_string=args)
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_export_leaves_out_contributor_names(client, db):
+    add_meme(db, contributor_name='Alice Example')
+    response = client.get('/export_data')
+    assert 'Alice Example' not in response.get_data(as_text=True)
+    (meme,) = [line['row'] for line in export_lines(client)[1:] if line['table'] == 'memes']
+    assert 'contributor_name' not in meme
+
+
+def test_export_pseudonymizes_session_ids(client, db):
+    add_meme(db)
+    first = [line['session_id'] for line in export_lines(client, table='evaluations')]
+    second = [line['session_id'] for line in export_lines(client, table='evaluations')]
+    assert len(set(first)) == 2
+    assert not {'session-1', 'session-2'} & set(first)
+    assert first == second  # stable, so deltas line up with earlier dumps
+
+    csv_text = client.get('/export_data', query_string={'table': 'evaluations', 'format': 'csv'}).get_data(as_text=True)
+    assert 'session-1' not in csv_text and first[0] in csv_text
+
+
+def test_cli_export_is_anonymized(app, db, tmp_path):
+    add_meme(db, contributor_name='Alice Example')
+    result = app.test_cli_runner().invoke(args=['export-data', '--out', str(tmp_path / 'export')])
+    assert result.exit_code == 0, result.output
+    assert 'Alice Example' not in (tmp_path / 'export' / 'memes.ndjson').read_text()
+    assert 'session-1' not in (tmp_path / 'export' / 'evaluations.ndjson').read_text()
+
+
+def change_seqs(db, table_name):
+    rows = db.execute('SELECT row_id, seq FROM change_log WHERE table_name = ?', (table_name,))
+    return dict(rows.fetchall())
+
+
+def test_label_update_gives_evaluations_new_seqs(db):
+    meme_id = add_meme(db)
+    other = add_meme(db)
+    before = change_seqs(db, 'evaluations')
+    watermark = db.execute('SELECT MAX(seq) FROM change_log').fetchone()[0]
+
+    db.execute('''UPDATE memes SET humor_type = '["Dark"]' WHERE id = ?''', (meme_id,))
+    db.commit()
+    after = change_seqs(db, 'evaluations')
+
+    relabeled = {row[0] for row in db.execute('SELECT id FROM evaluations WHERE meme_id = ?', (meme_id,))}
+    assert len(relabeled) == 2
+    assert all(after[id] > watermark for id in relabeled)
+    assert {id: seq for id, seq in after.items() if id not in relabeled} == \
+        {id: seq for id, seq in before.items() if id not in relabeled}
+    assert change_seqs(db, 'memes')[meme_id] > watermark
+    assert change_seqs(db, 'memes')[other] <= watermark
+
+
+def test_delta_export_returns_only_changed_rows(client, db):
+    changed, unchanged, deleted = add_meme(db), add_meme(db), add_meme(db)
+    evaluations = {
+        meme_id: {('evaluations', row[0]) for row in db.execute('SELECT id FROM evaluations WHERE meme_id = ?', (meme_id,))}
+        for meme_id in (changed, deleted)
+    }
+    response = client.get('/export_data')
+    watermark = int(response.headers['X-Export-Watermark'])
+
+    db.execute('''UPDATE memes SET humor_type = '["Dark"]' WHERE id = ?''', (changed,))
+    db.execute('DELETE FROM evaluations WHERE meme_id = ?', (deleted,))
+    db.execute('DELETE FROM memes WHERE id = ?', (deleted,))
+    db.commit()
+
+    header, *lines = export_lines(client, since=watermark)
+    assert header['since'] == watermark and header['watermark'] > watermark
+    assert all(line['seq'] > watermark for line in lines)
+    upserts = {(line['table'], line['row']['id']) for line in lines if line['op'] == 'upsert'}
+    tombstones = {(line['table'], line['id']) for line in lines if line['op'] == 'delete'}
+    assert upserts == {('memes', changed)} | evaluations[changed]  # nothing about `unchanged`
+    assert tombstones == {('memes', deleted)} | evaluations[deleted]
+    assert len(lines) == len(upserts) + len(tombstones)
+    assert all(line['row']['humor_type'] == ['Dark'] for line in lines
+               if line['op'] == 'upsert' and line['table'] == 'evaluations')
+
+    header, *lines = export_lines(client, since=header['watermark'])
+    assert lines == []
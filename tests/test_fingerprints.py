@@ -0,0 +1,83 @@
+# tests/test_fingerprints.py
+import io
+import os
+import shutil
+import sqlite3
+
+import pytest
+from PIL import Image
+
+from memeqa import fingerprints
+from memeqa.migrations import MIGRATIONS_DIR, migrate
+
+
+def add_meme(db, content_hash):
+    return db.execute('''
+        INSERT INTO memes (filename, original_filename, contributor_country, platform_found, session_id,
+                           languages, humor_type, emotions_conveyed, context_level, content_hash)
+        VALUES ('a.jpg', 'a.jpg', 'Germany', 'Reddit', 'uploader', '[]', '[]', '[]', 'None', ?)
+    ''', (content_hash,)).lastrowid
+
+
+def png_bytes():
+    buffer = io.BytesIO()
+    Image.new('RGB', (32, 32), (200, 30, 30)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def upload(client, data):
+    return client.post('/memes/upload', content_type='multipart/form-data', data={
+        'file': (io.BytesIO(data), 'meme.png'),
+        'platform_found': 'Reddit',
+        'languages': 'English',
+        'humors[]': 'Irony/Sarcasm',
+        'emotions[]': 'Joy',
+        'context_level': 'Universal',
+        'terms_agreement': 'on',
+        'contributor_country': 'Germany',
+        'birth_year': '1990',
+    })
+
+
+def test_content_hash_is_unique(db):
+    add_meme(db, 'a' * 64)
+    add_meme(db, None)
+    add_meme(db, None)  # unfingerprinted memes do not collide
+    with pytest.raises(sqlite3.IntegrityError):
+        add_meme(db, 'a' * 64)
+
+
+def test_migration_keeps_the_oldest_copy_hashed(tmp_path):
+    older = tmp_path / 'migrations'
+    older.mkdir()
+    for filename in os.listdir(MIGRATIONS_DIR):
+        if filename.endswith('.sql') and int(filename.split('_')[0]) < 14:
+            shutil.copy(os.path.join(MIGRATIONS_DIR, filename), older)
+    db = sqlite3.connect(tmp_path / 'memes.db')
+    migrate(db, str(older))
+    first, copy, other = add_meme(db, 'a' * 64), add_meme(db, 'a' * 64), add_meme(db, 'b' * 64)
+    db.commit()
+
+    migrate(db)
+    hashes = dict(db.execute('SELECT id, content_hash FROM memes').fetchall())
+    assert hashes == {first: 'a' * 64, copy: None, other: 'b' * 64}
+
+
+def test_concurrent_duplicate_upload_is_refused(app, db, monkeypatch):
+    client = app.test_client()
+    data = png_bytes()
+    # Another request inserted the same bytes after this one's duplicate check
+    add_meme(db, fingerprints.hashlib.sha256(data).hexdigest())
+    db.commit()
+    find_duplicate, checks = fingerprints.find_duplicate, []
+
+    def find_duplicate_after_check(db, content_hash):
+        checks.append(content_hash)
+        return find_duplicate(db, content_hash) if len(checks) > 1 else None
+
+    monkeypatch.setattr(fingerprints, 'find_duplicate', find_duplicate_after_check)
+
+    response = upload(client, data)
+    assert response.status_code == 200
+    assert 'already been uploaded' in response.get_data(as_text=True)
+    assert db.execute('SELECT COUNT(*) FROM memes').fetchone()[0] == 1
@@ -0,0 +1,44 @@
+# tests/test_jobs.py
+from memeqa import jobs
+
+
+def queued(db, kind):
+    return db.execute("SELECT payload FROM jobs WHERE status = 'queued' AND kind = ? ORDER BY id", (kind,)).fetchall()
+
+
+def test_unique_jobs_collapse_per_payload(app, db):
+    first = jobs.enqueue(db, 'scoring.meme', {'meme_id': 1}, unique=True)
+    assert first is not None
+    assert jobs.enqueue(db, 'scoring.meme', {'meme_id': 1}, unique=True) is None
+    assert jobs.enqueue(db, 'scoring.meme', {'meme_id': 2}, unique=True) is not None
+    db.commit()
+    assert [row['payload'] for row in queued(db, 'scoring.meme')] == ['{"meme_id": 1}', '{"meme_id": 2}']
+
+
+def test_unique_job_queues_again_once_claimed(app, db):
+    jobs.enqueue(db, 'scoring.meme', {'meme_id': 1}, unique=True)
+    db.commit()
+    assert jobs.claim(db, 'test') is not None
+    assert jobs.enqueue(db, 'scoring.meme', {'meme_id': 1}, unique=True) is not None
+
+
+def test_purge_finished_keeps_recent_and_pending_jobs(app, db):
+    db.executemany('''
+        INSERT INTO jobs (kind, status, finished_at) VALUES ('scoring.meme', ?, datetime('now', ?))
+    ''', [('done', '-8 days'), ('failed', '-8 days'), ('done', '-1 hours'), ('queued', '-8 days')])
+    db.commit()
+    assert jobs.purge_finished(db, 7 * 24 * 60 * 60) == 2
+    assert sorted(row['status'] for row in db.execute('SELECT status FROM jobs')) == ['done', 'queued']
+
+
+def test_job_status_is_for_development_only(app, db):
+    job_id = jobs.enqueue(db, 'scoring.meme', {'meme_id': 1})
+    db.commit()
+    client = app.test_client()
+    assert client.get(f'/jobs/{job_id}').status_code == 403
+
+    app.config['DEVELOPMENT'] = True
+    response = client.get(f'/jobs/{job_id}')
+    assert response.status_code == 200
+    assert response.get_json()['kind'] == 'scoring.meme'
+    assert client.get(f'/jobs/{job_id + 1}').status_code == 404
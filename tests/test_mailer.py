@@ -0,0 +1,127 @@
+# tests/test_mailer.py
+import socket
+from datetime import datetime, timezone
+
+import pytest
+
+aiosmtpd_controller = pytest.importorskip('aiosmtpd.controller')
+
+from memeqa import mailer  # noqa: E402
+
+
+class Recorder:
+    """aiosmtpd handler keeping every session and delivered message, and
+    refusing recipients whose address names an SMTP reply, e.g. 451@example.com"""
+
+    def __init__(self):
+        self.sessions = []
+        self.messages = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if session not in self.sessions:
+            self.sessions.append(session)
+        code = address.split('@')[0]
+        if code.isdigit():
+            return f'{code} refused for the test'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append((session, envelope.rcpt_tos))
+        return '250 Message accepted'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def smtp(app, monkeypatch):
+    handler = Recorder()
+    controller = aiosmtpd_controller.Controller(handler, hostname='127.0.0.1', port=free_port())
+    controller.start()
+    app.config.update(
+        MAIL_SMTP_HOST='127.0.0.1', MAIL_SMTP_PORT=controller.port, MAIL_SMTP_STARTTLS=False,
+        MAIL_USERNAME=None, MAIL_PASSWORD=None, MAIL_SENDER='noreply@example.com',
+        MAIL_RETRY_BASE_SECONDS=60, MAIL_RETRY_MAX_SECONDS=3600, MAIL_MAX_ATTEMPTS=6,
+    )
+    monkeypatch.setattr(mailer, '_connections', {})
+    yield handler
+    for connection in mailer._connections.values():
+        connection.close()
+    controller.stop()
+
+
+def outbox(db, message_id):
+    return db.execute('SELECT * FROM email_outbox WHERE id = ?', (message_id,)).fetchone()
+
+
+def seconds_until(row):
+    return (row['run_after'] - datetime.now(timezone.utc).replace(tzinfo=None)).total_seconds()
+
+
+def make_due(db, message_id):
+    db.execute("UPDATE email_outbox SET run_after = datetime('now', '-1 seconds') WHERE id = ?", (message_id,))
+    db.commit()
+
+
+def test_batch_goes_over_one_session(app, db, smtp):
+    ids = [mailer.queue_email(db, f'user{i}@example.com', 'Hello', 'Body') for i in range(5)]
+    db.commit()
+
+    assert mailer.flush_outbox(db, app.config) == 5
+    assert len(smtp.messages) == 5
+    assert len(smtp.sessions) == 1
+    assert mailer.get_connection(app.config).opened == 1
+    assert {outbox(db, message_id)['status'] for message_id in ids} == {'sent'}
+
+    # The next batch reuses the open session
+    mailer.queue_email(db, 'later@example.com', 'Hello', 'Body')
+    db.commit()
+    assert mailer.flush_outbox(db, app.config) == 1
+    assert len(smtp.sessions) == 1
+
+
+def test_temporary_failure_is_retried_with_backoff(app, db, smtp):
+    message_id = mailer.queue_email(db, '451@example.com', 'Hello', 'Body')
+    ok_id = mailer.queue_email(db, 'ok@example.com', 'Hello', 'Body')
+    db.commit()
+
+    mailer.flush_outbox(db, app.config)
+    row = outbox(db, message_id)
+    assert row['status'] == 'queued' and row['attempts'] == 1
+    assert '451' in row['last_error']
+    assert 60 * 0.5 - 2 <= seconds_until(row) <= 60 + 1
+    # The rest of the batch still went out over the same session
+    assert outbox(db, ok_id)['status'] == 'sent'
+    assert len(smtp.sessions) == 1
+
+    assert mailer.flush_outbox(db, app.config) == 0  # not due yet
+    make_due(db, message_id)
+    mailer.flush_outbox(db, app.config)
+    row = outbox(db, message_id)
+    assert row['status'] == 'queued' and row['attempts'] == 2
+    assert 120 * 0.5 - 2 <= seconds_until(row) <= 120 + 1
+
+
+def test_temporary_failure_gives_up_after_max_attempts(app, db, smtp):
+    app.config['MAIL_MAX_ATTEMPTS'] = 2
+    message_id = mailer.queue_email(db, '421@example.com', 'Hello', 'Body')
+    db.commit()
+    mailer.flush_outbox(db, app.config)
+    make_due(db, message_id)
+    mailer.flush_outbox(db, app.config)
+    assert outbox(db, message_id)['status'] == 'failed'
+
+
+def test_permanent_failure_is_not_retried(app, db, smtp):
+    message_id = mailer.queue_email(db, '550@example.com', 'Hello', 'Body')
+    db.commit()
+
+    mailer.flush_outbox(db, app.config)
+    row = outbox(db, message_id)
+    assert row['status'] == 'failed' and row['attempts'] == 1
+    assert '550' in row['last_error']
+    assert smtp.messages == []
@@ -0,0 +1,61 @@
+# tests/test_meme_stats.py
+import pytest
+
+from memeqa import meme_stats
+
+COLUMNS = ('meme_id', 'total_evaluations', 'judged_evaluations', 'correct_identifications', 'accuracy_rate',
+           'difficulty_score', 'timed_evaluations', 'avg_evaluation_time', 'evaluation_time_m2')
+
+
+def add_meme(db):
+    return db.execute('''
+        INSERT INTO memes (filename, original_filename, contributor_country, platform_found, session_id,
+                           languages, humor_type, emotions_conveyed, context_level)
+        VALUES ('a.jpg', 'a.jpg', 'Germany', 'Reddit', 'uploader', '[]', '[]', '[]', 'None')
+    ''').lastrowid
+
+
+def add_evaluation(db, meme_id, session_id, was_correct, seconds):
+    return db.execute('''
+        INSERT INTO evaluations (session_id, meme_id, evaluated_context_level, was_correct, evaluation_time_seconds)
+        VALUES (?, ?, 'None', ?, ?)
+    ''', (session_id, meme_id, was_correct, seconds)).lastrowid
+
+
+def analytics(db):
+    rows = db.execute(f"SELECT {', '.join(COLUMNS)} FROM meme_analytics ORDER BY meme_id").fetchall()
+    return [dict(row) for row in rows]
+
+
+def fold_all(db):
+    while meme_stats.fold_pending(db, batch_size=3):
+        pass
+
+
+def test_folded_stats_match_a_recomputation(db):
+    first, second = add_meme(db), add_meme(db)
+    add_evaluation(db, first, 'session-1', 1, 12)
+    add_evaluation(db, first, 'session-2', 0, 30.5)
+    edited = add_evaluation(db, first, 'session-3', None, 7)
+    add_evaluation(db, second, 'session-1', 1, '')  # a blank time field counts as untimed
+    moved = add_evaluation(db, second, 'session-2', 1, 20)
+    deleted = add_evaluation(db, second, 'session-3', 0, 45)
+    db.commit()
+    fold_all(db)
+
+    db.execute('UPDATE evaluations SET was_correct = 1, evaluation_time_seconds = 9 WHERE id = ?', (edited,))
+    db.execute('UPDATE evaluations SET meme_id = ? WHERE id = ?', (first, moved))
+    db.execute('DELETE FROM evaluations WHERE id = ?', (deleted,))
+    add_evaluation(db, second, 'session-4', 0, 3)
+    db.commit()
+    fold_all(db)
+
+    folded = analytics(db)
+    assert db.execute('SELECT COUNT(*) FROM meme_analytics_pending').fetchone()[0] == 0
+    meme_stats.rebuild(db)
+    db.commit()
+    recomputed = analytics(db)
+
+    assert [row['meme_id'] for row in folded] == [first, second]
+    for row, expected in zip(folded, recomputed):
+        assert row == pytest.approx(expected)
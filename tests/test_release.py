@@ -0,0 +1,58 @@
+# tests/test_release.py
+import json
+
+
+def add_meme(db, contributor_name='Alice Example'):
+    meme_id = db.execute('''
+        INSERT INTO memes (filename, original_filename, contributor_name, contributor_country, platform_found,
+                           session_id, languages, humor_type, emotions_conveyed, context_level)
+        VALUES ('a.jpg', 'a.jpg', ?, 'Germany', 'Reddit', 'uploader', '["English"]', '["Wholesome"]', '["Joy"]', 'None')
+    ''', (contributor_name,)).lastrowid
+    for session_id in ('session-1', 'session-2'):
+        db.execute('''
+            INSERT INTO evaluations (session_id, meme_id, evaluated_context_level, evaluated_humor_type,
+                                     evaluated_emotions, evaluation_time_seconds)
+            VALUES (?, ?, 'None', '["Wholesome"]', '["Joy"]', 10)
+        ''', (session_id, meme_id))
+    db.commit()
+    return meme_id
+
+
+def read_ndjson(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def build(app, tmp_path, version):
+    result = app.test_cli_runner().invoke(args=[
+        'build-release', '--version', version, '--out', str(tmp_path / 'releases'),
+        '--compression', 'none', '--no-images',
+    ])
+    assert result.exit_code == 0, result.output
+    return tmp_path / 'releases' / f'memeqa-{version}'
+
+
+def test_release_is_anonymized(app, db, tmp_path):
+    add_meme(db)
+    release = build(app, tmp_path, '1.0')
+
+    memes = read_ndjson(release / 'data' / 'memes.ndjson')
+    assert len(memes) == 1
+    assert 'contributor_name' not in memes[0]
+    assert 'Alice Example' not in (release / 'data' / 'memes.ndjson').read_text()
+
+    evaluations = read_ndjson(release / 'data' / 'evaluations.ndjson')
+    sessions = [evaluation['session_id'] for evaluation in evaluations]
+    assert len(set(sessions)) == 2
+    assert not {'session-1', 'session-2'} & set(sessions)
+
+    manifest = json.loads((release / 'manifest.json').read_text())
+    assert manifest['anonymization']['dropped_columns'] == {'memes': ['contributor_name']}
+    assert manifest['anonymization']['pseudonymized_columns'] == {'evaluations': ['session_id']}
+
+
+def test_session_hashes_differ_between_releases(app, db, tmp_path):
+    add_meme(db)
+    first = read_ndjson(build(app, tmp_path, '1.0') / 'data' / 'evaluations.ndjson')
+    second = read_ndjson(build(app, tmp_path, '1.1') / 'data' / 'evaluations.ndjson')
+    assert first[0]['session_id'] != second[0]['session_id']
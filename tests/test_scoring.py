@@ -0,0 +1,50 @@
+# tests/test_scoring.py
+import json
+import random
+import subprocess
+import sys
+
+from memeqa import labels
+from memeqa import scoring
+
+
+def test_app_and_routes_do_not_import_numpy():
+    code = ('import sys, config; config.Config.JOB_WORKERS = 0; config.Config.AUTO_MIGRATE = False; '
+            'from memeqa import create_app; create_app(); print("numpy" in sys.modules)')
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+    assert output.strip() == 'False'
+
+
+def test_single_evaluation_scores_match_the_batch(app, db):
+    rnd = random.Random(3)
+    humor_types = [humor['type'] for humor in app.config['HUMOR_TYPES']][:4] + ['Unknown']
+    emotions = [emotion['emotion'] for emotion in app.config['EMOTIONS_TYPES']][:4]
+
+    def labels_value(vocabulary):
+        if rnd.random() < 0.1:
+            return '[]'
+        return json.dumps(rnd.sample(vocabulary, rnd.randint(1, 3)))
+
+    ids = []
+    for i in range(200):
+        meme_id = db.execute('''
+            INSERT INTO memes (filename, original_filename, contributor_country, platform_found, session_id,
+                               languages, humor_type, emotions_conveyed, context_level)
+            VALUES (?, ?, 'Germany', 'Reddit', 'uploader', '["English"]', ?, ?, 'None')
+        ''', (f'{i}.jpg', f'{i}.jpg', labels_value(humor_types), labels_value(emotions))).lastrowid
+        ids.append(db.execute('''
+            INSERT INTO evaluations (session_id, meme_id, evaluated_humor_type, evaluated_emotions,
+                                     evaluated_context_level)
+            VALUES ('evaluator', ?, ?, ?, 'None')
+        ''', (meme_id, labels_value(humor_types), labels_value(emotions))).lastrowid)
+
+    columns = 'SELECT id, matches_humor_type, emotion_overlap_score, was_correct FROM evaluations ORDER BY id'
+    scoring.score_evaluations(db, ids)
+    batch = [tuple(row) for row in db.execute(columns)]
+    db.execute('UPDATE evaluations SET matches_humor_type = NULL, emotion_overlap_score = NULL, was_correct = NULL')
+    for evaluation_id in ids:
+        labels.score_evaluation(db, evaluation_id)
+    single = [tuple(row) for row in db.execute(columns)]
+
+    assert single == batch
+    assert {row[3] for row in batch} == {None, 0, 1}
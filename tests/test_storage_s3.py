@@ -0,0 +1,91 @@
+# tests/test_storage_s3.py
+import os
+
+import pytest
+
+boto3 = pytest.importorskip('boto3')
+moto = pytest.importorskip('moto')
+
+from memeqa.storage import S3Storage  # noqa: E402
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def s3(tmp_path, monkeypatch):
+    for name, value in {'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing',
+                        'AWS_DEFAULT_REGION': 'us-east-1'}.items():
+        monkeypatch.setenv(name, value)
+    with moto.mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket='memes')
+        yield client
+
+
+@pytest.fixture
+def storage(s3, tmp_path):
+    # S3 rejects parts under 5MB, so this is the smallest multipart setup
+    return S3Storage(str(tmp_path / 'cache'), 'memes', prefix='up/', region='us-east-1',
+                     multipart_threshold=5 * MB, multipart_chunksize=5 * MB)
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return str(path)
+
+
+def test_put_file_uploads_large_files_in_parts(s3, storage, tmp_path):
+    data = os.urandom(11 * MB)
+    storage.put_file('ab/cd/big.png', write(tmp_path / 'incoming' / 'big.png', data))
+
+    head = s3.head_object(Bucket='memes', Key='up/ab/cd/big.png')
+    assert head['ETag'].strip('"').endswith('-3')  # three 5MB parts
+    assert head['ContentLength'] == len(data)
+    assert head['ContentType'] == 'image/png'
+    # The uploaded file stays behind as the cache entry
+    with open(storage.cache_path('ab/cd/big.png'), 'rb') as f:
+        assert f.read() == data
+
+
+def test_local_path_reads_through_the_cache(s3, storage):
+    s3.put_object(Bucket='memes', Key='up/ab/cd/a.png', Body=b'image')
+    path = storage.local_path('ab/cd/a.png')
+    assert path == storage.cache_path('ab/cd/a.png')
+    with open(path, 'rb') as f:
+        assert f.read() == b'image'
+
+    # Served from the cache once downloaded
+    s3.delete_object(Bucket='memes', Key='up/ab/cd/a.png')
+    assert storage.local_path('ab/cd/a.png') == path
+    assert not [name for name in os.listdir(os.path.dirname(path)) if name.endswith('.download')]
+
+    with pytest.raises(FileNotFoundError):
+        storage.local_path('ab/cd/missing.png')
+
+
+def test_exists_and_delete(s3, storage, tmp_path):
+    assert not storage.exists('ab/cd/a.png')
+    storage.put_file('ab/cd/a.png', write(tmp_path / 'incoming' / 'a.png', b'image'))
+    assert storage.exists('ab/cd/a.png')  # put_file forgets the cached miss
+
+    os.unlink(storage.cache_path('ab/cd/a.png'))
+    assert storage.exists('ab/cd/a.png')  # found in the bucket
+
+    storage.delete('ab/cd/a.png')
+    assert 'Contents' not in s3.list_objects_v2(Bucket='memes')
+    assert not storage.exists('ab/cd/a.png')
+
+
+def test_presigned_url_is_cached(storage):
+    url = storage.url('ab/cd/a.png')
+    assert 'up/ab/cd/a.png' in url and 'Signature' in url
+    assert storage.url('ab/cd/a.png') is url
+    assert storage.url('ab/cd/b.png') != url
+
+    storage._urls.clear()
+    assert storage.url('ab/cd/a.png') is not url
+
+    storage.presign_expires = 0
+    assert storage.url('ab/cd/a.png') is None